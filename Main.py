@@ -1,19 +1,14 @@
 import argparse
 from projects import ProjectName, Project
-from data_extractor import DataExtractor
-from version_selector import VersionType
 from config import Config
 import os
 import json
-from pathlib import Path
-import pandas as pd
-from metrics.version_metrics import Extractor
-from metrics.version_metrics_data import DataBuilder
 from metrics.version_metrics_name import DataNameEnum
-from classification_instance import ClassificationInstance
-from itertools import tee
-import time
 from functools import reduce
+# pandas, sklearn, git and jira are imported by the methods that use them, listing the projects imports none of them
+
+NUMERIC_DESCRIBE = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
 
 class Main():
     def __init__(self):
@@ -38,18 +33,23 @@ class Main():
         self.set_extractor()
 
     def set_extractor(self):
+        from data_extractor import DataExtractor
+        if self.extractor is not None:
+            self.extractor.close()
         self.extractor = DataExtractor(self.project, self.jira_url, self.github_user_name)
 
     def extract_metrics(self, rest_versions, rest_only, data_types):
-        classes_datasets = []
-        aggregated_classes_datasets = []
-        methods_datasets = []
+        from training_set import TrainingSet
         if not rest_only:
-            for version in self.extractor.get_selected_versions()[:-1]:
+            # every training version is appended to the on disk training sets as soon as it is extracted
+            classes_training = TrainingSet.create(self.get_training_set_path("classes"))
+            methods_training = TrainingSet.create(self.get_training_set_path("methods"))
+            versions = self.extractor.get_selected_versions()[:-1]
+            for version in versions[:-1]:
                 classes_df, methods_df, aggregated_classes_df = self.extract_features_to_version(version, True, data_types)
-                classes_datasets.append(classes_df)
-                methods_datasets.append(methods_df)
-                aggregated_classes_datasets.append(aggregated_classes_df)
+                classes_training.append(self.get_classes_training(aggregated_classes_df))
+                methods_training.append(self.get_methods_training(methods_df))
+            classes_testing, methods_testing, aggregated_classes_testing = self.extract_features_to_version(versions[-1], True, data_types)
         for version in rest_versions:
             try:
                 self.extract_features_to_version(version, False, data_types)
@@ -57,11 +57,15 @@ class Main():
                 pass
         if rest_only:
             return
-        self.extract_classes_datasets(aggregated_classes_datasets[:-1], aggregated_classes_datasets[-1]).predict()
-        # self.extract_classes_datasets(classes_datasets[:-1], classes_datasets[-1], "classes_no_aggregate").predict()
-        self.extract_methods_datasets(methods_datasets[:-1], methods_datasets[-1]).predict()
+        self.extract_classes_datasets(classes_training, aggregated_classes_testing).predict()
+        # self.extract_classes_datasets(classes_training, classes_testing, "classes_no_aggregate").predict()
+        self.extract_methods_datasets(methods_training, methods_testing).predict()
 
     def create_all_but_one_dataset(self, data_types):
+        import pandas as pd
+        from classification_instance import ClassificationInstance
+        from fingerprint import Fingerprint, StageStore
+        from training_set import TrainingSet
         alls = {}
         ones = {}
         detailed = {}
@@ -75,7 +79,10 @@ class Main():
             alls[d] = reduce(set.__or__, list(map(detailed.get, all_but_d)), set())
         for sub_dir, label in [("methods", "BuggedMethods"), ("classes", "Bugged")]:
             scores = []
-            training_df = pd.read_csv(os.path.join(self.get_dataset_path(sub_dir), "training.csv"), sep=';')
+            if TrainingSet.exists(self.get_training_set_path(sub_dir)):
+                training_df = TrainingSet(self.get_training_set_path(sub_dir))
+            else:
+                training_df = pd.read_csv(os.path.join(self.get_dataset_path(sub_dir), "training.csv"), sep=';')
             testing_df = pd.read_csv(os.path.join(self.get_dataset_path(sub_dir), "testing.csv"), sep=';')
             dataset_cols = set(training_df.columns.to_list()).intersection(set(testing_df.columns.to_list()))
             names = pd.read_csv(os.path.join(self.get_dataset_path(sub_dir), "prediction.csv"), sep=';')['name'].to_list()
@@ -85,66 +92,78 @@ class Main():
                     if len(cols) == 0:
                         continue
                     cols.add(label)
-                    cols = list(cols)
-                    train = training_df[cols]
+                    # sorted, so the same columns give the same fingerprint in every run
+                    cols = sorted(cols)
+                    train = training_df.select(cols) if isinstance(training_df, TrainingSet) else training_df[cols]
                     test = testing_df[cols]
-                    ci = ClassificationInstance(train, test, names, self.get_dataset_path(os.path.join(dir_name, sub_dir, d)), label=label)
-                    try:
-                        ci.predict()
-                        ci_scores = dict(ci.scores)
-                        ci_scores.update({"type": dir_name, "data_type": d})
-                        scores.append(ci_scores)
-                    except Exception as e:
-                        print(e)
+                    d_dir = self.get_dataset_path(os.path.join(dir_name, sub_dir, d))
+                    fingerprint = Fingerprint(train, test, names, label, ClassificationInstance.get_classifier(),
+                                              ClassificationInstance.get_code_fingerprint())
+                    stages = StageStore(os.path.join(d_dir, "stages"))
+                    ci_scores = stages.get("all_but_one", fingerprint)
+                    if ci_scores is None:
+                        ci = ClassificationInstance(train, test, names, d_dir, label=label)
+                        try:
+                            ci.predict()
+                            ci_scores = stages.put("all_but_one", fingerprint, dict(ci.scores))
+                        except Exception as e:
+                            print(e)
+                            continue
+                    ci_scores = dict(ci_scores)
+                    ci_scores.update({"type": dir_name, "data_type": d})
+                    scores.append(ci_scores)
             pd.DataFrame(scores).to_csv(self.get_dataset_path(sub_dir + "_metrics.csv", False), index=False, sep=';')
 
     def get_data_dirs(self):
-        classes_data = Config.get_work_dir_path(os.path.join(Config().config['CACHING']['RepositoryData'],
-                                                             Config().config['VERSION_METRICS']['ClassesData'],
-                                                             self.project.github()))
-        method_data = Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['VERSION_METRICS']['MethodData'],
-                         self.project.github()))
-        intermediate_dir = Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'],
-                         Config().config['VERSION_METRICS']['Intermediate'],
-                         self.project.github()))
-        classes_intermediate_dir = os.path.join(intermediate_dir, "classes")
-        methods_intermediate_dir = os.path.join(intermediate_dir, "methods")
-        Path(classes_intermediate_dir).mkdir(parents=True, exist_ok=True)
-        Path(methods_intermediate_dir).mkdir(parents=True, exist_ok=True)
-        Path(classes_data).mkdir(parents=True, exist_ok=True)
-        Path(method_data).mkdir(parents=True, exist_ok=True)
+        config = Config().config['VERSION_METRICS']
+        classes_data = Config.get_data_dir(config['ClassesData'], self.project.github())
+        method_data = Config.get_data_dir(config['MethodData'], self.project.github())
+        intermediate_dir = Config.get_data_dir(config['Intermediate'], self.project.github())
+        classes_intermediate_dir = Config.get_data_dir(config['Intermediate'], self.project.github(), "classes")
+        methods_intermediate_dir = Config.get_data_dir(config['Intermediate'], self.project.github(), "methods")
         return classes_data, method_data, classes_intermediate_dir, methods_intermediate_dir, intermediate_dir
 
     def aggrate_methods_df(self, df):
+        import pandas as pd
+        from pandas.api.types import is_bool_dtype, is_numeric_dtype
+        from metrics.symbols import SymbolTable, map_unique
+
         def clean(s):
             if "@" in s:
-                return s[1].split('@')[1].split('.')[:-1][-1]
-            return s[1].split('.')[:-1][-1]
-        ids = df['Method_ids'].iteritems()
-        files_id, classes_id = tee(ids, 2)
-        files = pd.Series(list(map(lambda x: x[1].split('@')[0], files_id))).values
-        classes = pd.Series(list(map(clean, classes_id))).values
+                return s.split('@')[1].split('.')[:-1][-1]
+            return s.split('.')[:-1][-1]
+        # split every distinct method id once
+        files = map_unique(df['Method_ids'], lambda x: x.split('@')[0])
+        classes = map_unique(df['Method_ids'], clean)
         df.insert(0, 'File', files)
         df.insert(0, 'Class', classes)
         groupby = ['File', 'Class']
         columns_filter = ['File', 'Class', 'BuggedMethods', 'Method', 'Method_ids']
         columns = list(
             filter(lambda x: x not in columns_filter, df.columns.values.tolist()))
+        symbols = SymbolTable()
+        keys = [symbols.encode(df[col], canonize=False) for col in groupby]
+        grouped = df[columns].groupby(keys, sort=False)
+        # numeric features are described for all the groups at once, the others per group
+        numeric = [c for c in columns if is_numeric_dtype(df[c]) and not is_bool_dtype(df[c])]
+        numeric_set = set(numeric)
+        described = grouped[numeric].describe().to_dict('index') if numeric else {}
         data = list()
-        for key, group in df.groupby(groupby):
-            key_data = {}
-            key_data.update(dict(zip(groupby, key)))
+        for key, positions in grouped.indices.items():
+            key_data = dict(zip(groupby, symbols.decode(list(key))))
+            stats = described.get(key, {})
             for feature in columns:
-                pt = pd.DataFrame(group[feature].describe(include = 'all')).T
-                cols = ["{0}_{1}".format(feature, c) for c in pt.columns.values.tolist()]
-                pt.columns = cols
-                key_data.update(list(pt.iterrows())[0][1].to_dict())
+                if feature in numeric_set:
+                    feature_stats = ((stat, stats[(feature, stat)]) for stat in NUMERIC_DESCRIBE)
+                else:
+                    feature_stats = df[feature].iloc[positions].describe(include='all').items()
+                key_data.update({"{0}_{1}".format(feature, c): v for c, v in feature_stats})
             data.append(key_data)
-        return pd.DataFrame(data)
+        # the order of a groupby on the strings
+        return pd.DataFrame(data).sort_values(groupby, kind='mergesort', ignore_index=True)
 
     def fillna(self, df, default=False):
+        from feature_matrix import downcast
         if 'Bugged' in df:
             df = df[df['Bugged'].notna()]
         if 'BuggedMethods' in df :
@@ -155,20 +174,23 @@ class Main():
                 df[col].fillna(0, inplace=True)
             else:
                 df[col].fillna(default, inplace=True)
-        return df
+        return downcast(df)
 
     def extract_features_to_version(self, version, extract_bugs, data_types):
+        from tracing import span
         self.extractor.checkout_version(version)
         db, extractors_to_run = self.get_extractors(data_types, extract_bugs, version)
         for extractor in extractors_to_run:
-            start = time.time()
-            extractor.extract()
-            print(time.time() - start, extractor.__class__.__name__)
+            with span(extractor.__class__.__name__, "extractor", version=version) as s:
+                extractor.extract()
+            print(s.duration, extractor.__class__.__name__)
         classes_df, methods_df = db.build()
-        aggregated_methods_df = self.aggrate_methods_df(methods_df)
-        methods_df = self.fillna(methods_df)
-        aggregated_classes_df = self.merge_aggregated_methods_to_class(aggregated_methods_df, classes_df)
-        classes_df = self.fillna(classes_df)
+        with span("aggregate", "build", version=version) as s:
+            aggregated_methods_df = self.aggrate_methods_df(methods_df)
+            methods_df = self.fillna(methods_df)
+            aggregated_classes_df = self.merge_aggregated_methods_to_class(aggregated_methods_df, classes_df)
+            classes_df = self.fillna(classes_df)
+            s.set(methods=len(methods_df), classes=len(aggregated_classes_df))
         methods_df = methods_df.drop('File', axis=1, errors='ignore')
         methods_df = methods_df.drop('Class', axis=1, errors='ignore')
         methods_df = methods_df.drop('Method', axis=1, errors='ignore')
@@ -195,6 +217,8 @@ class Main():
         methods_df.to_csv(os.path.join(method_data, version + ".csv"), index=False, sep=';')
 
     def get_extractors(self, data_types, extract_bugs, version):
+        from metrics.version_metrics import Extractor
+        from metrics.version_metrics_data import DataBuilder
         db = DataBuilder(self.project, version)
         if extract_bugs:
             data_types.add("bugged")
@@ -211,9 +235,11 @@ class Main():
             db.add_data_types(extractor_data_types)
         return db, extractors_to_run
 
-    def extract_classes_datasets(self, training_datasets, testing_dataset, sub_dir="classes"):
-        training = pd.concat(training_datasets, ignore_index=True).drop(["File", "Class", "Method_ids"], axis=1, errors='ignore')
-        training = self.fillna(training)
+    def get_classes_training(self, df):
+        return self.fillna(df.drop(["File", "Class", "Method_ids"], axis=1, errors='ignore'))
+
+    def extract_classes_datasets(self, training, testing_dataset, sub_dir="classes"):
+        from classification_instance import ClassificationInstance
         testing = testing_dataset.drop(["Method_ids", "Class"], axis=1, errors='ignore')
         testing = self.fillna(testing, default='')
         file_names = testing.pop("File").values.tolist()
@@ -222,29 +248,33 @@ class Main():
         return ClassificationInstance(training, testing, file_names, self.get_dataset_path(sub_dir))
 
     def get_dataset_path(self, name, is_dir=True):
-        dataset_dir = Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['VERSION_METRICS']['Dataset'],
-                         self.project.github()))
-        path = os.path.join(dataset_dir, name)
+        dataset = Config().config['VERSION_METRICS']['Dataset']
         if is_dir:
-            Path(path).mkdir(parents=True, exist_ok=True)
-        return path
+            return Config.get_data_dir(dataset, self.project.github(), name)
+        return os.path.join(Config.get_data_dir(dataset, self.project.github()), name)
+
+    def get_training_set_path(self, sub_dir):
+        return os.path.join(self.get_dataset_path(sub_dir), "training_set")
+
+    def get_methods_training(self, df):
+        return self.fillna(df.drop("Method_ids", axis=1, errors='ignore'))
 
-    def extract_methods_datasets(self, training_datasets, testing_dataset):
-        training = pd.concat(training_datasets, ignore_index=True).drop("Method_ids", axis=1, errors='ignore')
-        training = self.fillna(training)
+    def extract_methods_datasets(self, training, testing_dataset):
+        from classification_instance import ClassificationInstance
         testing = testing_dataset
         testing = self.fillna(testing)
         methods_testing_names = testing.pop("Method_ids").values.tolist()
         return ClassificationInstance(training, testing, methods_testing_names, self.get_dataset_path("methods"), label="BuggedMethods")
 
-    def choose_versions(self, version_num=5, algorithm="bin", version_type=VersionType.Untyped, strict=True):
+    def choose_versions(self, version_num=5, algorithm="bin", version_type=None, strict=True):
+        from version_selector import VersionType
         self.extractor.init_jira_commits()
-        self.extractor.choose_versions(version_num=version_num, algorithm=algorithm, strict=strict, version_type=version_type)
+        self.extractor.choose_versions(version_num=version_num, algorithm=algorithm, strict=strict, version_type=version_type or VersionType.Untyped)
 
-    def set_version_selection(self, version_num=5, algorithm="bin", version_type=VersionType.Untyped, strict=True, selected_config=0):
+    def set_version_selection(self, version_num=5, algorithm="bin", version_type=None, strict=True, selected_config=0):
+        from version_selector import VersionType
         self.extractor.set_selected_config(selected_config)
-        self.extractor.choose_versions(version_num=version_num, algorithm=algorithm, strict=strict, version_type=version_type)
+        self.extractor.choose_versions(version_num=version_num, algorithm=algorithm, strict=strict, version_type=version_type or VersionType.Untyped)
         assert self.extractor.get_selected_versions()
 
     def save_data_names(self):
@@ -282,6 +312,9 @@ class Main():
         self.jira_url = args.jira_url
         if args.projects:
             self.list_projects()
+            if not args.choose and not (args.github and args.jira):
+                return
+        from version_selector import VersionType
         if args.choose:
             self.set_project_enum(args.choose)
         if args.github and args.jira:
@@ -298,6 +331,7 @@ class Main():
                 data_types = set(json.loads(f.read()))
         self.extract_metrics(args.rest, args.only_rest, data_types)
         self.create_all_but_one_dataset(data_types)
+        self.extractor.close()
 
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@ from versions import get_repo_versions
 from caching import REPOSIROTY_DATA_DIR
 from fixing_issues import get_commits_between_versions, Version_Info, commits_and_issues,clean_commit_message
 from commit import Commit
-from caching import cached
+from caching import cached, git_sha
 from apache_repos import get_apache_repos_data
 from functools import reduce
 
@@ -51,7 +51,7 @@ def commits_and_all_issues(repo, issues):
     return commits
 
 
-@cached(r"apache_commits_data")
+@cached(r"apache_commits_data", inputs=lambda jira_project_name, jira_url, gitPath: [jira_url, git_sha(gitPath)])
 def get_jira_data(jira_project_name, jira_url, gitPath):
     repo = git.Repo(gitPath)
     dict_issues = {x.key.strip().split("-")[1]:x for x in get_jira_issues(jira_project_name, jira_url)}
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import platform
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+from caching import git_sha
+from classification_instance import ClassificationInstance
+from config import Config
+from create_test_env import SyntheticRepo
+from Main import Main
+from metrics.version_metrics import Extractor
+from metrics.version_metrics_data import DataBuilder
+from planner import get_repo_stats
+from projects import Project
+
+
+DEFAULT_DATA_TYPES = ["process_files", "issues_files"]
+
+
+class StageTimer(object):
+    """
+    The wall time and number of calls of every stage of a run. Methods of the pipeline are timed by wrapping them
+    on their class for the run, an extractor is timed under its class name.
+    """
+    def __init__(self):
+        self.stages = {}
+        self._wrapped = []
+
+    def record(self, name, seconds):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += seconds
+        stage["calls"] += 1
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def wrap(self, cls, method_name, name=None):
+        method = getattr(cls, method_name)
+        timer = self
+
+        def timed(obj, *args, **kwargs):
+            with timer.stage(name or obj.__class__.__name__):
+                return method(obj, *args, **kwargs)
+        self._wrapped.append((cls, method_name, method))
+        setattr(cls, method_name, timed)
+
+    def restore(self):
+        for cls, method_name, method in reversed(self._wrapped):
+            setattr(cls, method_name, method)
+        self._wrapped = []
+
+
+def run(commits, files, methods, tags, version_num, data_types, seed=0):
+    """
+    Creates a synthetic repository of commits commits and times the pipeline on it, from reading the commits to
+    the prediction of the last selected version.
+    """
+    project = Project("synthetic-{0}".format(commits), "SYN{0}".format(commits))
+    result = {"commits": commits, "files": files, "methods": methods, "tags": tags, "version_num": version_num,
+              "data_types": sorted(data_types), "stages": {}, "error": None}
+    timer = StageTimer()
+    try:
+        with timer.stage("create_repository"):
+            repo = SyntheticRepo.from_project(project, commits=commits, files=files, methods=methods, tags=tags,
+                                              seed=seed).create()
+            repo.seed_jira()
+        # the planner fits its cost model on these
+        result["stats"] = get_repo_stats(repo.path)
+        main = Main()
+        main.project = project
+        with timer.stage("DataExtractor.__init__"):
+            main.set_extractor()
+        with timer.stage("DataExtractor.init_jira_commits"):
+            main.extractor.init_jira_commits()
+        with timer.stage("DataExtractor.choose_versions"):
+            main.extractor.choose_versions(version_num=version_num)
+        with timer.stage("DataExtractor.extract"):
+            main.extractor.extract(True)
+        timer.wrap(Extractor, "extract")
+        timer.wrap(DataBuilder, "build", "DataBuilder.build")
+        timer.wrap(ClassificationInstance, "predict", "ClassificationInstance.predict")
+        with timer.stage("Main.extract_metrics"):
+            main.extract_metrics([], False, set(data_types))
+    except (Exception, SystemExit) as e:
+        # the stages timed until the failure are kept
+        result["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+        traceback.print_exc()
+    finally:
+        timer.restore()
+    result["stages"] = timer.stages
+    return result
+
+
+def save(results, out_path):
+    """
+    Appends the runs to the history of out_path, to compare them with the previous runs.
+    """
+    history = []
+    if os.path.exists(out_path):
+        with open(out_path) as f:
+            history = json.load(f)
+    history.append({"date": datetime.now().isoformat(), "git_sha": git_sha(os.path.dirname(os.path.abspath(__file__))),
+                    "python": platform.python_version(), "platform": platform.platform(), "runs": results})
+    with open(out_path + ".tmp", "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(out_path + ".tmp", out_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the pipeline on synthetic repositories of growing size')
+    parser.add_argument('-c', '--commits', dest='commits', nargs='+', type=int, default=[1000, 10000, 50000, 200000],
+                        help='the number of commits of every repository')
+    parser.add_argument('-f', '--files', dest='files', action='store', default=50, type=int)
+    parser.add_argument('-m', '--methods', dest='methods', action='store', default=5, type=int)
+    parser.add_argument('-t', '--tags', dest='tags', action='store', default=10, type=int)
+    parser.add_argument('-n', '--num_verions', dest='num_versions', action='store', default=3, type=int,
+                        help='the number of versions to select')
+    parser.add_argument('-d', '--data_types_to_extract', dest='data_types', action='store', default=None,
+                        help='Json file of the data types to extract as features, process and issues features by default')
+    parser.add_argument('-o', '--out', dest='out', action='store',
+                        default=os.path.join(Config().config['CACHING']['RepositoryData'], "benchmark.json"))
+    args = parser.parse_args()
+    data_types = DEFAULT_DATA_TYPES
+    if args.data_types:
+        with open(args.data_types) as f:
+            data_types = json.loads(f.read())
+    results = []
+    for commits in args.commits:
+        result = run(commits, args.files, args.methods, args.tags, args.num_versions, data_types)
+        for name, stage in result["stages"].items():
+            print("{0} commits: {1} {2:.2f}s ({3} calls)".format(commits, name, stage["seconds"], stage["calls"]))
+        results.append(result)
+    out_path = str(Config.get_work_dir_path(args.out))
+    save(results, out_path)
+    print("saved to", out_path)
+
+
+if __name__ == "__main__":
+    main()
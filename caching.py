@@ -1,8 +1,29 @@
+import gzip
+import hashlib
 import os
 import pickle
-import gzip
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import git
 
 from config import Config
+from fingerprint import Fingerprint
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
 
 
 REPOSITORY_DATA_DIR = Config.get_work_dir_path(Config().config['CACHING']['RepositoryData'])
@@ -19,38 +40,348 @@ assert REPOSITORY_DATA_DIR and assert_dir_exists(REPOSITORY_DATA_DIR)
 assert REPOSITORY_CACHING_DIR and assert_dir_exists(REPOSITORY_CACHING_DIR)
 
 
-def cached(cache_name, cache_dir=REPOSITORY_CACHING_DIR):
+class Codec(object):
+    def __init__(self, name, extension, compress, decompress):
+        self.name = name
+        self.extension = extension
+        self.compress = compress
+        self.decompress = decompress
+
+
+CODECS = {"gzip": Codec("gzip", ".gzip", lambda b: gzip.compress(b, compresslevel=6), gzip.decompress),
+          "none": Codec("none", ".pickle", lambda b: b, lambda b: b)}
+if zstandard:
+    CODECS["zstd"] = Codec("zstd", ".zst", lambda b: zstandard.ZstdCompressor(level=3).compress(b),
+                           lambda b: zstandard.ZstdDecompressor().decompress(b))
+if lz4:
+    CODECS["lz4"] = Codec("lz4", ".lz4", lz4.frame.compress, lz4.frame.decompress)
+
+
+def get_codec(name):
+    if name not in CODECS:
+        print(f"WARN: {name} compression is not available, using gzip")
+        return CODECS["gzip"]
+    return CODECS[name]
+
+
+class CacheEntry(object):
     """
-    A function that creates a decorator which will use "cachefile" for caching the results of the decorated function "fn".
+    A cached value with the fingerprint of the inputs it was computed from (None for a key without inputs).
+    Entries written before the fingerprints are plain values, they are trusted once and stamped with the current
+    fingerprint instead of being computed again, so a cache given inputs does not refetch all its keys.
     """
-    cache_dir = cache_dir.joinpath(cache_name)
-    assert_dir_exists(cache_dir)
+    __slots__ = ('fingerprint', 'value')
 
-    def decorator(fn):  # define a decorator for a function "fn"
-        def wrapped(key='KEY', *args, **kwargs):   # define a wrapper that will finally call "fn" with all arguments
-            gzip_cachefile = cache_dir.joinpath(key + ".gzip")
-            assert_dir_exists(gzip_cachefile.parent)
-            if gzip_cachefile.exists():
+    def __init__(self, fingerprint, value):
+        self.fingerprint = fingerprint
+        self.value = value
+
+
+def git_sha(repo_path, rev="HEAD"):
+    """
+    The sha of rev (HEAD, a tag, ...) of the repository at repo_path, None if there is no such repository or rev.
+    """
+    try:
+        return git.Repo(repo_path).commit(rev).hexsha
+    except (git.exc.InvalidGitRepositoryError, git.exc.NoSuchPathError, git.exc.BadName, ValueError):
+        return None
+
+
+def config_values(section, *keys):
+    config = Config().config[section]
+    return [(section, key, config.get(key)) for key in keys]
+
+
+class FileLock(object):
+    """
+    An exclusive lock on a file, held across processes (e.g. the workers of a multiprocessing.Pool).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, "a+b")
+        if fcntl:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+        else:
+            self.handle.seek(0)
+            while True:
                 try:
-                    with gzip.GzipFile(gzip_cachefile, 'rb') as cachehandle:
-                        print(f"read {key} from cache")
-                        return pickle.load(cachehandle)
-                except:
+                    msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
                     pass
-            # execute the function with all arguments passed
-            if fn.__code__.co_argcount == 0:
-                res = fn(*args, **kwargs)
-            else:
-                res = fn(key, *args, **kwargs)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if fcntl:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        else:
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        self.handle.close()
+        self.handle = None
+
+
+class Storage(ABC):
+    """
+    Where cached keeps the results of a cache. get returns a (found, value) pair, an entry computed from other
+    inputs than fingerprint is stale and not found.
+    """
+    def __init__(self):
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "stamped": 0, "errors": 0, "bytes_read": 0,
+                      "bytes_written": 0, "evictions": 0}
+
+    @abstractmethod
+    def get(self, key, fingerprint=None):
+        pass
+
+    @abstractmethod
+    def put(self, key, value, fingerprint=None):
+        pass
+
+    @abstractmethod
+    def lock(self, key):
+        pass
+
+    def _check(self, entry, fingerprint):
+        """
+        Returns whether the entry is found, its value and whether it has to be stamped with fingerprint.
+        """
+        if not isinstance(entry, CacheEntry):
+            # an entry written before the fingerprints
+            entry = CacheEntry(None, entry)
+        if entry.fingerprint is None and fingerprint is not None:
+            # written before the key had inputs, e.g. the jira data of a project cached before the upgrade
+            self.stats["stamped"] += 1
+            return True, entry.value, True
+        if entry.fingerprint != fingerprint:
+            self.stats["stale"] += 1
+            return False, None, False
+        return True, entry.value, False
+
+    def get_or_compute(self, key, compute, fingerprint=None):
+        stale = self.stats["stale"]
+        found, value = self.get(key, fingerprint)
+        if found:
+            return value
+        # only one process computes a missing key, the others wait for its result
+        with self.lock(key):
+            # the entry is checked again, a stale one should be counted once
+            self.stats["stale"] = stale
+            found, value = self.get(key, fingerprint)
+            if found:
+                return value
+            self.stats["misses"] += 1
+            value = compute()
+            self.put(key, value, fingerprint)
+            return value
+
 
-            # write to cache file
+class FileStorage(Storage):
+    """
+    Every key is a compressed pickle under cache_dir, written to a temporary file and renamed in place so a
+    crash never leaves a truncated entry. Entries of any codec are read, the configured one is written.
+    When max_bytes is set the least recently used entries under root are removed to keep them below it.
+    """
+    # the bytes of the entries under every root, counted by evict and kept up to date by put
+    sizes = {}
+
+    def __init__(self, cache_dir, codec="gzip", max_bytes=0, root=None):
+        super().__init__()
+        self.cache_dir = Path(cache_dir)
+        self.codec = get_codec(codec)
+        self.max_bytes = max_bytes
+        self.root = Path(root or self.cache_dir)
+        self.locks_dir = self.root.joinpath(".locks")
+        self.locks_dir.mkdir(parents=True, exist_ok=True)
+
+    def _get_path(self, key, codec):
+        return self.cache_dir.joinpath(key + codec.extension)
+
+    def _get_paths(self, key):
+        codecs = [self.codec] + [c for c in CODECS.values() if c is not self.codec]
+        return [(self._get_path(key, c), c) for c in codecs]
+
+    def lock(self, key):
+        return FileLock(self.locks_dir.joinpath(hashlib.sha1(key.encode()).hexdigest() + ".lock"))
+
+    def get(self, key, fingerprint=None):
+        for path, codec in self._get_paths(key):
             try:
-                with gzip.GzipFile(os.path.join(*gzip_cachefile.parts), 'wb') as cachehandle:
-                    pickle.dump(res, cachehandle, pickle.HIGHEST_PROTOCOL)
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            try:
+                # one read and one decompress, instead of unpickling from the compressed stream
+                entry = pickle.loads(codec.decompress(data))
             except Exception as e:
-                raise e
+                print(f"WARN: removing the unreadable cache entry {path}: {e}")
+                self.stats["errors"] += 1
+                self._remove(path)
+                continue
+            found, value, stamp = self._check(entry, fingerprint)
+            if not found:
+                # the recomputed entry replaces it
+                return False, None
+            self.stats["hits"] += 1
+            self.stats["bytes_read"] += len(data)
+            if stamp:
+                self.put(key, value, fingerprint)
+            else:
+                self._touch(path)
+            return True, value
+        return False, None
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _get_size(path):
+        try:
+            return os.path.getsize(str(path))
+        except OSError:
+            return 0
+
+    def put(self, key, value, fingerprint=None):
+        path = self._get_path(key, self.codec)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        replaced = sum(self._get_size(p) for p, _ in self._get_paths(key)) if self.max_bytes else 0
+        data = self.codec.compress(pickle.dumps(CacheEntry(fingerprint, value), pickle.HIGHEST_PROTOCOL))
+        handle, temp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, str(path))
+        except BaseException:
+            self._remove(temp_path)
+            raise
+        # a stale entry of another codec would shadow nothing, but would take space
+        for other_path, codec in self._get_paths(key)[1:]:
+            self._remove(other_path)
+        self.stats["bytes_written"] += len(data)
+        if self.max_bytes:
+            root = str(self.root)
+            if root in FileStorage.sizes:
+                FileStorage.sizes[root] += len(data) - replaced
+            # the entries are walked only when the total is unknown or over max_bytes, not on every put
+            if FileStorage.sizes.get(root, self.max_bytes + 1) > self.max_bytes:
+                self.evict(keep=path)
+
+    def _get_entries(self):
+        extensions = tuple(c.extension for c in CODECS.values())
+        for directory, dirs, files in os.walk(str(self.root)):
+            for name in files:
+                if name.endswith(extensions) and not name.startswith("."):
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until their total size is below max_bytes.
+        """
+        with FileLock(str(self.locks_dir.joinpath(".evict.lock"))):
+            entries = sorted(self._get_entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if keep is not None and os.path.abspath(path) == os.path.abspath(str(keep)):
+                    continue
+                self._remove(path)
+                total -= size
+                self.stats["evictions"] += 1
+            # entries written by other processes are counted again on the next walk
+            FileStorage.sizes[str(self.root)] = total
+
+
+# the storages of this process, by their cache directory and name or by the storage given to cached
+_storages = {}
+
+
+def get_storage(cache_name, cache_dir=REPOSITORY_CACHING_DIR):
+    """
+    The storage of the cache under cache_dir, created once per process: cached is called again for the same cache,
+    e.g. by every JavalangFileAnalyser of a version.
+    """
+    key = (str(Path(cache_dir)), cache_name)
+    if key not in _storages:
+        config = Config().config['CACHING']
+        max_bytes = int(float(config.get('MaxSizeMB', '0')) * (1 << 20))
+        _storages[key] = FileStorage(Path(cache_dir).joinpath(cache_name), config.get('Compression', 'gzip'),
+                                     max_bytes, root=cache_dir)
+    return _storages[key]
+
+
+def get_stats():
+    """
+    The hit, miss, error, byte and eviction counters of the caches of this process.
+    """
+    stats = {}
+    for storage in _storages.values():
+        for k, v in storage.stats.items():
+            stats[k] = stats.get(k, 0) + v
+    return stats
+
+
+def cached(cache_name, cache_dir=REPOSITORY_CACHING_DIR, storage=None, inputs=None, salt=None):
+    """
+    A function that creates a decorator which will use "cachefile" for caching the results of the decorated function "fn".
+    inputs is called with the arguments of fn and returns what the result depends on besides the key (e.g. git_sha
+    of a repository, config_values), salt is the version of the code. A cached result whose inputs or salt changed
+    is stale and recomputed.
+    """
+    if storage is None:
+        storage = get_storage(cache_name, cache_dir)
+    else:
+        _storages.setdefault(id(storage), storage)
+
+    def decorator(fn):  # define a decorator for a function "fn"
+        def get_fingerprint(key, *args, **kwargs):
+            if inputs is None and salt is None:
+                return None
+            return Fingerprint(salt, inputs(key, *args, **kwargs) if inputs else None).hexdigest()
+
+        def wrapped(key='KEY', *args, **kwargs):   # define a wrapper that will finally call "fn" with all arguments
+            def compute():
+                if fn.__code__.co_argcount == 0:
+                    return fn(*args, **kwargs)
+                return fn(key, *args, **kwargs)
+            hits = storage.stats["hits"]
+            start = time.time()
+            res = storage.get_or_compute(key, compute, get_fingerprint(key, *args, **kwargs))
+            if storage.stats["hits"] > hits:
+                print(f"read {key} from cache ({time.time() - start:.2f}s)")
             return res
 
+        def put(key, value, *args, **kwargs):
+            """
+            Stores value as the result of fn(key, *args, **kwargs), e.g. to seed a cache with data not fetched by fn.
+            """
+            storage.put(key, value, get_fingerprint(key, *args, **kwargs))
+
+        wrapped.storage = storage
+        wrapped.put = put
         return wrapped
 
     return decorator   # return this "customized" decorator that uses "cachefile"
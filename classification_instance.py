@@ -4,35 +4,56 @@ from sklearn.gaussian_process.kernels import RBF
 import pandas as pd
 import json
 import os
-import sklearn.metrics as metrics
+import pickle
+from scoring import MultiMetricScorer
+from training_set import TrainingSet
+from feature_matrix import FeatureMatrix, downcast
+from fingerprint import Fingerprint, StageStore
+from tracing import span
+import feature_matrix
+import sys
 
 
 class ClassificationInstance(object):
     def __init__(self, training, testing, names=None, dataset_dir=None, training_path="training.csv", testing_path="testing.csv",
-                 training_describe_path="training_describe.csv", testing_describe_path="testing_describe.csv", prediction_path="prediction.csv", label='Bugged', save_all=True, metrics_path='metrics.json', importance_path='importance.json'):
+                 training_describe_path="training_describe.csv", testing_describe_path="testing_describe.csv", prediction_path="prediction.csv", label='Bugged', save_all=True, metrics_path='metrics.json', importance_path='importance.json', model_path='model.pkl'):
         self.training = training
         self.testing = testing
         self.save_all = save_all
         if self.save_all:
-            self.training.to_csv(os.path.join(dataset_dir, training_path), index=False, sep=';')
+            if isinstance(self.training, TrainingSet):
+                self.training.to_csv(os.path.join(dataset_dir, training_path), sep=';')
+                self.training.describe().to_csv(os.path.join(dataset_dir, training_describe_path), sep=';')
+            else:
+                self.training.to_csv(os.path.join(dataset_dir, training_path), index=False, sep=';')
+                self.training.describe(include = 'all').to_csv(os.path.join(dataset_dir, training_describe_path), sep=';')
             self.testing.to_csv(os.path.join(dataset_dir, testing_path), index=False, sep=';')
 
-            self.training.describe(include = 'all').to_csv(os.path.join(dataset_dir, training_describe_path), sep=';')
             self.testing.describe(include = 'all').to_csv(os.path.join(dataset_dir, testing_describe_path), sep=';')
+        self.stages = StageStore(os.path.join(dataset_dir, "stages"))
         self.prediction_path = os.path.join(dataset_dir, prediction_path)
         self.metrics_path = os.path.join(dataset_dir, metrics_path)
         self.importance_path = os.path.join(dataset_dir, importance_path)
+        self.model_path = os.path.join(dataset_dir, model_path)
         self.scores = None
         self.importance = None
         self.fix_and_warn(label)
-        self.training_y = self.training.pop(label).values
-        self.features_list = self.training.columns.to_list()
-        self.training_X = self.training.values
+        matrices = FeatureMatrix()
+        if isinstance(self.training, TrainingSet):
+            # the training set is read from its memory-mapped columns instead of being loaded as a frame
+            self.training_y = self.training.read_column(label).values
+            self.features_list = [c for c in self.training.columns.to_list() if c != label]
+            self.training_X = matrices.from_training_set(self.training, self.features_list)
+        else:
+            self.training_y = self.training.pop(label).values
+            self.features_list = self.training.columns.to_list()
+            self.training_X = matrices.from_frame(downcast(self.training), sparse_format='csc')
         self.testing_y = None
         if label in self.testing.columns:
             self.testing_y = self.testing.pop(label).values
-        self.testing_X = self.testing.values
+        self.testing_X = matrices.from_frame(downcast(self.testing))
         self.names = names
+        self.classifier = None
 
     def fix_and_warn(self, label):
         test_ = set(self.testing.columns.to_list())
@@ -44,20 +65,101 @@ class ClassificationInstance(object):
         if not_in_train:
             print(f"WARN: {not_in_train} columns are not in train")
         all_cols = list(train_.intersection(test_))
-        self.training = self.training[all_cols]
+        if isinstance(self.training, TrainingSet):
+            self.training = self.training.select(all_cols)
+        else:
+            self.training = self.training[all_cols]
         self.testing = self.testing[all_cols]
 
+    @staticmethod
+    def get_classifier():
+        return RandomForestClassifier(n_estimators=1000, random_state=42)
+        # return GaussianProcessClassifier(kernel=RBF(), max_iter_predict=20, n_restarts_optimizer=0, warm_start=True)
+
+    @staticmethod
+    def get_code_fingerprint():
+        return Fingerprint.of_code(sys.modules[__name__], feature_matrix)
+
+    def get_fingerprint(self):
+        return Fingerprint(self.training_X, self.training_y, self.testing_X, self.testing_y, self.names,
+                           self.features_list, self.get_classifier(), self.get_code_fingerprint())
+
     def predict(self):
-        classifier = RandomForestClassifier(n_estimators=1000, random_state=42)
-        # classifier = GaussianProcessClassifier(kernel=RBF(), max_iter_predict=20, n_restarts_optimizer=0, warm_start=True)
-        model = classifier.fit(self.training_X, self.training_y)
-        classes = list(map(lambda x: str(x) + "_probability", classifier.classes_.tolist()))
-        predictions_proba = list(zip(*classifier.predict_proba(self.testing_X)))
-        predictions = list(classifier.predict(self.testing_X))
-        self.importance = dict(zip(self.features_list, classifier.feature_importances_.tolist()))
+        """
+        Fits the classifier and predicts the testing set, unless the same inputs were already predicted.
+        """
+        fingerprint = self.get_fingerprint()
+        stored = self.stages.get("predict", fingerprint)
+        if stored is not None:
+            prediction, self.scores, self.importance = stored
+        else:
+            prediction = self._predict()
+            self.stages.put("predict", fingerprint, (prediction, self.scores, self.importance))
+        if self.save_all and (stored is None or not os.path.exists(self.model_path)):
+            # a prediction stored before the models were saved, or whose model was removed, is fitted again
+            if self.classifier is None:
+                self.fit()
+            self.save_model()
+        self.save_prediction(prediction)
+        return prediction
+
+    def save_prediction(self, prediction):
         if self.save_all:
             with open(self.importance_path, "w") as f:
                 json.dump(self.importance, f)
+            if self.scores is not None:
+                with open(self.metrics_path, "w") as f:
+                    json.dump(self.scores, f)
+        if self.prediction_path:
+            prediction.to_csv(self.prediction_path, index=False, sep=';')
+
+    def fit(self):
+        """
+        Fits the classifier on the training set, and keeps it to predict other rows than the testing ones.
+        """
+        self.classifier = self.get_classifier()
+        with span("train", "model", features=len(self.features_list)) as s:
+            self.classifier.fit(self.training_X, self.training_y)
+            s.set_rows(self.training_X.shape[0])
+        return self.classifier
+
+    def predict_rows(self, df):
+        """
+        The probabilities of the fitted classifier for the rows of df, which holds the features of the training set.
+        """
+        return self.get_probabilities(self.classifier, self.features_list, df)
+
+    @staticmethod
+    def get_probabilities(classifier, features_list, df):
+        X = FeatureMatrix().from_frame(downcast(df[features_list]))
+        columns = list(map(lambda x: str(x) + "_probability", classifier.classes_.tolist()))
+        return pd.DataFrame(classifier.predict_proba(X), columns=columns, index=df.index)
+
+    def save_model(self):
+        """
+        Saves the features list and the fitted classifier, for the prediction service to load them without the
+        training set.
+        """
+        with open(self.model_path + ".tmp", "wb") as f:
+            pickle.dump((self.features_list, self.classifier), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.model_path + ".tmp", self.model_path)
+
+    @staticmethod
+    def load_model(path):
+        """
+        The features list and the fitted classifier saved by save_model.
+        """
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _predict(self):
+        classifier = self.fit()
+        classes = list(map(lambda x: str(x) + "_probability", classifier.classes_.tolist()))
+        with span("predict", "model") as s:
+            predictions_proba = list(zip(*classifier.predict_proba(self.testing_X)))
+            predictions = list(classifier.predict(self.testing_X))
+            s.set_rows(len(predictions))
+        self.importance = dict(zip(self.features_list, classifier.feature_importances_.tolist()))
         if self.names:
             names = self.names
         else:
@@ -65,27 +167,22 @@ class ClassificationInstance(object):
         if self.testing_y is not None:
             columns = ['name', 'actual', 'prediction'] + classes
             data = zip(names, self.testing_y.tolist(), predictions, *predictions_proba)
-            self.evaluate_on_test(self.testing_y.tolist(), predictions, classifier.classes_.tolist(), predictions_proba)
+            with span("score", "model"):
+                self.evaluate_on_test(self.testing_y.tolist(), predictions, classifier.classes_.tolist(), predictions_proba)
         else:
             columns = ['name', 'prediction'] + classes
             data = zip(names, predictions, *predictions_proba)
-        prediction = pd.DataFrame(data, columns=columns)
-        if self.prediction_path:
-            prediction.to_csv(self.prediction_path, index=False, sep=';')
-        return prediction
+        return pd.DataFrame(data, columns=columns)
+
+    # the scores of the test set and their names in MultiMetricScorer, the auc scores are of the probabilities
+    TEST_SCORES = {'accuracy_score': 'accuracy_score', 'precision_score': 'precision_score',
+                   'recall_score': 'recall_score', 'f1_score': 'f1_score', 'roc_auc_score': 'roc_auc',
+                   'pr_auc_score': 'pr_auc'}
 
     def evaluate_on_test(self, y_true, y_pred, classes, predicitons_proba):
-        self.scores = {}
         y_prob = dict(zip(classes, predicitons_proba))[True]
-        self.scores['accuracy_score'] = metrics.accuracy_score(y_true, y_pred)
-        self.scores['precision_score'] = metrics.precision_score(y_true, y_pred)
-        self.scores['recall_score'] = metrics.recall_score(y_true, y_pred)
-        self.scores['f1_score'] = metrics.f1_score(y_true, y_pred)
-        self.scores['roc_auc_score'] = metrics.roc_auc_score(y_true, y_prob)
-        self.scores['pr_auc_score'] = pr_auc_score(y_true, y_prob)
-        if self.save_all:
-            with open(self.metrics_path, "w") as f:
-                json.dump(self.scores, f)
+        scores = MultiMetricScorer(names=list(self.TEST_SCORES.values())).score(y_true, y_pred, y_prob)
+        self.scores = {name: scores[scorer_name] for name, scorer_name in self.TEST_SCORES.items()}
 
     @staticmethod
     def instance_for_rest_versions(training_path, testing_path, data_dir, save_all=True):
@@ -128,10 +225,5 @@ class ClassificationInstance(object):
             pd.DataFrame(scores).to_csv(os.path.join(dataset_dir, sub_dir + "_metrics.csv"), index=False, sep=';')
 
 
-def pr_auc_score(y_true, y_score):
-    precision, recall, thresholds =  metrics.precision_recall_curve(y_true, y_score)
-    return metrics.auc(recall, precision)
-
-
 if __name__ == "__main__":
     ClassificationInstance.all_but_one_evaluation(r"C:\Users\User\Downloads\dataset\commons-lang")
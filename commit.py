@@ -1,6 +1,7 @@
 import re
 import time
 from datetime import datetime
+from git.objects.util import from_timestamp, utctz_to_altz
 try:
     from javadiff.javadiff.SourceFile import SourceFile
     from javadiff.javadiff.diff import get_commit_methods
@@ -10,6 +11,8 @@ except:
 
 
 class CommittedFile(object):
+    __slots__ = ('sha', 'name', 'insertions', 'deletions', 'is_java')
+
     def __init__(self, sha, name, insertions, deletions):
         self.sha = sha
         self.name = Commit.fix_renamed_files([name])[0]
@@ -23,6 +26,9 @@ class CommittedFile(object):
 
 
 class Commit(object):
+    __slots__ = ('_commit_id', '_repo_dir', '_issue_id', '_files', '_methods', '_commit_date', '_commit_formatted_date',
+                 'issue', 'issue_type', 'is_java_commit')
+
     def __init__(self, bug_id, git_commit, issue=None, files=None, is_java_commit=True):
         self._commit_id = git_commit.hexsha
         self._repo_dir = git_commit.repo.working_dir
@@ -32,7 +38,7 @@ class Commit(object):
         else:
             self._files = list(map(lambda f: CommittedFile(self._commit_id, f, '0', '0'), git_commit.stats.files.keys()))
         self._methods = list()
-        self._commit_date = time.mktime(git_commit.committed_datetime.timetuple())
+        self._commit_date = Commit.get_commit_date(git_commit)
         self._commit_formatted_date = datetime.utcfromtimestamp(self._commit_date).strftime('%Y-%m-%d %H:%M:%S')
         self.issue = issue
         if issue:
@@ -55,6 +61,17 @@ class Commit(object):
                 self._methods = get_commit_methods(self._repo_dir, self._commit_id, analyze_source_lines=False)
         return self._methods
 
+    @staticmethod
+    def get_commit_date(git_commit):
+        return time.mktime(git_commit.committed_datetime.timetuple())
+
+    @staticmethod
+    def get_log_date(timestamp, utc_offset):
+        """
+        The get_commit_date of a commit from the %ct and the offset of the %ci of git log, e.g. "+0200".
+        """
+        return time.mktime(from_timestamp(timestamp, utctz_to_altz(utc_offset)).timetuple())
+
     @classmethod
     def init_commit_by_git_commit(cls, git_commit, bug_id=0, issue=None, files=None, is_java_commit=True):
         return Commit(bug_id, git_commit, issue, files=files, is_java_commit=is_java_commit)
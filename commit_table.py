@@ -0,0 +1,224 @@
+import sys
+from array import array
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from commit import get_commit_methods
+
+
+class CommitTable(object):
+    """
+    The commits of a repository in parallel arrays: shas as 20 raw bytes, dates as int64 seconds and the
+    committed files of every commit as a slice (file_offsets) of interned file ids, insertions and deletions.
+    Indexing or iterating the table gives CommitView objects with the attribute API of Commit.
+    """
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.file_names = []
+        self.file_index = {}
+        self.issues = {}
+        self.methods = {}
+        self._shas = bytearray()
+        self._dates = array('q')
+        self._issue_ids = []
+        self._is_java_commit = array('b')
+        self._file_offsets = array('q', [0])
+        self._file_ids = array('i')
+        self._insertions = array('i')
+        self._deletions = array('i')
+        self.closed = False
+
+    def _intern_file(self, name):
+        file_id = self.file_index.get(name)
+        if file_id is None:
+            file_id = len(self.file_names)
+            self.file_index[name] = file_id
+            self.file_names.append(name)
+        return file_id
+
+    def append(self, sha, date, bug_id, issue, files, is_java_commit=True):
+        """
+        Adds a commit, its date as Commit.get_commit_date gives it and its files as (name, insertions, deletions).
+        """
+        assert not self.closed
+        self._shas += bytes.fromhex(sha)
+        self._dates.append(int(date))
+        self._issue_ids.append(sys.intern(str(bug_id)))
+        if issue is not None:
+            self.issues[str(bug_id)] = issue
+        self._is_java_commit.append(is_java_commit)
+        for name, insertions, deletions in files:
+            self._file_ids.append(self._intern_file(name))
+            self._insertions.append(insertions)
+            self._deletions.append(deletions)
+        self._file_offsets.append(len(self._file_ids))
+
+    def close(self):
+        """
+        Freezes the table into numpy arrays.
+        """
+        self.shas = np.frombuffer(bytes(self._shas), dtype='S20')
+        self.dates = np.frombuffer(self._dates, dtype=np.int64).copy()
+        self.issue_ids = np.array(self._issue_ids, dtype=object)
+        self.is_java_commit = np.frombuffer(self._is_java_commit, dtype=np.int8).astype(bool)
+        self.file_offsets = np.frombuffer(self._file_offsets, dtype=np.int64).copy()
+        self.file_ids = np.frombuffer(self._file_ids, dtype=np.int32).copy()
+        self.insertions = np.frombuffer(self._insertions, dtype=np.int32).copy()
+        self.deletions = np.frombuffer(self._deletions, dtype=np.int32).copy()
+        self.file_is_java = np.array([name.endswith(".java") for name in self.file_names], dtype=bool)
+        del self._shas, self._dates, self._issue_ids, self._is_java_commit
+        del self._file_offsets, self._file_ids, self._insertions, self._deletions
+        self.closed = True
+        return self
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return CommitView(self, index)
+
+    def __iter__(self):
+        return (CommitView(self, i) for i in range(len(self)))
+
+    def get_sha(self, index):
+        # numpy drops the trailing zero bytes of fixed width bytes
+        return self.shas[index].ljust(20, b'\0').hex()
+
+    def get_shas(self):
+        shas = self.shas.tobytes().hex()
+        return [shas[i: i + 40] for i in range(0, len(shas), 40)]
+
+    def get_formatted_dates(self):
+        return pd.to_datetime(self.dates, unit='s').strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+
+    def get_issue_urls(self):
+        urls = {issue_id: issue.url for issue_id, issue in self.issues.items()}
+        return np.array([urls.get(issue_id, "") for issue_id in self.issue_ids], dtype=object)
+
+    def get_commit_index(self):
+        """
+        The index of the commit of every committed file.
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.file_offsets))
+
+    def get_file_names(self):
+        return np.array(self.file_names, dtype=object)[self.file_ids]
+
+    def get_sorted_java_commits(self):
+        """
+        The indices of the java commits ordered by date (ties keep their table order) and their dates.
+        """
+        java = np.flatnonzero(self.is_java_commit)
+        order = java[np.argsort(self.dates[java], kind='stable')]
+        return order, self.dates[order]
+
+
+class CommitView(object):
+    """
+    A Commit backed by a row of a CommitTable.
+    """
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: CommitTable, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def _commit_id(self):
+        return self.table.get_sha(self.index)
+
+    @property
+    def _repo_dir(self):
+        return self.table.repo_dir
+
+    @property
+    def _issue_id(self):
+        return self.table.issue_ids[self.index]
+
+    @property
+    def _commit_date(self):
+        return float(self.table.dates[self.index])
+
+    @property
+    def _commit_formatted_date(self):
+        return datetime.utcfromtimestamp(self._commit_date).strftime('%Y-%m-%d %H:%M:%S')
+
+    @property
+    def _files(self):
+        start, end = self.table.file_offsets[self.index], self.table.file_offsets[self.index + 1]
+        return [CommittedFileView(self.table, self.index, position) for position in range(start, end)]
+
+    @property
+    def issue(self):
+        return self.table.issues.get(self._issue_id)
+
+    @property
+    def issue_type(self):
+        issue = self.issue
+        return issue.type if issue else ''
+
+    @property
+    def is_java_commit(self):
+        return bool(self.table.is_java_commit[self.index])
+
+    def is_bug(self):
+        return self._issue_id != '0' and self.issue_type == 'bug'
+
+    def get_issue_url(self):
+        issue = self.issue
+        return issue.url if issue else ""
+
+    def get_commit_methods(self):
+        if self.is_bug():
+            if self.index not in self.table.methods:
+                self.table.methods[self.index] = get_commit_methods(self._repo_dir, self._commit_id,
+                                                                    analyze_source_lines=False)
+            return self.table.methods[self.index]
+        return self.table.methods.get(self.index, [])
+
+    def to_list(self):
+        return [self._commit_id, str(self._issue_id), ";".join(list(map(lambda x: x.name, self._files)))]
+
+    def __eq__(self, other):
+        return isinstance(other, CommitView) and other.table is self.table and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.table), self.index))
+
+
+class CommittedFileView(object):
+    """
+    A CommittedFile backed by a CommitTable.
+    """
+    __slots__ = ('table', 'commit', 'position')
+
+    def __init__(self, table: CommitTable, commit, position):
+        self.table = table
+        self.commit = commit
+        self.position = position
+
+    @property
+    def sha(self):
+        return self.table.get_sha(self.commit)
+
+    @property
+    def name(self):
+        return self.table.file_names[self.table.file_ids[self.position]]
+
+    @property
+    def insertions(self):
+        return int(self.table.insertions[self.position])
+
+    @property
+    def deletions(self):
+        return int(self.table.deletions[self.position])
+
+    @property
+    def is_java(self):
+        return bool(self.table.file_is_java[self.table.file_ids[self.position]])
@@ -3,14 +3,34 @@ import os
 import tempfile
 import pathlib
 import hashlib
+from functools import lru_cache
 
 
 class Config:
+    # the sections and keys the pipeline cannot run without
+    REQUIRED = {"CACHING": ["RepositoryData", "RepositoryCaching"],
+                "REPO": ["RepoDir", "JiraURL"],
+                "VERSION_METRICS": ["MetricsDir", "ClassesData", "MethodData", "Dataset", "Intermediate"],
+                "DATA_EXTRACTION": ["Versions", "VersionsInfos", "Commits", "CommittedFiles", "Issues", "Files"]}
+    _config = None
+
     def __init__(self):
-        self.config = configparser.ConfigParser()
+        # config.ini is read once per process, every Config shares it
+        if Config._config is None:
+            Config._config = Config._read()
+        self.config = Config._config
+
+    @staticmethod
+    def _read():
+        config = configparser.ConfigParser()
         cwd = pathlib.Path(__file__).parent.absolute()
         config_path = cwd.joinpath(r"config.ini")
-        self.config.read(config_path)
+        config.read(config_path)
+        missing = ["[{0}] {1}".format(section, key) for section, keys in Config.REQUIRED.items() for key in keys
+                   if section not in config or key not in config[section]]
+        if missing:
+            raise ValueError("{0} misses {1}".format(config_path, ", ".join(missing)))
+        return config
 
     @staticmethod
     def get_temp_path(path=""):
@@ -19,12 +39,27 @@ class Config:
         return os.path.join(tempfile.gettempdir(), path)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_work_dir_path(path=""):
         cwd = pathlib.Path(Config.extend_path(__file__)).parent.absolute()
         if path == "":
             return cwd
         return cwd.joinpath(path)
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _get_data_path(*names):
+        return str(Config.get_work_dir_path(os.path.join(Config().config['CACHING']['RepositoryData'], *names)))
+
+    @staticmethod
+    def get_data_dir(*names):
+        """
+        The directory of names under RepositoryData, created again if it was removed since the last call.
+        """
+        path = Config._get_data_path(*names)
+        os.makedirs(path, exist_ok=True)
+        return path
+
     @staticmethod
     def assert_dir_exists(dir_path):
         path = pathlib.Path(dir_path)
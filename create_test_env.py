@@ -1,6 +1,198 @@
+import argparse
+import os
+import random
+import shutil
+import subprocess
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from config import Config
+from issues import Issue, get_jira_issues
+from projects import Project
+
+
+class SyntheticRepo(object):
+    """
+    A deterministic local git repository of a java project, with the jira issues its commits refer to, to run the
+    pipeline without network access. The same arguments give the same commits (and shas).
+    Every commit changes methods of 1 to 3 java files, bug_ratio of the commits mention a bug issue
+    ("KEY-12: fix ..."), others an improvement or no issue, and tags are spread evenly over the history.
+    """
+    AUTHOR = "Synthetic Developer <developer@synthetic.org>"
+    START_DATE = int(datetime(2015, 1, 1, tzinfo=timezone.utc).timestamp())
+    COMMIT_INTERVAL = 3600
+    # written in the .git directory of the repositories create writes, the only ones it replaces
+    MARKER = "synthetic_repo"
+
+    def __init__(self, path, jira_key, commits=1000, files=50, methods=5, tags=10, bug_ratio=0.3, seed=0,
+                 github_user_name="apache"):
+        self.path = path
+        self.jira_key = jira_key
+        self.github_name = os.path.basename(os.path.normpath(path))
+        self.commits = commits
+        self.files = files
+        self.methods = methods
+        self.tags = tags
+        self.bug_ratio = bug_ratio
+        self.seed = seed
+        self.github_user_name = github_user_name
+        self.issues_types = self._get_issues_types()
+
+    @staticmethod
+    def from_project(project: Project, **kwargs):
+        return SyntheticRepo(project.path(), project.jira(), **kwargs)
+
+    def _get_issues_types(self):
+        rng = random.Random(self.seed)
+        return ['Bug' if rng.random() < 0.6 else 'Improvement' for _ in range(max(10, self.commits // 5))]
+
+    def _get_file_path(self, file_id):
+        return "src/main/java/org/synthetic/p{0}/C{1}.java".format(file_id % 10, file_id)
+
+    def _get_file_content(self, file_id, methods_versions):
+        lines = ["package org.synthetic.p{0};".format(file_id % 10), "",
+                 "public class C{0} {{".format(file_id)]
+        for method_id, version in enumerate(methods_versions):
+            lines.extend(["    public int m{0}(int x) {{".format(method_id),
+                          "        int y = x * {0};".format(method_id + 1)])
+            lines.extend("        y = y + {0};".format(i) for i in range(version % 7))
+            lines.extend(["        return y + {0};".format(version), "    }", ""])
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def _get_message(self, rng, file_id, method_id):
+        issue_id = rng.randrange(len(self.issues_types))
+        kind = 'Bug' if rng.random() < self.bug_ratio else rng.choice(['Improvement', None])
+        if kind is None:
+            return "update C{0}.m{1}".format(file_id, method_id)
+        # the closest issue of the kind, all the issues of a kind may be missing in a tiny repository
+        candidates = [i for i in range(len(self.issues_types)) if self.issues_types[i] == kind] or [issue_id]
+        issue_id = min(candidates, key=lambda i: abs(i - issue_id))
+        action = "fix" if kind == 'Bug' else "improve"
+        return "{0}-{1}: {2} C{3}.m{4}".format(self.jira_key, issue_id + 1, action, file_id, method_id)
+
+    def get_tag_name(self, tag_id):
+        return "release-{0}.{1}.{2}".format(1 + tag_id // 20, (tag_id // 4) % 5, tag_id % 4)
+
+    def _get_tagged_commits(self):
+        return {((tag_id + 1) * self.commits) // (self.tags + 1): tag_id for tag_id in range(self.tags)}
+
+    @staticmethod
+    def _data(payload):
+        payload = payload.encode()
+        return b"data " + str(len(payload)).encode() + b"\n" + payload + b"\n"
+
+    def _commit(self, mark, date, message, files):
+        header = "commit refs/heads/master\nmark :{0}\nauthor {1} {2} +0000\ncommitter {1} {2} +0000\n".format(
+            mark, self.AUTHOR, date)
+        chunks = [header.encode(), self._data(message)]
+        if mark > 1:
+            chunks.append("from :{0}\n".format(mark - 1).encode())
+        for path, content in files:
+            chunks.append("M 100644 inline {0}\n".format(path).encode())
+            chunks.append(self._data(content))
+        chunks.append(b"\n")
+        return b"".join(chunks)
+
+    def _stream(self):
+        rng = random.Random(self.seed)
+        versions = [[0] * self.methods for _ in range(self.files)]
+        tagged = self._get_tagged_commits()
+        for i in range(self.commits):
+            date = self.START_DATE + i * self.COMMIT_INTERVAL
+            if i == 0:
+                yield self._commit(1, date, "initial import",
+                                   [(self._get_file_path(f), self._get_file_content(f, versions[f]))
+                                    for f in range(self.files)] + [("README.md", "synthetic project\n")])
+            elif rng.random() < 0.05:
+                yield self._commit(i + 1, date, "update readme", [("README.md", "synthetic project {0}\n".format(i))])
+            else:
+                changed = rng.sample(range(self.files), min(self.files, rng.randint(1, 3)))
+                method_id = rng.randrange(self.methods)
+                for file_id in changed:
+                    versions[file_id][method_id] += 1
+                yield self._commit(i + 1, date, self._get_message(rng, changed[0], method_id),
+                                   [(self._get_file_path(f), self._get_file_content(f, versions[f])) for f in changed])
+            if i in tagged:
+                yield "reset refs/tags/{0}\nfrom :{1}\n\n".format(self.get_tag_name(tagged[i]), i + 1).encode()
+
+    def create(self):
+        """
+        Writes the repository at path through git fast-import, replacing a synthetic repository there. Any other
+        directory, e.g. a clone of the project, is never removed.
+        """
+        if os.path.exists(self.path):
+            if not os.path.exists(os.path.join(self.path, ".git", self.MARKER)):
+                raise ValueError("{0} exists and is not a synthetic repository".format(self.path))
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        git = ["git", "-C", self.path]
+        subprocess.run(git + ["init", "-q"], check=True)
+        subprocess.run(git + ["symbolic-ref", "HEAD", "refs/heads/master"], check=True)
+        open(os.path.join(self.path, ".git", self.MARKER), "w").close()
+        importer = subprocess.Popen(git + ["fast-import", "--quiet"], stdin=subprocess.PIPE)
+        try:
+            for chunk in self._stream():
+                importer.stdin.write(chunk)
+        finally:
+            importer.stdin.close()
+        if importer.wait():
+            raise subprocess.CalledProcessError(importer.returncode, "git fast-import")
+        subprocess.run(git + ["checkout", "-q", "-f", "master"], check=True)
+        subprocess.run(git + ["remote", "add", "origin", "https://github.com/{0}/{1}.git".format(
+            self.github_user_name, self.github_name)], check=True)
+        return self
+
+    def get_issues(self, url=None):
+        """
+        The jira issues of the repository, as issues.get_jira_issues gives them.
+        """
+        url = url or Config().config['REPO']['JiraURL']
+        name = lambda n: SimpleNamespace(name=n)
+        issues = []
+        for issue_id, issue_type in enumerate(self.issues_types):
+            date = datetime.fromtimestamp(self.START_DATE + issue_id * self.COMMIT_INTERVAL, timezone.utc).isoformat()
+            fields = {'issuetype': name(issue_type), 'priority': name('Major'), 'resolution': name('Fixed'),
+                      'status': name('Closed'), 'project': name(self.jira_key), 'creator': name('synthetic'),
+                      'reporter': name('synthetic'), 'assignee': name('synthetic'),
+                      'summary': "{0} {1}".format(issue_type, issue_id + 1), 'description': "synthetic issue",
+                      'environment': None, 'created': date, 'updated': date, 'resolutiondate': date,
+                      'lastViewed': None, 'duedate': None, 'workratio': -1, 'timeoriginalestimate': None,
+                      'timeestimate': None, 'timespent': None, 'aggregatetimespent': None,
+                      'aggregatetimeestimate': None, 'aggregatetimeoriginalestimate': None,
+                      'components': [], 'labels': [], 'versions': [], 'fixVersions': [], 'issuelinks': [],
+                      'subtasks': []}
+            issue = SimpleNamespace(key="{0}-{1}".format(self.jira_key, issue_id + 1), fields=SimpleNamespace(**fields))
+            issues.append(Issue(issue, url))
+        return issues
+
+    def seed_jira(self, url=None):
+        """
+        Stores the issues in the cache of get_jira_issues, so it does not query jira.
+        """
+        url = url or Config().config['REPO']['JiraURL']
+        get_jira_issues.put(self.jira_key, self.get_issues(url), url)
+
 
 def main():
-    return
+    parser = argparse.ArgumentParser(description='Create a synthetic java repository and its jira issues')
+    parser.add_argument('-g', '--github_repo_name', dest='github', action='store', default='synthetic',
+                        help='the name of the repository, created under the RepoDir of config.ini')
+    parser.add_argument('-j', '--jira_name', dest='jira', action='store', default='SYN', help='the jira key of the issues')
+    parser.add_argument('-c', '--commits', dest='commits', action='store', default=1000, type=int)
+    parser.add_argument('-f', '--files', dest='files', action='store', default=50, type=int)
+    parser.add_argument('-m', '--methods', dest='methods', action='store', default=5, type=int)
+    parser.add_argument('-t', '--tags', dest='tags', action='store', default=10, type=int)
+    parser.add_argument('-b', '--bug_ratio', dest='bug_ratio', action='store', default=0.3, type=float)
+    parser.add_argument('-s', '--seed', dest='seed', action='store', default=0, type=int)
+    args = parser.parse_args()
+    repo = SyntheticRepo.from_project(Project(args.github.lower(), args.jira.upper()), commits=args.commits,
+                                      files=args.files, methods=args.methods, tags=args.tags,
+                                      bug_ratio=args.bug_ratio, seed=args.seed)
+    repo.create()
+    repo.seed_jira()
+    print("created {0} with {1} commits and {2} tags".format(repo.path, repo.commits, repo.tags))
+
 
 if __name__ == "__main__":
     main()
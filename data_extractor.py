@@ -1,20 +1,24 @@
 import os
 from datetime import datetime
-from functools import reduce
-from pathlib import Path
+from itertools import islice
 
 import git
 import json
+import numpy as np
 import pandas as pd
 
-from commit import Commit, CommittedFile
+from commit import Commit
+from commit_table import CommitTable
 from config import Config
 from fixing_issues import VersionInfo
 from issues import get_jira_issues
-from version_selector import ConfigurationSelectVersion, BinSelectVersion, QuadraticSelectVersion, VersionType, AbstractSelectVersions
+from version_selector import ConfigurationSelectVersion, BinSelectVersion, QuadraticSelectVersion, VersionType, AbstractSelectVersions, \
+    VersionParser
 from versions import Version
 from caching import cached
+from project_store import ProjectStore
 from repo import Repo
+from tracing import span, traced
 
 
 class DataExtractor(object):
@@ -43,20 +47,39 @@ class DataExtractor(object):
         self.bugged_files_between_versions = None
         self.selected_versions = None
         self.selected_config = self.read_selected_config()
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = ProjectStore(self.github_name)
+        return self._store
+
+    def close(self):
+        """
+        Closes the connection to the project store, the next use of the store opens it again.
+        """
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_selection(self, selected):
+        return Config.get_short_name(self.get_selected_versions()) if selected else ''
 
     def set_selected_config(self, val):
         self.selected_config = val
-        out_dir = Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'],
-                         Config().config['DATA_EXTRACTION']['SelectedVersionsInd']))
-        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        out_dir = Config.get_data_dir(Config().config['DATA_EXTRACTION']['SelectedVersionsInd'])
         with open(os.path.join(out_dir, self.github_name), "w") as f:
             json.dump({"selected_config": self.selected_config}, f)
 
     def read_selected_config(self):
-        out_dir = Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'],
-                         Config().config['DATA_EXTRACTION']['SelectedVersionsInd']))
+        out_dir = Config.get_data_dir(Config().config['DATA_EXTRACTION']['SelectedVersionsInd'])
         path = os.path.join(out_dir, self.github_name)
         if not os.path.exists(path):
             return 0
@@ -77,11 +100,11 @@ class DataExtractor(object):
 
     @staticmethod
     def _get_repo_versions(repo):
-        repo_tags = sorted(list(repo.tags), key=lambda t: t.commit.committed_date)
+        repo_tags = sorted(list(repo.tags), key=lambda t: (t.commit.committed_date, VersionParser.sort_key(t.name)))
         tags = zip(list(repo_tags)[1:], list(repo_tags))
         versions = list(map(lambda tag: Version(tag[0], DataExtractor._version_files(tag[0], tag[1])),
                             tags))
-        return sorted(versions, key=lambda version: version._commit._commit_date)
+        return sorted(versions, key=VersionParser.date_key)
 
     def _get_bugged_files_between_versions(self, versions, analyze_methods=False):
         tags_commits = self._get_commits_between_versions(versions)
@@ -91,16 +114,25 @@ class DataExtractor(object):
                 tags.append(VersionInfo(tag, tags_commits[tag], self.git_repo, analyze_methods=analyze_methods))
             else:
                 print("not commits for", tag._name)
-        return sorted(tags, key=lambda x: x.version._commit._commit_date)
+        return sorted(tags, key=lambda x: VersionParser.date_key(x.version))
 
     def init_jira_commits(self):
-        self.jira_issues = get_jira_issues(self.jira_project_name, self.jira_url)
-        self.commits = self._get_repo_commits(self.git_repo, self.jira_issues)
-        self.versions = self._get_repo_versions(self.git_repo)
+        with span("jira.issues", "ingestion") as s:
+            self.jira_issues = get_jira_issues(self.jira_project_name, self.jira_url)
+            s.set_rows(len(self.jira_issues))
+        with span("git.commits", "ingestion") as s:
+            self.commits = self._get_repo_commits(self.git_repo, self.jira_issues)
+            s.set_rows(len(self.commits))
+        with span("git.versions", "ingestion") as s:
+            self.versions = self._get_repo_versions(self.git_repo)
+            s.set_rows(len(self.versions))
         print("number of commits: ", len(self.commits))
         print("number of tags: ", len(self.versions))
-        self.bugged_files_between_versions = self._get_bugged_files_between_versions(self.versions)
+        with span("git.bugged_files", "ingestion") as s:
+            self.bugged_files_between_versions = self._get_bugged_files_between_versions(self.versions)
+            s.set_rows(len(self.bugged_files_between_versions))
 
+    @traced("data_extractor.extract", "ingestion")
     def extract(self, selected_versions=False):
         tags = self.bugged_files_between_versions
         self._store_issues()
@@ -141,28 +173,45 @@ class DataExtractor(object):
         dummies_path = os.path.join(commited_files_dir, self.jira_project_name + "_dummies.csv")
         issues_df['issue_id'] = issues_df['key'].apply(lambda k: int(k.split('-')[1]))
         issues_df.to_csv(dummies_path, index=False, sep=';')
+        self.store.write("issues", issues_df)
 
     def _store_commited_files(self):
         columns = ["file_name", "insertions", "deletions", "changes", 'is_java', "commit_id", "issue_id", "commit_date", "commit_url", "bug_url"]
-        commited_files = list(map(lambda c:
-                                  list(map(lambda f:
-                                           [f.name, f.insertions, f.deletions, f.insertions + f.deletions, f.is_java, c._commit_id,
-                                            c._issue_id, c._commit_formatted_date, self.get_commit_url(c._commit_id), c.get_issue_url()],
-                                           c._files)), self.commits))
-
-        commited_files = reduce(list.__add__, commited_files, [])
-        df = pd.DataFrame(commited_files, columns=columns)
+        commits = self._get_commits_columns()
+        commit_index = self.commits.get_commit_index()
+        insertions = self.commits.insertions.astype('int64')
+        deletions = self.commits.deletions.astype('int64')
+        df = pd.DataFrame({"file_name": self.commits.get_file_names(),
+                           "insertions": insertions,
+                           "deletions": deletions,
+                           "changes": insertions + deletions,
+                           "is_java": self.commits.file_is_java[self.commits.file_ids],
+                           "commit_id": commits["commit_id"][commit_index],
+                           "issue_id": commits["issue_id"][commit_index],
+                           "commit_date": commits["commit_date"][commit_index],
+                           "commit_url": commits["commit_url"][commit_index],
+                           "bug_url": commits["bug_url"][commit_index]}, columns=columns)
         commited_files_dir = self._get_caching_path("CommittedFiles")
         path = os.path.join(commited_files_dir, self.jira_project_name + ".csv")
         df.to_csv(path, index=False, sep=';')
+        self.store.write("committed_files", df)
+
+    def _get_commits_columns(self):
+        shas = self.commits.get_shas()
+        return {"commit_id": np.array(shas, dtype=object),
+                "is_java": self.commits.is_java_commit,
+                "issue_id": self.commits.issue_ids,
+                "commit_date": self.commits.get_formatted_dates(),
+                "commit_url": np.array(list(map(self.get_commit_url, shas)), dtype=object),
+                "bug_url": self.commits.get_issue_urls()}
 
     def _store_commits(self):
         columns = ["commit_id", 'is_java', "issue_id", "commit_date", "commit_url", "bug_url"]
-        commits = list(map(lambda c: [c._commit_id, c.is_java_commit, c._issue_id, c._commit_formatted_date, self.get_commit_url(c._commit_id), c.get_issue_url()], self.commits))
-        df = pd.DataFrame(commits, columns=columns)
+        df = pd.DataFrame(self._get_commits_columns(), columns=columns)
         commits_dir = self._get_caching_path("Commits")
         path = os.path.join(commits_dir, self.jira_project_name + ".csv")
         df.to_csv(path, index=False, sep=';')
+        self.store.write("commits", df)
 
     def _store_versions(self, tags, selected=False):
         columns = ["version_name", "#commited_files_in_version", "#bugged_files_in_version", "bugged_ratio",
@@ -189,6 +238,7 @@ class DataExtractor(object):
             Config.assert_dir_exists(versions_dir)
             path = os.path.join(versions_dir, self.jira_project_name + ".csv")
         df.to_csv(path, index=False, sep=';')
+        self.store.write("versions", df, selection=self._get_selection(selected))
 
     def get_commit_url(self, commit_sha):
         return os.path.normpath(os.path.join(self.git_url, commit_sha))
@@ -199,11 +249,15 @@ class DataExtractor(object):
         else:
             versions_infos_dir = os.path.join(self._get_caching_path("VersionsInfos"), self.jira_project_name)
         Config.assert_dir_exists(versions_infos_dir)
+        dfs = []
         for tag in tags:
             df = pd.DataFrame(tag.commits_shas, columns=["commit_id", "is_buggy"])
             version_name = os.path.normpath(tag.version._name).replace(os.path.sep, "_")
             path = os.path.join(versions_infos_dir, version_name + ".csv")
             df.to_csv(path, index=False, sep=';')
+            dfs.append(df.assign(version_name=tag.version._name))
+        if dfs:
+            self.store.write("versions_infos", pd.concat(dfs, ignore_index=True), selection=self._get_selection(selected))
 
     def _store_methods(self, tags):
         methods_dir = os.path.join(self._get_caching_path("SelectedMethods"), self.jira_project_name,
@@ -230,6 +284,7 @@ class DataExtractor(object):
         else:
             files_dir = os.path.join(self._get_caching_path("Files"), self.jira_project_name)
         Config.assert_dir_exists(files_dir)
+        dfs = []
         for tag in tags:
             files = {file_name: False for file_name in tag.version_files}
             files.update({file_name: True for file_name in tag.bugged_files})
@@ -237,25 +292,20 @@ class DataExtractor(object):
             version_name = tag.version._name.replace(os.path.sep, "_")
             path = os.path.join(files_dir, version_name + ".csv")
             df.to_csv(path, index=False, sep=';')
+            dfs.append(df.assign(version_name=tag.version._name))
+        if dfs:
+            self.store.write("files", pd.concat(dfs, ignore_index=True), selection=self._get_selection(selected))
 
     def _get_commits_between_versions(self, versions):
-        sorted_versions = sorted(versions, key=lambda version: version._commit._commit_date)
-        sorted_commits_and_versions = sorted(versions + list(filter(lambda x: x.is_java_commit, self.commits)),
-                                             key=lambda version: version._commit._commit_date if hasattr(version,
-                                                                                                         "_commit") else version._commit_date)
-        versions_indices = list(map(lambda version: (version, sorted_commits_and_versions.index(version)), sorted_versions))
-        selected_versions = list(filter(lambda vers: vers[0][1] < vers[1][1], zip(versions_indices, versions_indices[1:])))
-        return dict(
-            map(lambda vers: (vers[0][0], sorted_commits_and_versions[vers[0][1] + 1: vers[1][1]]), selected_versions))
+        # the java commits of a version are those dated from it (inclusive) up to the next version (exclusive)
+        sorted_versions = sorted(versions, key=VersionParser.date_key)
+        order, dates = self.commits.get_sorted_java_commits()
+        bounds = np.searchsorted(dates, list(map(lambda version: version._commit._commit_date, sorted_versions)), side='left')
+        return dict(map(lambda i: (sorted_versions[i], list(map(lambda j: self.commits[int(j)], order[bounds[i]: bounds[i + 1]]))),
+                        range(len(sorted_versions) - 1)))
 
     def _get_caching_path(self, config_name):
-        config = Config().config
-        file_name = config['DATA_EXTRACTION'][config_name]
-        repository_data = config["CACHING"]["RepositoryData"]
-        repository_data = Config().get_work_dir_path(repository_data)
-        path = os.path.join(repository_data, file_name, self.github_name)
-        Config.assert_dir_exists(path)
-        return path
+        return Config.get_data_dir(Config().config['DATA_EXTRACTION'][config_name], self.github_name)
 
     @staticmethod
     def _version_files(new_tag, prev_tag):
@@ -284,37 +334,56 @@ class DataExtractor(object):
                         return word
             return "0"
 
-        commits = []
-        java_commits = DataExtractor._get_commits_files(repo)
-        for git_commit in java_commits:
-            bug_id = "0"
-            if all(list(map(lambda x: not x.is_java, java_commits[git_commit]))):
-                commit = Commit.init_commit_by_git_commit(git_commit, bug_id, None, java_commits[git_commit], False)
-                commits.append(commit)
+        commits = CommitTable(repo.working_dir)
+        for sha, date, summary, files in DataExtractor._get_commits_files(repo):
+            if not any(map(lambda f: f[0].endswith(".java"), files)):
+                commits.append(sha, date, "0", None, files, False)
                 continue
-            try:
-                commit_text = DataExtractor._clean_commit_message(git_commit.summary)
-            except:
-                continue
-            bug_id = get_bug_num_from_comit_text(commit_text, issues.keys())
-            commits.append(
-                Commit.init_commit_by_git_commit(git_commit, bug_id, issues.get(bug_id), java_commits[git_commit]))
-        return commits
+            bug_id = get_bug_num_from_comit_text(DataExtractor._clean_commit_message(summary), issues.keys())
+            commits.append(sha, date, bug_id, issues.get(bug_id), files)
+        return commits.close()
 
     @staticmethod
-    def _get_commits_files(repo):
-        data = repo.git.log('--numstat','--pretty=format:"sha: %H"').split("sha: ")
-        comms = {}
-        for d in data[1:]:
-            d = d.replace('"', '').replace('\n\n', '\n').split('\n')
-            commit_sha = d[0]
-            comms[commit_sha] = []
-            for x in d[1:-1]:
-                insertions, deletions, name = x.split('\t')
-                names = Commit.fix_renamed_files([name])
-                comms[commit_sha].extend(list(map(lambda n: CommittedFile(commit_sha, n, insertions, deletions), names)))
-        return dict(map(lambda x: (repo.commit(x), comms[x]), filter(lambda x: comms[x], comms)))
+    def _split_stream(stream, separator, chunk_size=1 << 16):
+        """
+        The parts of a byte stream between the separators, read one chunk at a time.
+        """
+        rest = b''
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            parts = (rest + chunk).split(separator)
+            rest = parts.pop()
+            yield from parts
+        yield rest
 
+    @staticmethod
+    def _get_commits_files(repo):
+        """
+        The sha, date, summary and committed files (name, insertions, deletions) of every commit with files, read
+        from the stream of git log. Only the table built from them holds the history of the repository.
+        """
+        # every field ends with a NUL, the numstat lines of a commit follow its message
+        process = repo.git.log('--numstat', '--pretty=format:%x00%H%x00%ct%x00%ci%x00%B%x00', as_process=True)
+        parts = DataExtractor._split_stream(process.stdout, b'\0')
+        next(parts, None)
+        while True:
+            fields = list(islice(parts, 5))
+            if len(fields) < 5:
+                break
+            sha, timestamp, date, message, numstat = map(lambda f: f.decode('utf-8', 'replace'), fields)
+            files = []
+            for line in numstat.replace('"', '').split('\n'):
+                if not line:
+                    continue
+                insertions, deletions, name = line.split('\t', 2)
+                if not insertions.isnumeric():
+                    # a binary file
+                    insertions, deletions = '0', '0'
+                files.extend((n, int(insertions), int(deletions)) for n in Commit.fix_renamed_files([name]))
+            if files:
+                yield sha, Commit.get_log_date(int(timestamp), date.split()[-1]), message.split('\n', 1)[0], files
+        process.wait()
+
+    @traced("versions.select", "selection")
     def choose_versions(self, repo=None, version_num=5, configurations=False,
                         algorithm="bin", version_type=VersionType.Untyped, strict=True):
         # if self.get_selected_versions() is not None:
@@ -349,6 +418,8 @@ class DataExtractor(object):
         assert None
 
     def get_files_bugged(self, version):
+        if self.store.has("files", selection='', version_name=version):
+            return self.store.get_files(version).to_dict('records')
         files_dir = self._get_caching_path("Files")
         path = os.path.join(files_dir, version+".csv")
         if os.path.exists(path):
@@ -370,6 +441,16 @@ class DataExtractor(object):
             path = os.path.join(cache_path, self.jira_project_name, version.replace(os.path.sep, "_") + '.csv')
         return path
 
+    def get_bugged_files(self, version, selected_versions=False):
+        """
+        The file_name and is_buggy of every file of the version, from the project store, or from the csv export
+        of projects extracted before the store existed.
+        """
+        selection = self._get_selection(selected_versions)
+        if self.store.has("files", selection=selection, version_name=version):
+            return self.store.get_files(version, selection)
+        return pd.read_csv(self.get_bugged_files_path(version, selected_versions), sep=';')
+
     def get_bugged_methods_path(self, version):
         cache_path = self._get_caching_path("SelectedMethods")
         path = os.path.join(cache_path, self.jira_project_name, Config.get_short_name(self.get_selected_versions()), version.replace(os.path.sep, "_") + '.csv')
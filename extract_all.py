@@ -1,19 +1,14 @@
-from Main import Main
+from orchestrator import Orchestrator, get_selection_options
 from projects import ProjectName
-from version_selector import VersionType
 
 
 def extract_all():
-    for n in map(lambda x: x.name, ProjectName):
-        m = Main()
-        m.set_project_enum(n)
-        m.choose_versions(version_num=3, algorithm='bin',
-                             version_type=VersionType["Untyped"], strict=False)
-        m.set_version_selection(version_num=3, algorithm='bin',
-                                   version_type=VersionType["Untyped"], strict=False,
-                                selected_config=0)
-        m.extract()
+    # every project is a task of the orchestrator, a run resumes the previous one and a failure stops only its project
+    projects = list(map(lambda x: x.name, ProjectName))
+    Orchestrator.from_config(projects, selection=get_selection_options(version_num=3, algorithm='bin',
+                                                                       version_type="Untyped", strict=False,
+                                                                       selected_config=0)).run()
 
 
 if __name__ == '__main__':
-    extract_all()
\ No newline at end of file
+    extract_all()
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from pandas.api.types import is_bool_dtype, is_integer_dtype, infer_dtype
+
+from config import Config
+
+
+def downcast(df):
+    """
+    Casts the columns of df to the smallest dtypes that keep their values: object columns holding only
+    booleans (the smell columns after an outer merge and fillna) to bool and integer columns to int8/int16/int32.
+    Float columns are left as they are, the feature matrices are float32 anyway.
+    """
+    dtypes = {}
+    for col in df.columns:
+        series = df[col]
+        if is_bool_dtype(series):
+            continue
+        if is_integer_dtype(series):
+            dtypes[col] = pd.to_numeric(series, downcast='integer').dtype
+        elif series.dtype == object and infer_dtype(series, skipna=False) == 'boolean':
+            dtypes[col] = bool
+    return df.astype(dtypes, copy=False) if dtypes else df
+
+
+class FeatureMatrix(object):
+    """
+    Builds the float32 feature matrix of the classifier, column by column. The matrix is a scipy sparse
+    matrix when its density (mostly that of the smell blocks, which are overwhelmingly False) is below
+    [CLASSIFICATION] SparseDensity, otherwise a dense array.
+    """
+    def __init__(self, density=None):
+        if density is None:
+            density = float(Config().config['CLASSIFICATION'].get('SparseDensity', '0.3'))
+        self.density = density
+
+    def is_sparse(self, nonzeros, rows, columns):
+        return rows * columns > 0 and nonzeros / float(rows * columns) < self.density
+
+    @staticmethod
+    def _to_float32(values):
+        return np.asarray(values, dtype=np.float32)
+
+    def _build_sparse(self, columns_values, rows, sparse_format):
+        indices, data, indptr = [], [], [0]
+        for values in columns_values:
+            values = self._to_float32(values)
+            nonzero = np.flatnonzero(values)
+            indices.append(nonzero.astype(np.int32))
+            data.append(values[nonzero])
+            indptr.append(indptr[-1] + len(nonzero))
+        matrix = sparse.csc_matrix((np.concatenate(data) if data else np.array([], dtype=np.float32),
+                                    np.concatenate(indices) if indices else np.array([], dtype=np.int32),
+                                    np.array(indptr, dtype=np.int64)), shape=(rows, len(indptr) - 1))
+        return matrix.asformat(sparse_format)
+
+    def from_frame(self, df, sparse_format='csr'):
+        """
+        The matrix of the columns of df, csr by default as predict prefers it.
+        """
+        nonzeros = sum(np.count_nonzero(self._to_float32(df[c].values)) for c in df.columns)
+        if self.is_sparse(nonzeros, len(df), len(df.columns)):
+            return self._build_sparse((df[c].values for c in df.columns), len(df), sparse_format)
+        return np.column_stack([self._to_float32(df[c].values) for c in df.columns]) if len(df.columns) else \
+            np.empty((len(df), 0), dtype=np.float32)
+
+    def from_training_set(self, training_set, columns, sparse_format='csc'):
+        """
+        The matrix of the columns of a TrainingSet, read one column at a time. csc by default as fit prefers it,
+        a dense matrix is memory mapped. The density comes from the counts of the training set, so every column
+        is read once.
+        """
+        nonzeros = sum(training_set.count_nonzero(c) for c in columns)
+        if self.is_sparse(nonzeros, len(training_set), len(columns)):
+            return self._build_sparse((training_set.read_column(c).values for c in columns), len(training_set),
+                                      sparse_format)
+        return training_set.to_matrix(columns)
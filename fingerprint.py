@@ -0,0 +1,151 @@
+import hashlib
+import inspect
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+
+class Fingerprint(object):
+    """
+    A content hash of the inputs of a stage: its data (frames, arrays, files), its configuration and the source of
+    the code that computes it. A stage whose fingerprint did not change gives the result it gave before.
+    """
+    def __init__(self, *values):
+        self._hash = hashlib.sha1()
+        self.update(*values)
+
+    def update(self, *values):
+        for value in values:
+            self._update(value)
+        return self
+
+    def _tag(self, tag, size=0):
+        self._hash.update("{0}:{1};".format(tag, size).encode())
+
+    def _update(self, value):
+        if isinstance(value, Fingerprint):
+            self._tag("fingerprint")
+            self._hash.update(value.hexdigest().encode())
+        elif hasattr(value, "get_fingerprint"):
+            self._update(value.get_fingerprint())
+        elif isinstance(value, pd.DataFrame):
+            self._tag("frame", len(value))
+            self._update([list(map(str, value.columns)), list(map(str, value.dtypes))])
+            self._hash.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+        elif isinstance(value, pd.Series):
+            self._tag("series", len(value))
+            self._update([str(value.name), str(value.dtype)])
+            self._hash.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+        elif sparse.issparse(value):
+            value = value.tocsr()
+            self._tag("sparse", value.nnz)
+            self._update([value.shape, value.data, value.indices, value.indptr])
+        elif isinstance(value, np.ndarray):
+            self._tag("array " + str(value.dtype), value.shape)
+            if value.dtype == object:
+                self._update(pd.Series(value.ravel()))
+            else:
+                self._hash.update(memoryview(np.ascontiguousarray(value)).cast('B'))
+        elif isinstance(value, dict):
+            self._tag("dict", len(value))
+            for k in sorted(value, key=repr):
+                self._update(k)
+                self._update(value[k])
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            self._tag(type(value).__name__, len(value))
+            for v in (sorted(value, key=repr) if isinstance(value, (set, frozenset)) else value):
+                self._update(v)
+        elif hasattr(value, "get_params") and not isinstance(value, type):
+            # an estimator, by its class and parameters
+            self._tag("estimator " + type(value).__name__)
+            self._update(value.get_params(deep=False))
+        elif callable(value) and hasattr(value, "__qualname__"):
+            # the repr of a function holds its address
+            self._tag("callable")
+            self._hash.update("{0}.{1}".format(value.__module__, value.__qualname__).encode())
+        else:
+            self._tag(type(value).__name__)
+            self._hash.update(repr(value).encode())
+
+    def update_files(self, paths):
+        """
+        Adds the content of the files, a missing file counts as empty.
+        """
+        for path in paths:
+            self._tag("file")
+            self._hash.update(os.path.basename(path).encode())
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        self._hash.update(block)
+        return self
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and other.hexdigest() == self.hexdigest()
+
+    def __hash__(self):
+        return hash(self.hexdigest())
+
+    def __repr__(self):
+        return self.hexdigest()
+
+    @staticmethod
+    def of_code(*modules):
+        """
+        The fingerprint of the source files of the modules, the code version of a stage.
+        """
+        return Fingerprint().update_files(sorted(inspect.getsourcefile(m) for m in modules))
+
+
+class StageStore(object):
+    """
+    The results of stages kept in a directory, each with the fingerprint of the inputs it was computed from.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _get_paths(self, name):
+        return os.path.join(self.path, name + ".pkl"), os.path.join(self.path, name + ".fingerprint")
+
+    def has(self, name, fingerprint):
+        result_path, fingerprint_path = self._get_paths(name)
+        if not (os.path.exists(result_path) and os.path.exists(fingerprint_path)):
+            return False
+        with open(fingerprint_path) as f:
+            return f.read().strip() == fingerprint.hexdigest()
+
+    def get(self, name, fingerprint, default=None):
+        if not self.has(name, fingerprint):
+            return default
+        with open(self._get_paths(name)[0], "rb") as f:
+            stored_fingerprint, value = pickle.load(f)
+        # the fingerprint file may be newer than the result, if writing the result failed
+        return value if stored_fingerprint == fingerprint.hexdigest() else default
+
+    def put(self, name, fingerprint, value):
+        os.makedirs(self.path, exist_ok=True)
+        result_path, fingerprint_path = self._get_paths(name)
+        with open(result_path + ".tmp", "wb") as f:
+            pickle.dump((fingerprint.hexdigest(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(result_path + ".tmp", result_path)
+        with open(fingerprint_path + ".tmp", "w") as f:
+            f.write(fingerprint.hexdigest())
+        os.replace(fingerprint_path + ".tmp", fingerprint_path)
+        return value
+
+    def cached(self, name, fingerprint, compute):
+        """
+        The stored result of the stage if its fingerprint matches, otherwise computes and stores it.
+        """
+        if self.has(name, fingerprint):
+            with open(self._get_paths(name)[0], "rb") as f:
+                stored_fingerprint, value = pickle.load(f)
+            if stored_fingerprint == fingerprint.hexdigest():
+                return value
+        return self.put(name, fingerprint, compute())
@@ -28,7 +28,7 @@ class VersionInfo(object):
 
     @staticmethod
     def get_commits_files(commits):
-        return set(VersionInfo.filter_java_files(reduce(list.__add__, map(lambda commit: list(map(lambda x: x.name, commit._files)), commits), [])))
+        return set(VersionInfo.filter_java_files(set(f.name for commit in commits for f in commit._files)))
 
     @staticmethod
     def filter_java_files(files):
@@ -29,7 +29,7 @@ class Issue(object):
             self.fields[k] = ' '.join(self.fields[k].split())
 
 
-@cached("apache_jira")
+@cached("apache_jira", inputs=lambda project_name, url="http://issues.apache.org/jira", bunch=100: [url])
 def get_jira_issues(project_name, url="http://issues.apache.org/jira", bunch=100):
     jira_conn = jira.JIRA(url)
     all_issues=[]
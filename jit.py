@@ -0,0 +1,266 @@
+import argparse
+import json
+import math
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import git
+import javalang
+import pandas as pd
+from pandas.api.types import is_bool_dtype
+
+from classification_instance import ClassificationInstance
+from config import Config
+from metrics.commented_code_detector import CommentFilter, Halstead
+from metrics.process_history import ProcessHistoryIndex
+from metrics.version_metrics import ProcessExtractor
+from metrics.version_metrics_name import DataNameEnum, DataType
+from projects import ProjectName, Project
+from training_set import TrainingSet
+from tracing import span
+
+
+PROCESS_STREAM = "all_process"
+PROCESS_COLUMNS = ['insertions', 'deletions', 'changes']
+# the added lines of a -U0 diff hunk: "@@ -12,3 +12,4 @@"
+HUNK = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@', re.MULTILINE)
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+
+class RunningProcess(object):
+    """
+    The running aggregates of the all_process history of every file, as the checkpoints of ProcessHistoryIndex,
+    updated by every commit after the version. Its features are those ProcessExtractor gives for the same commits.
+    """
+    def __init__(self, columns=PROCESS_COLUMNS, checkpoint=None):
+        self.columns = columns
+        self.aggregates = checkpoint.to_dict('index') if checkpoint is not None else {}
+
+    def _empty(self):
+        aggregates = {('rows', 'rows'): 0}
+        for col in self.columns:
+            aggregates.update({('count', col): 0, ('sum', col): 0, ('sumsq', col): 0, ('min', col): math.nan,
+                               ('max', col): math.nan})
+        return aggregates
+
+    def add(self, file_name, values):
+        aggregates = self.aggregates.setdefault(file_name, self._empty())
+        aggregates[('rows', 'rows')] += 1
+        for col in self.columns:
+            v = values[col]
+            aggregates[('count', col)] += 1
+            aggregates[('sum', col)] += v
+            aggregates[('sumsq', col)] += v * v
+            # nan compares false, the first value replaces it
+            if not aggregates[('min', col)] <= v:
+                aggregates[('min', col)] = v
+            if not aggregates[('max', col)] >= v:
+                aggregates[('max', col)] = v
+
+    def get_features(self, file_names):
+        checkpoint = pd.DataFrame([self.aggregates.get(f) or self._empty() for f in file_names], index=file_names)
+        checkpoint.columns = pd.MultiIndex.from_tuples(checkpoint.columns)
+        counts, stats = ProcessHistoryIndex.describe(self.columns, checkpoint)
+        return ProcessExtractor.format_features(self.columns, counts, stats, file_names, PROCESS_STREAM)
+
+
+class JITPredictor(object):
+    """
+    Just in time defect prediction: keeps the classes model of a project and the features of the files at its last
+    version in memory, and scores every new commit of HEAD from the files it touches. Their process features and
+    Halstead metrics are recomputed from the commit, and a javalang parse of the new content gives the methods the
+    commit changed. The features of the external tools keep their values at the version.
+    """
+    HALSTEAD = {d.value.column_name: d.value.name for d in DataNameEnum if d.value.data_type == DataType.HalsteadDataType}
+
+    def __init__(self, repo_path, classification_instance, features, process, commit):
+        self.repo = git.Repo(repo_path)
+        self.classification_instance = classification_instance
+        if classification_instance.classifier is None:
+            classification_instance.fit()
+        # one row per file, indexed by its name
+        self.features = features
+        self.defaults = {c: False if is_bool_dtype(features[c]) else 0 for c in features.columns}
+        self.process = process
+        self.commit = commit
+
+    @staticmethod
+    def from_project(project: Project, version=None):
+        """
+        The predictor of the last training version of the project (the testing version of Main.extract_metrics),
+        caught up with the commits of HEAD.
+        """
+        from Main import Main
+        main = Main()
+        main.project = project
+        main.set_extractor()
+        version = version or main.extractor.get_selected_versions()[:-1][-1]
+        classes_data = main.get_data_dirs()[0]
+        testing = pd.read_csv(os.path.join(classes_data, version + "_aggregated_classes_.csv"), sep=';')
+        testing = main.fillna(testing.drop(["Method_ids", "Class"], axis=1, errors='ignore'), default='')
+        names = testing.pop("File").map(os.path.normpath).tolist()
+        training_path = main.get_training_set_path("classes")
+        if TrainingSet.exists(training_path):
+            training = TrainingSet(training_path)
+        else:
+            training = pd.read_csv(os.path.join(main.get_dataset_path("classes"), "training.csv"), sep=';')
+        classification_instance = ClassificationInstance(training, testing.copy(), names,
+                                                         Config.get_data_dir("jit", project.github()), save_all=False)
+        history = ProcessHistoryIndex.for_project(project)
+        checkpoints = history.checkpoints[PROCESS_STREAM]
+        checkpoint = history.get_checkpoint(PROCESS_STREAM, history.get_version_date(version),
+                                            checkpoints.index.get_level_values('file_name').unique())
+        predictor = JITPredictor(project.path(), classification_instance, testing.set_axis(names),
+                                 RunningProcess(history.columns[PROCESS_STREAM], checkpoint),
+                                 git.Repo(project.path()).commit(version.replace('\\', '/')).hexsha)
+        predictor.catch_up()
+        return predictor
+
+    def _get_new_commits(self):
+        head = self.repo.head.commit.hexsha
+        if head == self.commit:
+            return head, []
+        # the commits of merged branches are counted one by one, as in the committed files of the pipeline
+        return head, list(self.repo.iter_commits("{0}..{1}".format(self.commit, head), no_merges=True, reverse=True))
+
+    @staticmethod
+    def get_changed_lines(diff):
+        lines = set()
+        for start, count in HUNK.findall(diff):
+            count = 1 if count == '' else int(count)
+            # a hunk that only deletes touches the line it follows
+            lines.update(range(int(start), int(start) + max(count, 1)))
+        return lines
+
+    @staticmethod
+    def get_methods(file_name, content):
+        """
+        The methods and constructors of the java source, with the first and last line of each, None if it does not
+        parse. A method ends where the next one starts.
+        """
+        try:
+            tree = javalang.parse.parse(content)
+        except (javalang.parser.JavaSyntaxError, javalang.tokenizer.LexerError, TypeError, IndexError):
+            return None
+        starts = []
+        for path, node in tree.filter(javalang.tree.Declaration):
+            if not isinstance(node, (javalang.tree.MethodDeclaration, javalang.tree.ConstructorDeclaration)) or \
+                    node.position is None:
+                continue
+            types = [p.name for p in path if isinstance(p, javalang.tree.TypeDeclaration)]
+            parameters = ",".join(p.type.name for p in node.parameters)
+            starts.append((node.position.line, "{0}@{1}.{2}({3})".format(file_name, ".".join(types), node.name,
+                                                                         parameters)))
+        starts.sort()
+        ends = [start - 1 for start, _ in starts[1:]] + [content.count("\n") + 1]
+        return [(method_id, start, end) for (start, method_id), end in zip(starts, ends)]
+
+    def _get_changed_methods(self, commit, path, content):
+        parent = commit.parents[0].hexsha if commit.parents else EMPTY_TREE
+        lines = self.get_changed_lines(self.repo.git.diff(parent, commit.hexsha, "-U0", "--", path))
+        methods = self.get_methods(os.path.normpath(path), content)
+        if methods is None:
+            return []
+        return [method_id for method_id, start, end in methods if any(start <= line <= end for line in lines)]
+
+    def apply(self, commit, with_methods=True):
+        """
+        Updates the features of the java files the commit touches, returns them with the methods it changed in each.
+        """
+        touched = {}
+        for path, stats in commit.stats.files.items():
+            path = str(path)
+            if not path.endswith('.java'):
+                continue
+            file_name = os.path.normpath(path)
+            self.process.add(file_name, {'insertions': stats['insertions'], 'deletions': stats['deletions'],
+                                         'changes': stats['insertions'] + stats['deletions']})
+            try:
+                content = (commit.tree / path).data_stream.read().decode('latin-1')
+            except KeyError:
+                # deleted by the commit
+                self.features = self.features.drop(file_name, errors='ignore')
+                continue
+            values = {self.HALSTEAD[k]: v for k, v in
+                      Halstead(CommentFilter().filterComments(content.splitlines())[0]).getValuesVector().items()}
+            touched[file_name] = (values, self._get_changed_methods(commit, path, content) if with_methods else [])
+        if not touched:
+            return {}
+        process = self.process.get_features(list(touched))
+        new = [f for f in touched if f not in self.features.index]
+        if new:
+            self.features = pd.concat([self.features, pd.DataFrame([self.defaults] * len(new), index=new)])
+        columns = set(self.features.columns)
+        for file_name, (values, _) in touched.items():
+            values.update(process[file_name])
+            values = {k: v for k, v in values.items() if k in columns}
+            self.features.loc[file_name, list(values)] = list(values.values())
+        return {file_name: methods for file_name, (_, methods) in touched.items()}
+
+    def catch_up(self):
+        """
+        Applies the commits between the version and HEAD, without scoring them.
+        """
+        head, commits = self._get_new_commits()
+        with span("jit.catch_up", "jit") as s:
+            for commit in commits:
+                self.apply(commit, with_methods=False)
+            s.set_rows(len(commits))
+        self.commit = head
+
+    def score(self, commit):
+        with span("jit.commit", "jit", commit=commit.hexsha) as s:
+            touched = self.apply(commit)
+            probabilities = {}
+            if touched:
+                proba = self.classification_instance.predict_rows(self.features.loc[list(touched)])
+                probabilities = proba.get("True_probability", pd.Series(0.0, index=proba.index)).to_dict()
+            s.set_rows(len(touched))
+        return {"commit": commit.hexsha, "date": datetime.fromtimestamp(commit.committed_date, timezone.utc).isoformat(),
+                "summary": commit.summary, "seconds": round(s.duration, 3),
+                "files": [{"file": file_name, "probability": probabilities[file_name], "methods": methods}
+                          for file_name, methods in touched.items()]}
+
+    def poll(self):
+        """
+        Scores the commits added to HEAD since the last poll.
+        """
+        head, commits = self._get_new_commits()
+        results = [self.score(commit) for commit in commits]
+        self.commit = head
+        return results
+
+    def watch(self, interval=5.0, out_path=None):
+        while True:
+            for result in self.poll():
+                line = json.dumps(result)
+                print(line)
+                if out_path:
+                    with open(out_path, "a") as f:
+                        f.write(line + "\n")
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score the new commits of a project with its last trained model')
+    parser.add_argument('-c', '--choose', dest='choose', action='store', help='the project to watch')
+    parser.add_argument('-g', '--github_repo_name', dest='github', action='store')
+    parser.add_argument('-j', '--jira_name', dest='jira', action='store')
+    parser.add_argument('-v', '--version', dest='version', action='store', default=None,
+                        help='the version of the features, the last training version by default')
+    parser.add_argument('-i', '--interval', dest='interval', action='store', default=5.0, type=float,
+                        help='seconds between two polls of HEAD')
+    parser.add_argument('-o', '--out', dest='out', action='store', default=None,
+                        help='a json lines file the scores are appended to')
+    args = parser.parse_args()
+    project = ProjectName[args.choose].value if args.choose else Project(args.github.lower(), args.jira.upper())
+    out_path = args.out or os.path.join(Config.get_data_dir("jit", project.github()), "scores.jsonl")
+    predictor = JITPredictor.from_project(project, args.version)
+    print("watching {0} from {1}".format(project.path(), predictor.commit))
+    predictor.watch(args.interval, out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 import os
 import shutil
+import sys
 import tempfile
 from abc import ABC, abstractmethod
-from subprocess import Popen, run
+from subprocess import CalledProcessError
 
 import pandas as pd
 
-from caching import cached
+from caching import cached, git_sha
 from config import Config
+from fingerprint import Fingerprint
+from .jvm_daemon import run_jar
 try:
     from javadiff.javadiff.SourceFile import SourceFile
 except:
@@ -19,6 +22,9 @@ class FileAnalyser(ABC):
     def get_closest_id(self, file_name, line):
         pass
 
+    def get_closest_ids(self, file_names, lines):
+        return pd.Series([self.get_closest_id(f, l) for f, l in zip(file_names, lines)], dtype=object)
+
 
 class JavaParserFileAnalyser(FileAnalyser):
 
@@ -31,6 +37,7 @@ class JavaParserFileAnalyser(FileAnalyser):
         if parser_df is None:
             parser_df = self._parse_source_code(local_path, self.outpath)
         self.parser_df = parser_df
+        self._methods_index = None
         self.classes_paths = self._get_classes_path()
         self.methods_by_path_and_name = self._get_methods_by_path_and_name()
 
@@ -57,9 +64,10 @@ class JavaParserFileAnalyser(FileAnalyser):
         runner = os.path.join(base_dir, Config().config["EXTERNALS"]["JavaParser"])
         outdir = tempfile.mkdtemp()
         outpath = os.path.join(outdir, "sourceCodeInformation.csv")
-        commands = ["java", "-jar", runner.replace("\\\\?\\", ""), "-i", local_path, "-o", outdir]
-        status = run(commands)
-        status.check_returncode()
+        args = ["-i", local_path, "-o", outdir]
+        result = run_jar(runner, args, tool="JavaParser")
+        if not result.ok:
+            raise CalledProcessError(result.returncode, result.command)
         parser_df = pd.read_csv(outpath, delimiter=";")
         shutil.copyfile(outpath, cache_path)
         shutil.rmtree(outdir)
@@ -70,7 +78,8 @@ class JavaParserFileAnalyser(FileAnalyser):
         relative_file_name = file_name.replace(os.path.join(os.path.normpath(self.local_path).lower(), ""), "")
         cond = self.parser_df['File Path'].str.contains(relative_file_name , case=False, regex=False) 
         df = self.parser_df.loc[cond]
-        closest_df = df.iloc[(df["Method Beginning Line"] - line).abs().argsort()[:1]]
+        # the first method of the parser output on a tie, as get_closest_ids
+        closest_df = df.iloc[(df["Method Beginning Line"] - line).abs().argsort(kind="mergesort")[:1]]
         if closest_df.empty:
             return None
         file_path = str(closest_df["File Path"].values[0])
@@ -81,6 +90,52 @@ class JavaParserFileAnalyser(FileAnalyser):
         closest_id = file_path + '@' + package_name + "." + type_name + "." + method_name + parameters
         return closest_id.lower()
 
+    def _get_relative_name(self, file_name):
+        file_name = os.path.normpath(file_name).lower()
+        return file_name.replace(os.path.join(os.path.normpath(self.local_path).lower(), ""), "")
+
+    def _get_methods_index(self):
+        if self._methods_index is None:
+            df = self.parser_df
+            index = pd.DataFrame({
+                "parser_file": df["File Path"].astype(str).str.lower(),
+                "parser_line": pd.to_numeric(df["Method Beginning Line"], errors='coerce'),
+                "method_id": (df["File Path"].astype(str) + '@' + df["Package Name"].astype(str) + "." +
+                              df["Type Name"].astype(str) + "." + df["Method Name"].astype(str) +
+                              df["Parameters"].astype(str)).str.lower(),
+                "order": range(len(df))})
+            index = index.dropna(subset=["parser_line"])
+            index["parser_line"] = index["parser_line"].astype("int64")
+            self._methods_index = index
+        return self._methods_index
+
+    def _match_files(self, relative_names, parser_files):
+        """
+        Maps every distinct file name to the parser files whose path contains it, as get_closest_id does.
+        """
+        pairs = [(name, f) for name in relative_names for f in parser_files if name in f]
+        return pd.DataFrame(pairs, columns=["file", "parser_file"])
+
+    def get_closest_ids(self, file_names, lines):
+        """
+        The get_closest_id of whole columns at once: every distinct file is resolved once and its lines are compared
+        to the methods of the files it resolves to in a single merge. As in get_closest_id the nearest method of
+        all these files is taken, the first of the parser output on a tie.
+        """
+        rows = pd.DataFrame({"file": [self._get_relative_name(str(f)) for f in file_names],
+                             "line": pd.to_numeric(pd.Series(list(lines)), errors='coerce').fillna(0).astype("int64")})
+        rows["row"] = range(len(rows))
+        index = self._get_methods_index()
+        matches = self._match_files(rows["file"].unique(), index["parser_file"].unique())
+        ids = pd.Series([None] * len(rows), dtype=object)
+        if matches.empty:
+            return ids
+        candidates = rows.merge(matches, on="file").merge(index, on="parser_file")
+        candidates["distance"] = (candidates["line"] - candidates["parser_line"]).abs()
+        closest = candidates.sort_values(["row", "distance", "order"], kind="mergesort").drop_duplicates("row")
+        ids.iloc[closest["row"].to_numpy()] = closest["method_id"].to_numpy()
+        return ids
+
     def get_file_path_by_designite(self, package_name, type_name, method_name=None):
         cond = self.parser_df['Package Name'].str.fullmatch(package_name, case=False)
         df = self.parser_df.loc[cond]
@@ -133,7 +188,9 @@ class JavalangFileAnalyser(FileAnalyser):
     def __init__(self, local_path, project_name, version_name):
         self.local_path = local_path
         cache_name = self._get_cache_name(project_name, version_name)
-        analyze = cached(cache_name)(self._analyze)
+        # the parse of a checkout is stale once the checkout moves or the parsing code changes
+        analyze = cached(cache_name, inputs=lambda path: [git_sha(path)],
+                         salt=Fingerprint.of_code(sys.modules[__name__], sys.modules[SourceFile.__module__]))(self._analyze)
         res = analyze(local_path)
         self.methods = res[0]
         self.methods_df = self._store_methods(project_name, version_name, self.methods)
@@ -0,0 +1,299 @@
+import atexit
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import zipfile
+
+from config import Config
+from tracing import span
+from .tool_runner import ToolResult, ToolRunner, ToolSettings, ToolTimeoutError, java_command
+
+# nailgun protocol chunk types, see https://github.com/facebook/nailgun
+CHUNK_HEADER = struct.Struct('>ic')
+CHUNKTYPE_ARG = b'A'
+CHUNKTYPE_ENV = b'E'
+CHUNKTYPE_DIR = b'D'
+CHUNKTYPE_CMD = b'C'
+CHUNKTYPE_STDOUT = b'1'
+CHUNKTYPE_STDERR = b'2'
+CHUNKTYPE_STDIN_EOF = b'.'
+CHUNKTYPE_EXIT = b'X'
+CHUNKTYPE_SENDINPUT = b'S'
+CHUNKTYPE_HEARTBEAT = b'H'
+
+
+class NailgunClient(object):
+    """
+    Minimal client of the nailgun protocol: sends one command to a running NGServer and
+    streams its stdout/stderr back until the exit chunk arrives.
+    """
+    def __init__(self, host, port, heartbeat_interval=1.0):
+        self.host = host
+        self.port = port
+        self.heartbeat_interval = heartbeat_interval
+
+    def run(self, main_class, args, cwd=None, env=None, stdout=None, stderr=None, timeout=None):
+        stdout = stdout or sys.stdout.buffer
+        stderr = stderr or sys.stderr.buffer
+        env = os.environ if env is None else env
+        self.deadline = time.time() + timeout if timeout else None
+        with socket.create_connection((self.host, self.port)) as sock:
+            lock = threading.Lock()
+            for arg in args:
+                self._send_chunk(sock, lock, CHUNKTYPE_ARG, str(arg))
+            for key, value in env.items():
+                self._send_chunk(sock, lock, CHUNKTYPE_ENV, "{0}={1}".format(key, value))
+            self._send_chunk(sock, lock, CHUNKTYPE_DIR, cwd or os.getcwd())
+            self._send_chunk(sock, lock, CHUNKTYPE_CMD, main_class)
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(sock, lock, done), daemon=True)
+            heartbeat.start()
+            try:
+                return self._read_until_exit(sock, lock, stdout, stderr)
+            finally:
+                done.set()
+
+    def _heartbeat(self, sock, lock, done):
+        while not done.wait(self.heartbeat_interval):
+            try:
+                self._send_chunk(sock, lock, CHUNKTYPE_HEARTBEAT, '')
+            except OSError:
+                return
+
+    def _read_until_exit(self, sock, lock, stdout, stderr):
+        while True:
+            length, chunk_type = CHUNK_HEADER.unpack(self._recv_exactly(sock, CHUNK_HEADER.size))
+            payload = self._recv_exactly(sock, length)
+            if chunk_type == CHUNKTYPE_STDOUT:
+                stdout.write(payload)
+            elif chunk_type == CHUNKTYPE_STDERR:
+                stderr.write(payload)
+            elif chunk_type == CHUNKTYPE_SENDINPUT:
+                # the analysers never read stdin
+                self._send_chunk(sock, lock, CHUNKTYPE_STDIN_EOF, '')
+            elif chunk_type == CHUNKTYPE_EXIT:
+                return int(payload.decode('ascii').strip() or 0)
+
+    @staticmethod
+    def _send_chunk(sock, lock, chunk_type, payload):
+        data = payload.encode('utf-8')
+        with lock:
+            sock.sendall(CHUNK_HEADER.pack(len(data), chunk_type) + data)
+
+    def _recv_exactly(self, sock, size):
+        data = b''
+        while len(data) < size:
+            if self.deadline is not None:
+                remaining = self.deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout("nailgun job exceeded its timeout")
+                sock.settimeout(remaining)
+            part = sock.recv(size - len(data))
+            if not part:
+                raise ConnectionError("nailgun server closed the connection")
+            data += part
+        return data
+
+
+class JVMDaemon(object):
+    """
+    A warm JVM that keeps a single analyser jar on its classpath and runs its main class on demand.
+    """
+    def __init__(self, jar, server_jar, server_class, host='127.0.0.1', port=None, jvm_options=()):
+        self.jar = jar
+        self.jvm_options = list(jvm_options)
+        self.server_jar = server_jar
+        self.server_class = server_class
+        self.host = host
+        self.port = port or self._get_free_port(host)
+        self.main_class = get_main_class(jar)
+        self.process = None
+
+    @staticmethod
+    def _get_free_port(host):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind((host, 0))
+            return s.getsockname()[1]
+
+    def start(self, timeout=30, tool=None):
+        """
+        Starts the server through the ToolRunner of the tool, so it logs, is limited and is killed like its one-shot
+        jobs.
+        """
+        class_path = os.pathsep.join([self.server_jar, self.jar])
+        commands = ["java"] + self.jvm_options + ["-cp", class_path, self.server_class, "{0}:{1}".format(self.host, self.port)]
+        self.process = ToolRunner(tool or os.path.basename(self.jar)).start(commands)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                socket.create_connection((self.host, self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.2)
+        log_path = self.process.log_path
+        self.stop()
+        raise RuntimeError("could not start a jvm daemon for {0}, log: {1}".format(self.jar, log_path))
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def submit(self, args, main_class=None, cwd=None, timeout=None):
+        client = NailgunClient(self.host, self.port)
+        return client.run(main_class or self.main_class, args, cwd=cwd, timeout=timeout)
+
+    def stop(self):
+        process, self.process = self.process, None
+        if process is not None and process.poll() is None:
+            ToolRunner.kill(process)
+
+
+class JVMDaemonPool(object):
+    """
+    Lazily starts one daemon per analyser jar and keeps it for the lifetime of the python process.
+    """
+    def __init__(self):
+        config = Config().config
+        section = config['JVM_DAEMON'] if 'JVM_DAEMON' in config else {}
+        self.enabled = str(section.get('Enabled', 'False')).lower() == 'true'
+        externals = Config.get_work_dir_path(config['EXTERNALS']['BaseDir'])
+        self.server_jar = os.path.join(externals, section.get('Server', ''))
+        self.server_class = section.get('ServerClass', 'com.facebook.nailgun.NGServer')
+        self.host = section.get('Host', '127.0.0.1')
+        self.startup_timeout = int(section.get('StartupTimeout', 30))
+        self.tools = set(map(str.strip, section.get('Tools', '').split(',')))
+        self.daemons = {}
+        self.failed = set()
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        return self.enabled and os.path.isfile(self.server_jar)
+
+    def get(self, jar, tool=None):
+        with self.lock:
+            if jar in self.failed:
+                return None
+            daemon = self.daemons.get(jar)
+            if daemon is not None and daemon.is_alive():
+                return daemon
+            try:
+                jvm_options = ToolSettings(tool).jvm_options() if tool else []
+                daemon = JVMDaemon(jar, self.server_jar, self.server_class, self.host,
+                                   jvm_options=jvm_options).start(self.startup_timeout, tool)
+            except Exception as e:
+                logging.getLogger("tools." + (tool or os.path.basename(jar))).warning(
+                    "jvm daemon unavailable for {0}: {1}".format(jar, e))
+                self.failed.add(jar)
+                return None
+            self.daemons[jar] = daemon
+            return daemon
+
+    def stop(self, jar, daemon):
+        """
+        Stops the daemon of the jar, unless another job already replaced it.
+        """
+        with self.lock:
+            if self.daemons.get(jar) is daemon:
+                del self.daemons[jar]
+        daemon.stop()
+
+    def stop_all(self):
+        with self.lock:
+            for daemon in self.daemons.values():
+                daemon.stop()
+            self.daemons = {}
+
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = JVMDaemonPool()
+        atexit.register(_pool.stop_all)
+    return _pool
+
+
+def get_main_class(jar):
+    with zipfile.ZipFile(jar) as z:
+        manifest = z.read("META-INF/MANIFEST.MF").decode('utf-8')
+    # manifest lines longer than 72 bytes continue on the next line with a leading space
+    manifest = manifest.replace("\r\n", "\n").replace("\n ", "")
+    for line in manifest.splitlines():
+        if line.startswith("Main-Class:"):
+            return line.split(":", 1)[1].strip()
+    return None
+
+
+def run_jar(jar, args, main_class=None, cwd=None, tool=None):
+    """
+    Runs an analyser jar and returns its ToolResult.
+    The job goes to the warm daemon of the jar when one is configured for the tool, otherwise (or when
+    the daemon fails) it runs in a one-shot java process through the ToolRunner.
+    Jobs that depend on their working directory always run one-shot, since a shared JVM has a single one.
+    A job that times out stops its daemon, the job would otherwise keep running in the shared JVM and take its
+    heap and cpu from every later job. The next job starts a new daemon, the jobs running on the stopped one lose
+    their connection and run one-shot.
+    """
+    jar = jar.replace("\\\\?\\", "")
+    tool = tool or os.path.basename(jar)
+    pool = get_pool()
+    logger = logging.getLogger("tools." + tool)
+    if cwd is None and pool.is_available() and tool in pool.tools:
+        daemon = pool.get(jar, tool)
+        if daemon is not None and not (main_class or daemon.main_class):
+            logger.warning("{0} has no Main-Class, running one-shot".format(jar))
+            daemon = None
+        if daemon is not None:
+            timeout = ToolSettings(tool).timeout
+            start = time.time()
+            try:
+                with span(tool, "execute", daemon=True):
+                    returncode = daemon.submit(args, main_class=main_class, timeout=timeout)
+                return ToolResult(tool, [jar] + list(args), returncode, time.time() - start)
+            except socket.timeout:
+                pool.stop(jar, daemon)
+                result = ToolResult(tool, [jar] + list(args), None, time.time() - start, True)
+                logger.warning(repr(result))
+                raise ToolTimeoutError(result)
+            except (OSError, ConnectionError) as e:
+                logger.warning("jvm daemon failed for {0}, running one-shot: {1}".format(jar, e))
+    return ToolRunner(tool).run(java_command(tool, jar, args, main_class), cwd=cwd)
+
+
+def benchmark(repo_path, versions, runs=1):
+    """
+    Parses the given versions of a repository with the JavaParser analyser, once with one-shot JVMs and once
+    through the daemon, and prints the total time of each mode.
+    """
+    import git
+    import shutil
+    import tempfile
+    config = Config().config
+    runner = os.path.join(Config.get_work_dir_path(config["EXTERNALS"]["BaseDir"]), config["EXTERNALS"]["JavaParser"])
+    repo = git.Repo(repo_path)
+    pool = get_pool()
+    timings = {}
+    for mode in ("one_shot", "daemon"):
+        pool.enabled = mode == "daemon"
+        start = time.time()
+        for version in versions:
+            repo.git.checkout(version, force=True)
+            for _ in range(runs):
+                out_dir = tempfile.mkdtemp()
+                run_jar(runner, ["-i", repo_path, "-o", out_dir], tool="JavaParser")
+                shutil.rmtree(out_dir)
+        timings[mode] = time.time() - start
+        print(mode, timings[mode])
+    pool.stop_all()
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,156 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+from config import Config
+from project_store import ProjectStore
+from projects import Project
+
+METRICS = ['count', 'mean', 'std', 'min', 'max']
+
+
+class ProcessHistoryIndex(object):
+    """
+    Running per-file aggregates (count, sum, sum of squares, min, max) of the committed files of a project,
+    sorted by commit date and checkpointed at every version date. The process features of a version are
+    read from its checkpoint instead of rescanning all the commits before it.
+    """
+    # the indexes used last, a process extracts one project at a time so older ones are not kept
+    MAX_INDEXES = 2
+    _indexes = OrderedDict()
+
+    def __init__(self, committed_files, issues, versions):
+        self.issues = committed_files[['commit_id', 'issue_id']].merge(issues, on=['issue_id'], how='right')
+        committed_files = committed_files[committed_files['file_name'].str.endswith('.java')].copy()
+        committed_files['commit_date'] = pd.to_datetime(committed_files['commit_date'], format='%Y-%m-%d %H:%M:%S')
+        committed_files = committed_files.sort_values('commit_date', kind='mergesort')
+        self.version_dates = dict(zip(versions['version_name'],
+                                      pd.to_datetime(versions['version_date'], format='%Y-%m-%d %H:%M:%S')))
+        self.dates = np.array(sorted(set(self.version_dates.values())), dtype='datetime64[ns]')
+        df = committed_files.drop(['is_java', 'commit_id', 'commit_url', 'bug_url'], axis=1)
+        merged = df.merge(self.issues.drop(['commit_id'], axis=1), on=['issue_id'], how='inner').drop(['key'], axis=1)
+        streams = {"all_process": df,
+                   "fixes": df[df['issue_id'] != '0'],
+                   "non_fixes": df[df['issue_id'] == '0'],
+                   "issues": merged}
+        self.columns = {}
+        self.checkpoints = {}
+        for name, stream in streams.items():
+            self.columns[name], self.checkpoints[name] = self._build(stream.drop('issue_id', axis=1))
+
+    @staticmethod
+    def _get_paths(project: Project):
+        config = Config().config
+        repository_data = config["CACHING"]["RepositoryData"]
+        extraction = config['DATA_EXTRACTION']
+        return (os.path.join(repository_data, extraction["CommittedFiles"], project.github(), project.jira() + ".csv"),
+                os.path.join(repository_data, extraction["Issues"], project.github(), project.jira() + "_dummies.csv"),
+                os.path.join(repository_data, extraction["Versions"], project.github(), project.jira() + ".csv"))
+
+    @classmethod
+    def for_project(cls, project: Project):
+        """
+        The index of the project, built once per process and rebuilt only when its inputs change. The inputs are
+        read from the project store, or from the csv export of projects extracted before the store existed.
+        """
+        if ProjectStore.exists(project.github()):
+            store = ProjectStore(project.github())
+            if all(map(store.has, ["committed_files", "issues", "versions"])):
+                key = (store.path, os.path.getmtime(store.path))
+                try:
+                    return cls._get_or_build(key, lambda: cls(store.get_committed_files(), store.get_issues(),
+                                                              store.get_versions()))
+                finally:
+                    store.close()
+            store.close()
+        paths = cls._get_paths(project)
+        key = tuple((path, os.path.getmtime(path)) for path in paths)
+        return cls._get_or_build(key, lambda: cls(*map(lambda p: pd.read_csv(p, sep=';'), paths)))
+
+    @classmethod
+    def _get_or_build(cls, key, build):
+        if key in cls._indexes:
+            cls._indexes.move_to_end(key)
+            return cls._indexes[key]
+        index = build()
+        cls._indexes[key] = index
+        while len(cls._indexes) > cls.MAX_INDEXES:
+            cls._indexes.popitem(last=False)
+        return index
+
+    def _build(self, df):
+        columns = df.drop(['file_name'], axis=1).select_dtypes(include=[np.number]).columns.to_list()
+        values = df[columns].astype({c: 'int64' if is_integer_dtype(df[c]) else 'float64' for c in columns})
+        # a commit belongs to every version dated after it: bucket i holds the commits between dates i-1 and i
+        buckets = np.searchsorted(self.dates, df['commit_date'].to_numpy(), side='right')
+        keys = [df['file_name'].to_numpy(), buckets]
+        rows = values.assign(rows=1)[['rows']].groupby(keys).sum()
+        stats = {'count': values.notnull().groupby(keys).sum(),
+                 'sum': values.groupby(keys).sum(),
+                 'sumsq': (values ** 2).groupby(keys).sum(),
+                 'min': values.fillna(np.inf).groupby(keys).min(),
+                 'max': values.fillna(-np.inf).groupby(keys).max()}
+        running = {'rows': rows.groupby(level=0).cumsum(),
+                   'count': stats['count'].groupby(level=0).cumsum(),
+                   'sum': stats['sum'].groupby(level=0).cumsum(),
+                   'sumsq': stats['sumsq'].groupby(level=0).cumsum(),
+                   'min': stats['min'].groupby(level=0).cummin().replace(np.inf, np.nan),
+                   'max': stats['max'].groupby(level=0).cummax().replace(-np.inf, np.nan)}
+        checkpoints = pd.concat(running, axis=1)
+        checkpoints.index.names = ['file_name', 'bucket']
+        return columns, checkpoints
+
+    def get_version_date(self, version):
+        return self.version_dates[version].to_pydatetime()
+
+    def get_checkpoint(self, stream, version_date, file_names):
+        """
+        The running aggregates of every file of file_names committed before the version date, one row per file with
+        the (aggregate, column) columns of the checkpoints.
+        """
+        position = np.searchsorted(self.dates, np.datetime64(version_date, 'ns'), side='left')
+        if position == len(self.dates) or self.dates[position] != np.datetime64(version_date, 'ns'):
+            raise KeyError("{0} is not a version date".format(version_date))
+        checkpoints = self.checkpoints[stream]
+        checkpoints = checkpoints[checkpoints.index.get_level_values('bucket') <= position]
+        checkpoints = checkpoints[checkpoints.index.get_level_values('file_name').isin(set(file_names))]
+        return checkpoints.groupby(level='file_name').tail(1).droplevel('bucket')
+
+    def get_files(self, version_date, file_names):
+        """
+        The files of file_names that were committed before the version date, sorted.
+        """
+        return self.get_checkpoint("all_process", version_date, file_names).index.to_list()
+
+    def get_stats(self, stream, version_date, file_names):
+        """
+        Returns the numeric columns of the stream, the row count of every file and its describe()-like
+        statistics keyed by (column, metric), over the commits before the version date.
+        """
+        columns = self.columns[stream]
+        return (columns,) + self.describe(columns, self.get_checkpoint(stream, version_date, file_names))
+
+    @staticmethod
+    def describe(columns, checkpoint):
+        """
+        The row count of every file and its describe()-like statistics keyed by (column, metric), from its running
+        aggregates.
+        """
+        counts = checkpoint[('rows', 'rows')].to_dict()
+        if not columns:
+            return counts, {}
+        n = checkpoint['count'].astype(float)
+        total = checkpoint['sum']
+        # n * sumsq - sum ** 2 stays exact for integer columns, so constant columns get a std of exactly 0
+        variance = (checkpoint['count'] * checkpoint['sumsq'] - total ** 2).astype(float) / (n * (n - 1))
+        metrics = {'count': n,
+                   'mean': total.astype(float) / n,
+                   'std': np.sqrt(variance.clip(lower=0)).where(n > 1),
+                   'min': checkpoint['min'].astype(float),
+                   'max': checkpoint['max'].astype(float)}
+        stats = pd.concat(metrics, axis=1).swaplevel(axis=1)
+        stats = stats[[(col, metric) for col in columns for metric in METRICS]]
+        return counts, stats.to_dict('index')
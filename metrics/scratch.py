@@ -0,0 +1,65 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+from config import Config
+
+_live_dirs = set()
+
+
+def _cleanup_live_dirs():
+    for path in list(_live_dirs):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+atexit.register(_cleanup_live_dirs)
+
+
+class ScratchSpace(object):
+    """
+    A private temporary directory for a single (project, version, tool) run, removed when the run ends.
+    Tools listed in [SCRATCH] TmpfsTools are placed on the RAM disk when it exists and has enough free space.
+    """
+    def __init__(self, project_name, version, tool):
+        self.project_name = project_name
+        self.version = version
+        self.tool = tool
+        config = Config().config
+        self.section = config['SCRATCH'] if 'SCRATCH' in config else {}
+        self.keep = self.section.get('Keep', 'False').lower() == 'true'
+        self.path = None
+
+    def _get_base_dir(self):
+        tmpfs = self.section.get('Tmpfs', '')
+        tmpfs_tools = set(map(str.strip, self.section.get('TmpfsTools', '').split(',')))
+        if tmpfs and self.tool in tmpfs_tools and os.path.isdir(tmpfs) and os.access(tmpfs, os.W_OK):
+            min_free = float(self.section.get('TmpfsMinFreeGB', 1)) * 1024 ** 3
+            if shutil.disk_usage(tmpfs).free >= min_free:
+                return os.path.join(tmpfs, "repository_mining")
+        config = Config().config
+        return str(Config.get_work_dir_path(os.path.join(config['CACHING']['RepositoryData'],
+                                                         self.section.get('BaseDir', 'scratch'))))
+
+    def create(self):
+        version = os.path.normpath(self.version).replace(os.path.sep, "_")
+        base_dir = os.path.join(self._get_base_dir(), self.project_name, version).replace("\\\\?\\", "")
+        Config.assert_dir_exists(base_dir)
+        self.path = tempfile.mkdtemp(prefix=self.tool + "_", dir=base_dir)
+        _live_dirs.add(self.path)
+        return self.path
+
+    def cleanup(self):
+        if self.path is None:
+            return
+        _live_dirs.discard(self.path)
+        if not self.keep:
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.path = None
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+        return False
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def canonical(value):
+    return os.path.normpath(str(value).lower()).lower()
+
+
+def map_unique(values, func):
+    """
+    func applied to every value, computed once per distinct value.
+    """
+    codes, uniques = pd.factorize(pd.Series(values), sort=False)
+    mapped = np.array([func(u) for u in uniques] + [np.nan], dtype=object)
+    # factorize marks missing values with -1, which picks the trailing nan
+    return mapped[codes]
+
+
+class SymbolTable(object):
+    """
+    Interns the file, class and method ids of a version as int32 keys, so frames are merged and grouped on
+    integers and the strings are restored only when the frame is exported.
+    """
+    def __init__(self):
+        self.symbols = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _intern(self, symbol):
+        key = self.index.get(symbol)
+        if key is None:
+            key = len(self.symbols)
+            self.index[symbol] = key
+            self.symbols.append(symbol)
+        return key
+
+    def encode(self, values, canonize=True):
+        """
+        The keys of the values, canonized (normpath-ed and lowercased) unless canonize is False.
+        Every distinct value is canonized once.
+        """
+        codes, uniques = pd.factorize(pd.Series(values).astype(str), sort=False)
+        keys = np.fromiter((self._intern(canonical(u) if canonize else u) for u in uniques), dtype=np.int32,
+                           count=len(uniques))
+        return keys[codes]
+
+    def decode(self, keys):
+        # outer merges leave missing keys (nan) for rows that came from frames without the column
+        keys = pd.Series(keys)
+        missing = keys.isnull().to_numpy()
+        symbols = np.array(self.symbols + [np.nan], dtype=object)
+        return symbols[np.where(missing, len(self.symbols), keys.fillna(-1).to_numpy().astype(np.int64))]
+
+    def encode_columns(self, df, columns, canonize_columns=()):
+        """
+        Replaces the columns by their keys. The canonize_columns are canonized, the others only lowercased.
+        """
+        df = df.copy()
+        for col in columns:
+            if col in canonize_columns:
+                df[col] = self.encode(df[col])
+            else:
+                df[col] = self.encode(df[col].astype(str).str.lower(), canonize=False)
+        return df
+
+    def decode_columns(self, df, columns):
+        if df is None:
+            return None
+        for col in columns:
+            if col in df.columns:
+                df[col] = self.decode(df[col])
+        return df
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import time
+from collections import deque
+from datetime import datetime
+
+from config import Config
+from tracing import span
+
+_systemd_scope_available = None
+
+
+def systemd_scope_available():
+    """
+    Whether transient systemd scopes (and so cgroup limits) can be created by this user, probed once per process.
+    """
+    global _systemd_scope_available
+    if _systemd_scope_available is None:
+        _systemd_scope_available = False
+        if os.name == 'posix' and shutil.which('systemd-run'):
+            try:
+                probe = subprocess.run(["systemd-run", "--user", "--scope", "--quiet", "--", "true"],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+                _systemd_scope_available = probe.returncode == 0
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+    return _systemd_scope_available
+
+
+class ToolResult(object):
+    def __init__(self, tool, command, returncode, duration, timed_out=False, log_path=None, stderr_tail=None):
+        self.tool = tool
+        self.command = command
+        self.returncode = returncode
+        self.duration = duration
+        self.timed_out = timed_out
+        self.log_path = log_path
+        self.stderr_tail = stderr_tail or []
+
+    @property
+    def ok(self):
+        return not self.timed_out and self.returncode == 0
+
+    def as_dict(self):
+        return {"tool": self.tool, "command": self.command, "returncode": self.returncode,
+                "duration": self.duration, "timed_out": self.timed_out, "log_path": self.log_path}
+
+    def __repr__(self):
+        return "ToolResult({0}, returncode={1}, duration={2:.1f}s, timed_out={3})".format(
+            self.tool, self.returncode, self.duration, self.timed_out)
+
+
+class ToolTimeoutError(Exception):
+    def __init__(self, result: ToolResult):
+        super().__init__("{0} timed out after {1:.0f}s, log: {2}".format(result.tool, result.duration, result.log_path))
+        self.result = result
+
+
+class ToolSettings(object):
+    """
+    The [TOOL_RUNNER] settings of a single tool. Every key can be overridden per tool by prefixing it with
+    the tool name, e.g. DesigniteTimeout.
+    """
+    def __init__(self, tool):
+        self.tool = tool
+        config = Config().config
+        self.section = config['TOOL_RUNNER'] if 'TOOL_RUNNER' in config else {}
+        self.timeout = self._get_float('Timeout')
+        self.xmx = self._get('Xmx')
+        self.threads = self._get('Threads')
+        self.memory_limit = self._get('MemoryLimit')
+        self.log_dir = Config.get_work_dir_path(os.path.join(config['CACHING']['RepositoryData'],
+                                                             self.section.get('LogDir', 'tool_logs')))
+
+    def _get(self, key):
+        value = self.section.get(self.tool + key, self.section.get(key, ''))
+        return value.strip() or None
+
+    def _get_float(self, key):
+        value = self._get(key)
+        return float(value) if value else None
+
+    def jvm_options(self):
+        options = []
+        if self.xmx:
+            options.append("-Xmx" + self.xmx)
+        if self.threads:
+            options.extend(["-XX:ActiveProcessorCount=" + self.threads, "-XX:ParallelGCThreads=" + self.threads])
+        return options
+
+    def limit_command(self, command):
+        # cgroup memory cap through a transient systemd scope, when the host has one
+        if self.memory_limit and systemd_scope_available():
+            return ["systemd-run", "--user", "--scope", "--quiet", "-p", "MemoryMax=" + self.memory_limit, "--"] + command
+        return command
+
+
+def java_command(tool, jar, args, main_class=None):
+    options = ToolSettings(tool).jvm_options()
+    if main_class:
+        return ["java"] + options + ["-cp", jar, main_class] + list(args)
+    return ["java"] + options + ["-jar", jar] + list(args)
+
+
+class ToolRunner(object):
+    def __init__(self, tool, settings: ToolSettings = None):
+        self.tool = tool
+        self.settings = settings or ToolSettings(tool)
+        self.logger = logging.getLogger("tools." + tool)
+
+    def _get_log_path(self):
+        Config.assert_dir_exists(self.settings.log_dir)
+        name = "{0}_{1}_{2}.log".format(self.tool, datetime.now().strftime('%Y%m%d_%H%M%S_%f'), os.getpid())
+        return os.path.join(self.settings.log_dir, name)
+
+    def _write_line(self, line, log_file, prefix, tail):
+        text = line.decode('utf-8', errors='replace').rstrip()
+        log_file.write("{0} {1}\n".format(prefix, text))
+        log_file.flush()
+        self.logger.info(text)
+        if tail is not None:
+            tail.append(text)
+
+    async def _stream(self, stream, log_file, prefix, tail=None):
+        # read in chunks and split here, readline fails on a line longer than the limit of the stream
+        pending = b''
+        while True:
+            chunk = await stream.read(1 << 16)
+            if not chunk:
+                if pending:
+                    self._write_line(pending, log_file, prefix, tail)
+                return
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                self._write_line(line, log_file, prefix, tail)
+
+    async def run_async(self, command, cwd=None):
+        command = [str(c) for c in command]
+        log_path = self._get_log_path()
+        stderr_tail = deque(maxlen=50)
+        start = time.time()
+        kwargs = {'start_new_session': True} if os.name == 'posix' else {}
+        process = await asyncio.create_subprocess_exec(*self.settings.limit_command(command), cwd=cwd,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE, **kwargs)
+        timed_out = False
+        with open(log_path, "w", encoding="utf-8") as log_file:
+            log_file.write("$ {0}\n".format(" ".join(command)))
+            streams = asyncio.gather(self._stream(process.stdout, log_file, "[out]"),
+                                     self._stream(process.stderr, log_file, "[err]", stderr_tail),
+                                     process.wait())
+            try:
+                await asyncio.wait_for(streams, self.settings.timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+            finally:
+                # whatever ended the wait (a timeout, an error reading the output, a cancel), the tool is not left
+                # running in its session
+                streams.cancel()
+                if process.returncode is None:
+                    self._kill(process)
+                    await process.wait()
+        result = ToolResult(self.tool, command, process.returncode, time.time() - start, timed_out, log_path,
+                            list(stderr_tail))
+        if not result.ok:
+            self.logger.warning(repr(result))
+        return result
+
+    @staticmethod
+    def _kill(process):
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
+    def start(self, command, cwd=None):
+        """
+        Starts a long running command in its own process group, limited like the jobs of run, with its output in
+        the log of the tool. The caller waits for the process and stops it with kill.
+        """
+        command = [str(c) for c in command]
+        log_path = self._get_log_path()
+        kwargs = {'start_new_session': True} if os.name == 'posix' else {}
+        with open(log_path, "w", encoding="utf-8") as log_file:
+            log_file.write("$ {0}\n".format(" ".join(command)))
+            log_file.flush()
+            process = subprocess.Popen(self.settings.limit_command(command), cwd=cwd, stdout=log_file,
+                                       stderr=subprocess.STDOUT, **kwargs)
+        process.log_path = log_path
+        return process
+
+    @staticmethod
+    def kill(process, timeout=10):
+        """
+        Terminates the process group of a command of start, and kills it if it did not exit within timeout seconds.
+        """
+        for stop in ("terminate", "kill"):
+            try:
+                if os.name == 'posix':
+                    os.killpg(process.pid, signal.SIGTERM if stop == "terminate" else signal.SIGKILL)
+                else:
+                    getattr(process, stop)()
+            except ProcessLookupError:
+                return
+            try:
+                process.wait(timeout)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+
+    def run(self, command, cwd=None):
+        with span(self.tool, "execute"):
+            result = asyncio.run(self.run_async(command, cwd=cwd))
+        if result.timed_out:
+            raise ToolTimeoutError(result)
+        return result
+
+
+def run_tool(tool, command, cwd=None):
+    return ToolRunner(tool).run(command, cwd=cwd)
+
+
+async def run_tools_async(jobs, max_concurrency=None):
+    """
+    Runs (tool, command, cwd) jobs concurrently, at most max_concurrency ([TOOL_RUNNER] MaxConcurrency) at a time.
+    Timed out jobs are returned as results rather than raised.
+    """
+    if max_concurrency is None:
+        config = Config().config
+        max_concurrency = int(config['TOOL_RUNNER'].get('MaxConcurrency', 1)) if 'TOOL_RUNNER' in config else 1
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_job(tool, command, cwd):
+        async with semaphore:
+            return await ToolRunner(tool).run_async(command, cwd=cwd)
+
+    return await asyncio.gather(*[run_job(*job) for job in jobs])
+
+
+def run_tools(jobs, max_concurrency=None):
+    return asyncio.run(run_tools_async(jobs, max_concurrency))
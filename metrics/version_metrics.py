@@ -1,10 +1,9 @@
 import os
 import json
 from abc import ABC, abstractmethod
-from subprocess import Popen
 from xml.etree import ElementTree
-from datetime import datetime
 import pandas as pd
+import numpy as np
 import math
 import git
 from functools import reduce
@@ -28,8 +27,13 @@ from metrics.rsc.designite_smells import (
     organic_type_smells_list,
     organic_method_smells_list)
 from .java_analyser import JavaParserFileAnalyser
+from .jvm_daemon import run_jar
+from .tool_runner import run_tool, java_command
+from .scratch import ScratchSpace
+from .process_history import ProcessHistoryIndex, METRICS
 from metrics.version_metrics_name import DataType
 from typing import List
+from tracing import span
 
 
 class Extractor(ABC):
@@ -46,6 +50,7 @@ class Extractor(ABC):
         self.local_path = os.path.realpath(repo.local_path)
         self.file_analyser = JavaParserFileAnalyser(self.local_path, self.project_name, self.version)
         self.data: Data = None
+        self.scratch_dir = None
 
     @staticmethod
     def _get_runner(config, extractor_name):
@@ -76,12 +81,23 @@ class Extractor(ABC):
     def store(self):
         self.data.store()
 
+    def _get_scratch_path(self, temp_name):
+        return os.path.join(self.scratch_dir, self.config['TEMP'][temp_name])
+
     def extract(self):
         self._set_data()
         if hasattr(self.data, "path") and os.path.exists(self.data.path):
             return
-        self._extract()
-        self.store()
+        try:
+            with ScratchSpace(self.project_name, self.version, self.extractor_name) as self.scratch_dir:
+                # the tools run by _extract are spans of their own, the rest of it is processing their output
+                with span(self.extractor_name + ".extract", "extractor", version=self.version):
+                    self._extract()
+        finally:
+            # the scratch space is removed, a failed extraction must not leave its path behind
+            self.scratch_dir = None
+        with span(self.extractor_name + ".store", "extractor", version=self.version):
+            self.store()
 
 
     @staticmethod
@@ -98,9 +114,8 @@ class Bugged(Extractor):
         self.data = BuggedData(self.project, self.version)
 
     def _extract(self):
-        extractor = DataExtractor(self.project)
-        path = extractor.get_bugged_files_path(self.version, True)
-        df = pd.read_csv(path, sep=';')
+        with DataExtractor(self.project) as extractor:
+            df = extractor.get_bugged_files(self.version, True)
         key = 'file_name'
         assert key in df.columns
         bugged = df.groupby(key).apply(lambda x: dict(zip(["is_buggy"], x.is_buggy))).to_dict()
@@ -115,8 +130,8 @@ class BuggedMethods(Extractor):
         self.data = BuggedMethodData(self.project, self.version)
 
     def _extract(self):
-        extractor = DataExtractor(self.project)
-        path = extractor.get_bugged_methods_path(self.version)
+        with DataExtractor(self.project) as extractor:
+            path = extractor.get_bugged_methods_path(self.version)
         df = pd.read_csv(path, sep=';')
         key = 'method_id'
         bugged = df.groupby(key).apply(lambda x: dict(zip(["is_method_buggy"], x.is_method_buggy))).to_dict()
@@ -126,8 +141,10 @@ class BuggedMethods(Extractor):
 class Checkstyle(Extractor):
     def __init__(self, project: Project, version, repo=None):
         super().__init__("Checkstyle", project, version, [DataType.CheckstyleDataType], repo)
-        self.out_path_to_xml = os.path.normpath(Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['TEMP']['Checkstyle'])))
+
+    @property
+    def out_path_to_xml(self):
+        return self._get_scratch_path('Checkstyle')
 
     def _set_data(self):
         self.data = CheckstyleData(self.project, self.version)
@@ -148,14 +165,11 @@ class Checkstyle(Extractor):
 
     @staticmethod
     def _execute_command(checkstyle_runner: str, all_checks_xml: str, local_path: str, out_path_to_xml: str) -> str:
-        commands = ["java",
-                    "-jar", checkstyle_runner,
-                    "-c", all_checks_xml,
-                    "-f", "xml",
-                    "-o", out_path_to_xml.replace("\\\\?\\", ""),
-                    local_path]
-        p = Popen(commands)
-        p.communicate()
+        args = ["-c", all_checks_xml,
+                "-f", "xml",
+                "-o", out_path_to_xml.replace("\\\\?\\", ""),
+                local_path]
+        run_jar(checkstyle_runner, args, tool="Checkstyle")
         return out_path_to_xml
 
     def _process_checkstyle_data(self, out_path_to_xml):
@@ -217,9 +231,10 @@ class Designite(Extractor):
         super().__init__("Designite", project, version, [DataType.DesigniteDesignSmellsDataType, DataType.DesigniteImplementationSmellsDataType,
                                                          DataType.DesigniteMethodMetricsDataType, DataType.DesigniteOrganicMethodSmellsDataType,
                                                          DataType.DesigniteTypeMetricsDataType, DataType.DesigniteOrganicTypeSmellsDataType], repo)
-        self.out_dir = os.path.normpath(Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['TEMP']['Designite'])))
-        Config.assert_dir_exists(self.out_dir)
+
+    @property
+    def out_dir(self):
+        return Config.assert_dir_exists(self._get_scratch_path('Designite'))
 
     def _set_data(self):
         self.data = CompositeData()
@@ -245,9 +260,7 @@ class Designite(Extractor):
         Config.assert_dir_exists(out_dir)
         if not os.path.exists(out_dir):
             os.makedirs(out_dir)
-        commands = ["java", "-jar", designite_runner, "-i", local_path, "-o", out_dir]
-        p = Popen(commands)
-        p.communicate()
+        run_tool("Designite", java_command("Designite", designite_runner, ["-i", local_path, "-o", out_dir]))
         return out_dir
 
     def _extract_design_code_smells(self):
@@ -348,10 +361,10 @@ class Designite(Extractor):
 class SourceMonitor(Extractor):
     def __init__(self, project: Project, version, repo=None):
         super().__init__("SourceMonitor", project, version, [DataType.SourceMonitorDataType, DataType.SourceMonitorFilesDataType], repo)
-        self.out_dir = os.path.normpath(Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['TEMP']['SourceMonitor'])))
-        Config.assert_dir_exists(self.out_dir)
 
+    @property
+    def out_dir(self):
+        return Config.assert_dir_exists(self._get_scratch_path('SourceMonitor'))
 
     def _set_data(self):
         self.data = CompositeData()
@@ -373,7 +386,7 @@ class SourceMonitor(Extractor):
         with open(xml_path, "w") as f:
             f.write(xml)
 
-        Popen([source_monitor_runner, "/C", xml_path]).communicate()
+        run_tool("SourceMonitor", [source_monitor_runner, "/C", xml_path])
         return out_dir
 
     def _process_metrics(self):
@@ -425,9 +438,10 @@ class SourceMonitor(Extractor):
 class CK(Extractor):
     def __init__(self, project: Project, version, repo=None):
         super().__init__("CK", project, version, [DataType.CKDataType], repo)
-        self.out_dir = os.path.normpath(Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['TEMP']['CK'])))
-        Config.assert_dir_exists(self.out_dir)
+
+    @property
+    def out_dir(self):
+        return Config.assert_dir_exists(self._get_scratch_path('CK'))
 
     def _set_data(self):
         self.data = CKData(self.project, self.version)
@@ -440,33 +454,27 @@ class CK(Extractor):
     @staticmethod
     def _execute_command(ck_runner, local_path, out_dir):
         project_path = os.path.join(os.getcwd(), local_path)
-        command = ["java", "-jar", ck_runner, project_path, "True"]
-        Popen(command, cwd=out_dir).communicate()
+        run_jar(ck_runner, [project_path, "True"], cwd=out_dir, tool="CK")
         return out_dir
 
     def _process_metrics(self):
-        ck = {}
         df_path = os.path.join(self.out_dir, "method.csv")
         df = pd.read_csv(df_path)
         df = df.drop(['class', "method"], axis=1)
-        df['method_id'] = df.apply(lambda x:
-                                   self.file_analyser.get_closest_id(x['file'], x['line']),
-                                   axis=1)
-        df = df[list(map(lambda x: x is not None, df['method_id'].to_list()))]
+        df.insert(0, 'id', self.file_analyser.get_closest_ids(df['file'], df['line']).to_numpy())
+        df = df[df['id'].notnull()]
         df = df.drop(['file', "line"], axis=1)
-        df.apply(lambda x:
-                 ck.setdefault(x["method_id"], x.drop("method_id")),
-                 axis=1)
-        return ck
+        # the first row of every method wins
+        return df.drop_duplicates('id', keep='first')
 
 
 class Mood(Extractor):
     def __init__(self, project: Project, version, repo=None):
         super().__init__("MOOD", project, version, [DataType.MoodDataType], repo)
-        self.out_dir = os.path.normpath(Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['TEMP']['MOOD'])))
-        Config.assert_dir_exists(self.out_dir)
 
+    @property
+    def out_dir(self):
+        return Config.assert_dir_exists(self._get_scratch_path('MOOD'))
 
     def _set_data(self):
         self.data = MoodData(self.project, self.version)
@@ -478,8 +486,7 @@ class Mood(Extractor):
 
     @staticmethod
     def _execute_command(mood_runner, local_path, out_dir):
-        command = ["java", "-jar", mood_runner, local_path, out_dir]
-        Popen(command).communicate()
+        run_jar(mood_runner, [local_path, out_dir], tool="MOOD")
 
     def _process_metrics(self):
         with open(os.path.join(self.out_dir, "_metrics.json")) as file:
@@ -503,8 +510,10 @@ class Halstead(Extractor):
 class Jasome(Extractor):
     def __init__(self, project: Project, version, repo=None):
         super().__init__("Jasome", project, version, [DataType.JasomeFilesDataType, DataType.JasomeMethodsDataType], repo)
-        self.out_path_to_xml = os.path.normpath(Config.get_work_dir_path(
-            os.path.join(Config().config['CACHING']['RepositoryData'], Config().config['TEMP']['Jasome'])))
+
+    @property
+    def out_path_to_xml(self):
+        return self._get_scratch_path('Jasome')
 
     def _set_data(self):
         self.data = CompositeData()
@@ -518,39 +527,28 @@ class Jasome(Extractor):
 
     @staticmethod
     def _execute_command(jasome_runner, local_path, out_path_to_xml):
-        command = ["java", "-cp", jasome_runner, "org.jasome.executive.CommandLineExecutive", '-xt', local_path, '-o', out_path_to_xml]
-        print('jasome command', command)
-        Popen(command).communicate()
+        args = ['-xt', local_path, '-o', out_path_to_xml]
+        print('jasome command', args)
+        run_jar(jasome_runner, args, main_class="org.jasome.executive.CommandLineExecutive", tool="Jasome")
 
     def _process_metrics(self):
         from metrics.jasome_xml_parser import parse
         classes_metrics, methods_metrics = parse(self.out_path_to_xml)
-        classes_metrics["id"] = classes_metrics.apply(lambda x: self.file_analyser.classes_paths.get(x['Class Path'].lower()), axis=1)
+        classes_metrics.insert(0, "id", classes_metrics['Class Path'].str.lower().map(self.file_analyser.classes_paths))
         classes_metrics = classes_metrics.drop('Class Path', axis=1)
-        cols = classes_metrics.columns.tolist()
-        cols.remove("id")
-        classes_metrics = classes_metrics[["id"] + cols]
-
-        methods_metrics["id"] = methods_metrics.apply(lambda x: self.file_analyser.get_closest_id(x['File Name'], x['start_line']), axis=1)
-        methods_metrics = methods_metrics.drop('File Name', axis=1)
-        methods_metrics = methods_metrics.drop('start_line', axis=1)
-        cols = methods_metrics.columns.tolist()
-        cols.remove("id")
-        methods_metrics = methods_metrics[["id"] + cols]
-        return self._get_metrics_dict(classes_metrics), self._get_metrics_dict(methods_metrics)
+
+        methods_metrics.insert(0, "id", self.file_analyser.get_closest_ids(methods_metrics['File Name'],
+                                                                          methods_metrics['start_line']).to_numpy())
+        methods_metrics = methods_metrics.drop(['File Name', 'start_line'], axis=1)
+        return self._get_metrics_df(classes_metrics), self._get_metrics_df(methods_metrics)
 
     @staticmethod
-    def _get_metrics_dict(df):
-        types = {}
-        metrics_columns = list(df.columns.drop("id"))
-        for id_ in df["id"]:
-            types[id_] = dict.fromkeys(metrics_columns, 0)
-        types.update(
-            dict(map(lambda x: (
-                x[1]["id"],
-                dict(zip(metrics_columns, list(x[1].drop("id"))))
-            ), df.iterrows())))
-        return types
+    def _get_metrics_df(df):
+        # one row per id, holding the metrics of its last row
+        df = df[df["id"].notnull()]
+        order = df["id"].drop_duplicates(keep='first')
+        df = df.drop_duplicates("id", keep='last').set_index("id")
+        return df.loc[order].reset_index()
 
 
 class ProcessExtractor(Extractor):
@@ -560,43 +558,23 @@ class ProcessExtractor(Extractor):
     def _set_data(self):
         self.data = CompositeData()
 
-    def clean(self, s):
+    @staticmethod
+    def clean(s):
         return "".join(list(filter(lambda c: c.isalpha(), s)))
 
     def _extract(self):
-        # get version_date from apache_versions
-        config = Config().config
-        repository_data = config["CACHING"]["RepositoryData"]
-        path = os.path.join(repository_data, config['DATA_EXTRACTION']["Versions"], self.project.github(), self.project.jira() + ".csv")
-        df = pd.read_csv(path, sep=';')
-        version_date = df[df['version_name'] == self.version]['version_date'].to_list()[0]
-        version_date = datetime.strptime(version_date, '%Y-%m-%d %H:%M:%S')
-        # get file list from committed_files
-        path = os.path.join(repository_data, config['DATA_EXTRACTION']["CommittedFiles"], self.project.github(), self.project.jira() + ".csv")
-        df = pd.read_csv(path, sep=';')
-        issues_path = os.path.join(repository_data, config['DATA_EXTRACTION']["Issues"], self.project.github(),
-                                   self.project.jira() + "_dummies.csv")
-        issues_df = pd.read_csv(issues_path, sep=';')
-        issues_df = df[['commit_id', 'issue_id']].merge(issues_df, on=['issue_id'], how='right')
-        # filter commits after version date
-        df = df[df.apply(lambda r: datetime.strptime(r['commit_date'], '%Y-%m-%d %H:%M:%S') < version_date, axis=1)]
-        # split by file_name
-        data = {}
-        issues_data = {}
-
-        extractor = DataExtractor(self.project)
-        path = extractor.get_bugged_files_path(self.version, True)
-        files = pd.read_csv(path, sep=';')['file_name'].to_list()
-        df = df[df.apply(lambda r: r['file_name'].endswith('.java') and r['file_name'] in files, axis=1)]
-
-        for file_name, file_df in df.groupby('file_name', as_index=False):
-            data[file_name] = self._extract_process_features(file_df)
-            issues_data[file_name] = self._extract_issues_features(file_df, issues_df, self._get_blame_data(file_name))
+        history = ProcessHistoryIndex.for_project(self.project)
+        version_date = history.get_version_date(self.version)
+        with DataExtractor(self.project) as extractor:
+            files = set(extractor.get_bugged_files(self.version, True)['file_name'])
+        file_names = history.get_files(version_date, files)
+
+        data = self._extract_process_features(history, version_date, file_names)
+        issues_data = self._extract_issues_features(history, version_date, self._get_blames_data(file_names), file_names)
         # extract the following features:
         self.data.add(ProcessData(self.project, self.version, data=data)).add(IssuesData(self.project, self.version, data=issues_data))
 
-    def _get_blame_data(self, file_name):
-        repo = git.Repo(self.local_path)
+    def _get_tag(self, repo):
         version_names = list(map(lambda x: x.name, repo.tags))
         version = self.version
         if version not in version_names:
@@ -606,6 +584,11 @@ class ProcessExtractor(Extractor):
             if '/' in version:
                 if version.replace('/', '\\') in version_names:
                     version = version.replace('/', '\\')
+        return version
+
+    def _get_blame_data(self, file_name, repo=None, version=None):
+        repo = repo or git.Repo(self.local_path)
+        version = version or self._get_tag(repo)
         blame = repo.blame(version, file_name)
         blame = reduce(list.__add__, map(lambda x: list(map(lambda y: (x[0], y), x[1])), blame), [])
         commits, source_code = list(zip(*blame))
@@ -618,6 +601,21 @@ class ProcessExtractor(Extractor):
             values.append(d)
         return pd.DataFrame(values)
 
+    def _get_blames_data(self, file_names):
+        """
+        The blame data of all the files, with a file_name column. The repository and tag are resolved once.
+        """
+        repo = git.Repo(self.local_path)
+        version = self._get_tag(repo)
+        blames = []
+        for file_name in file_names:
+            blame = self._get_blame_data(file_name, repo, version)
+            blame.insert(0, 'file_name', file_name)
+            blames.append(blame)
+        if not blames:
+            return pd.DataFrame(columns=['file_name', 'commit_id'])
+        return pd.concat(blames, ignore_index=True)
+
     def _get_blame_for_file(self, file_name):
         ans = {}
         repo = git.Repo(self.local_path)
@@ -663,25 +661,59 @@ class ProcessExtractor(Extractor):
                     ans["_".join([self.clean(initial), self.clean(col), self.clean(k)])] = v
         return ans
 
-    def _extract_process_features(self, df):
-        df = df.drop(['file_name', 'is_java', 'commit_id', 'commit_date', 'commit_url', 'bug_url'], axis=1)
+    @staticmethod
+    def format_features(columns, counts, stats, file_names, initial=''):
+        """
+        The keys and defaults of _get_features, for every file in file_names, from its row count and its
+        statistics keyed by (column, metric). Files without rows get the same defaults as an empty frame.
+        """
+        clean = ProcessExtractor.clean
+        defaults = dict.fromkeys(["_".join([initial, col, metric]) for col in columns for metric in METRICS], 0.0)
+        clean_names = {(col, metric): "_".join([clean(initial), clean(col), clean(metric)])
+                       for col in columns for metric in METRICS}
         ans = {}
-        ans.update(self._get_features(df.drop('issue_id', axis=1), "all_process"))
+        for file_name in file_names:
+            features = {initial + "_count": counts.get(file_name, 0)}
+            features.update(defaults)
+            for key, v in stats.get(file_name, {}).items():
+                if v and not math.isnan(v):
+                    features[clean_names[key]] = v
+            ans[file_name] = features
         return ans
 
-    def _extract_issues_features(self, df, issues_df, blame):
+    def _get_files_features(self, df, file_names, initial=''):
+        """
+        _get_features of every file in file_names with a single groupby over df, which holds the rows of all of
+        them in a file_name column.
+        """
+        columns = df.drop('file_name', axis=1).select_dtypes(include=[np.number]).columns.to_list()
+        grouped = df.groupby('file_name')
+        stats = grouped[columns].agg(METRICS).astype(float).to_dict('index') if columns else {}
+        return self.format_features(columns, grouped.size().to_dict(), stats, file_names, initial)
+
+    def _get_history_features(self, history, stream, version_date, file_names):
+        columns, counts, stats = history.get_stats(stream, version_date, file_names)
+        return self.format_features(columns, counts, stats, file_names, stream)
+
+    @staticmethod
+    def _merge_features(*features):
         ans = {}
-        # d = df[['commit_id', 'issue_id']]
-        # blame_merge = d.merge(blame, on=['commit_id'], how='right')
-        blame_merge = blame.merge(issues_df, on=['commit_id'], how='left')
-        blame_merge = blame_merge.drop(['commit_id', 'issue_id'], axis=1)
-        ans.update(self._get_features(blame_merge, "blame_merge"))
-        df = df.drop(['file_name', 'is_java', 'commit_id', 'commit_date', 'commit_url', 'bug_url'], axis=1)
-        ans.update(self._get_features(df[df['issue_id'] != '0'].drop('issue_id', axis=1), "fixes"))
-        ans.update(self._get_features(df[df['issue_id'] == '0'].drop('issue_id', axis=1), "non_fixes"))
-        merged = df.merge(issues_df.drop(['commit_id'], axis=1), on=['issue_id'], how='inner')
-        merged = merged.drop(['key', 'issue_id'], axis=1)
-        ans.update(self._get_features(merged, 'issues'))
+        for f in features:
+            for file_name, values in f.items():
+                ans.setdefault(file_name, {}).update(values)
+        return ans
+
+    def _extract_process_features(self, history, version_date, file_names):
+        return self._get_history_features(history, "all_process", version_date, file_names)
+
+    def _extract_issues_features(self, history, version_date, blames, file_names):
+        blame_merge = blames.merge(history.issues, on=['commit_id'], how='left')
+        blame_merge = blame_merge.drop(['commit_id', 'issue_id'], axis=1, errors='ignore')
+        ans = self._merge_features(
+            self._get_files_features(blame_merge, file_names, "blame_merge"),
+            self._get_history_features(history, "fixes", version_date, file_names),
+            self._get_history_features(history, "non_fixes", version_date, file_names),
+            self._get_history_features(history, "issues", version_date, file_names))
 
         # for dummy in dummies_dict:
         #     # percent
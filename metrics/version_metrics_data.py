@@ -1,7 +1,6 @@
 import os
 from abc import ABC, abstractmethod
 from itertools import tee
-from pathlib import Path
 from collections import OrderedDict
 
 import pandas as pd
@@ -9,9 +8,11 @@ import pandas as pd
 from config import Config
 from metrics.version_metrics_name import DataNameEnum
 from metrics.version_metrics_name import DataType
+from metrics.symbols import SymbolTable, map_unique
 from projects import ProjectName, Project
 import gc
 from typing import List
+from tracing import span
 
 
 class Data(ABC):
@@ -26,17 +27,13 @@ class Data(ABC):
         else:
             self.data = self._convert_to_df(self.raw_data)
 
+    @staticmethod
+    def get_version_dir(project, version):
+        return Config.get_data_dir(Config().config['VERSION_METRICS']['MetricsDir'], project.github(), version)
+
     @staticmethod
     def _get_path(data_type, project, version):
-        config = Config().config
-        repository_data = config['CACHING']['RepositoryData']
-        metrics_dirname = config['VERSION_METRICS']['MetricsDir']
-        metrics_dir = os.path.join(repository_data, metrics_dirname)
-        metrics_dir_path = Config().get_work_dir_path(metrics_dir)
-        version_dir_path = os.path.join(metrics_dir_path, project.github(), version)
-        Path(version_dir_path).mkdir(parents=True, exist_ok=True)
-        path = os.path.join(version_dir_path, data_type + ".csv")
-        return path
+        return os.path.join(Data.get_version_dir(project, version), data_type + ".csv")
 
     def _read_data_to_df(self):
         data = pd.read_csv(self.path, sep=';')
@@ -44,14 +41,18 @@ class Data(ABC):
 
     @staticmethod
     def _convert_to_df(data):
-        df = pd.DataFrame(data).T.reset_index()
-        df.rename(columns={"index": "id"}, inplace=True)
+        if isinstance(data, pd.DataFrame):
+            # already one row per id, with an 'id' column
+            df = data.reset_index(drop=True)
+        else:
+            df = pd.DataFrame(data).T.reset_index()
+            df.rename(columns={"index": "id"}, inplace=True)
         if 'id' in df.columns.values.tolist():
             df = df[df.id.notnull()]
-            df['id'] = df['id'].apply(os.path.normpath)
+            df['id'] = map_unique(df['id'], os.path.normpath)
         if 'Method_ids' in df.columns.values.tolist():
             df = df[df.Method_ids.notnull()]
-            df['Method_ids'] = df['Method_ids'].apply(os.path.normpath)
+            df['Method_ids'] = map_unique(df['Method_ids'], os.path.normpath)
         return df
 
     def set_raw_data(self, raw):
@@ -137,53 +138,37 @@ class CompositeData(Data):
                 files_dfs.append(df.drop(["Package", "Method", 'Method_ids'], axis=1, errors='ignore'))
         classes_df = None
         methods_df = None
+        symbols = SymbolTable()
 
         if classes_dfs:
-            classes_df = classes_dfs.pop(0)
-            classes_df['File'] = classes_df.File.astype(str)
-            classes_df['Class'] = classes_df.Class.astype(str)
-            classes_df['File'] = classes_df['File'].str.lower()
-            classes_df['Class'] = classes_df['Class'].str.lower()
-            classes_df['File'] = classes_df['File'].apply(lambda x: os.path.normpath(x).lower())
+            classes_df = symbols.encode_columns(classes_dfs.pop(0), ['File', 'Class'], ['File'])
             while classes_dfs:
                 gc.collect()
-                other = classes_dfs.pop(0)
-                other['File'] = other.File.astype(str)
-                other['Class'] = other.Class.astype(str)
-                other['File'] = other['File'].str.lower()
-                other['Class'] = other['Class'].str.lower()
-                other['File'] = other['File'].apply(lambda x: os.path.normpath(x).lower())
+                other = symbols.encode_columns(classes_dfs.pop(0), ['File', 'Class'], ['File'])
                 classes_df = classes_df.merge(other, on=['File', 'Class'], how='outer')
 
         if files_dfs:
             if classes_df is None:
-                classes_df = files_dfs.pop(0)
-                classes_df['File'] = classes_df.File.astype(str)
-                classes_df['File'] = classes_df['File'].str.lower()
-                classes_df['File'] = classes_df['File'].apply(lambda x: os.path.normpath(x).lower())
+                classes_df = symbols.encode_columns(files_dfs.pop(0), ['File'], ['File'])
             while files_dfs:
                 gc.collect()
-                other = files_dfs.pop(0)
-                other['File'] = other.File.astype(str)
-                other['File'] = other['File'].str.lower()
-                other['File'] = other['File'].apply(lambda x: os.path.normpath(x).lower())
+                other = symbols.encode_columns(files_dfs.pop(0), ['File'], ['File'])
                 classes_df = classes_df.merge(other, on=['File'], how='outer')
 
         if methods_dfs:
             methods_df = methods_dfs.pop(0)
             methods_df = methods_df.drop(["File", "Class", "Package", "Method"], axis=1, errors='ignore')
-            methods_df['Method_ids'] = methods_df.Method_ids.astype(str)
-            methods_df['Method_ids'] = methods_df['Method_ids'].str.lower()
-            methods_df['Method_ids'] = methods_df['Method_ids'].apply(lambda x: os.path.normpath(x).lower())
+            methods_df = symbols.encode_columns(methods_df, ['Method_ids'], ['Method_ids'])
             while methods_dfs:
                 gc.collect()
                 method_df = methods_dfs.pop(0)
                 method_df = method_df.drop(["File", "Class", "Package", "Method"], axis=1, errors='ignore')
-                method_df['Method_ids'] = method_df.Method_ids.astype(str)
-                method_df['Method_ids'] = method_df['Method_ids'].str.lower()
-                method_df['Method_ids'] = method_df['Method_ids'].apply(lambda x: os.path.normpath(x).lower())
+                method_df = symbols.encode_columns(method_df, ['Method_ids'], ['Method_ids'])
                 methods_df = methods_df.merge(method_df, on=['Method_ids'], how='outer')
 
+        # the merges ran on int keys, the frames leave with the canonical strings
+        classes_df = symbols.decode_columns(classes_df, ['File', 'Class'])
+        methods_df = symbols.decode_columns(methods_df, ['Method_ids'])
         return classes_df, methods_df
 
 
@@ -211,9 +196,8 @@ class BuggedMethodData(Data):
 
     def build(self, values, column_names):
         df = super().build(values, column_names)
-        id = df['id'].apply(os.path.normpath).iteritems()
-        methods = pd.Series(list(map(lambda x: x[1], id))).values
-        ids = df['id'].apply(os.path.normpath)
+        ids = map_unique(df['id'], os.path.normpath)
+        methods = ids
         df = df.drop(columns='id')
         df.insert(0, 'Method', methods)
         df.insert(0, 'Method_ids', ids)
@@ -235,7 +219,7 @@ class CheckstyleData(Data):
         packages = pd.Series(list(map(lambda x: '.'.join(x[1].split('@')[1].split('.')[:-2]), packages_id))).values
         classes = pd.Series(list(map(lambda x: x[1].split('@')[1].split('.')[:-1][-1], classes_id))).values
         methods = pd.Series(list(map(lambda x: x[1].split('.')[-1].split('(')[0], methods_id))).values
-        ids = df['id'].apply(os.path.normpath)
+        ids = map_unique(df['id'], os.path.normpath)
         df = df.drop(columns='id')
         df.insert(0, 'Method', methods)
         df.insert(0, 'Method_ids', ids)
@@ -278,7 +262,7 @@ class DesigniteImplementationSmellsData(Data):
         packages = pd.Series(list(map(lambda x: '.'.join(x[1].split('@')[1].split('.')[:-2]), packages_id))).values
         classes = pd.Series(list(map(lambda x: x[1].split('@')[1].split('.')[:-1][-1], classes_id))).values
         methods = pd.Series(list(map(lambda x: x[1].split('.')[-1].split('(')[0], methods_id))).values
-        ids = df['id'].apply(os.path.normpath)
+        ids = map_unique(df['id'], os.path.normpath)
         df = df.drop(columns='id')
         df.insert(0, 'Method', methods)
         df.insert(0, 'Method_ids', ids)
@@ -323,7 +307,7 @@ class DesigniteOrganicMethodSmellsData(Data):
         classes = pd.Series(list(map(lambda x: x[1].split('@')[1].split('.')[:-1][-1], classes_id))).values
         methods = pd.Series(list(map(lambda x: x[1].split('.')[-1].split('(')[0], methods_id))).values
         
-        ids = df['id'].apply(os.path.normpath)
+        ids = map_unique(df['id'], os.path.normpath)
         df = df.drop(columns='id')
         df.insert(0, 'Method', methods)
         df.insert(0, 'Method_ids', ids)
@@ -367,7 +351,7 @@ class DesigniteMethodMetricsData(Data):
         classes = pd.Series(list(map(lambda x: x[1].split('@')[1].split('.')[:-1][-1], classes_id))).values
         methods = pd.Series(list(map(lambda x: x[1].split('.')[-1].split('(')[0], methods_id))).values
         
-        ids = df['id'].apply(os.path.normpath)
+        ids = map_unique(df['id'], os.path.normpath)
         df = df.drop(columns='id')
         df.insert(0, 'Method', methods)
         df.insert(0, 'Method_ids', ids)
@@ -414,7 +398,7 @@ class CKData(Data):
         packages = pd.Series(list(map(lambda x: '.'.join(x[1].split('@')[1].split('.')[:-2]), packages_id))).values
         classes = pd.Series(list(map(lambda x: x[1].split('@')[1].split('.')[:-1][-1], classes_id))).values
         methods = pd.Series(list(map(lambda x: x[1].split('.')[-1].split('(')[0], methods_id))).values
-        ids = df['id'].apply(os.path.normpath)
+        ids = map_unique(df['id'], os.path.normpath)
         df = df.drop(columns='id')
         df.insert(0, 'Method', methods)
         df.insert(0, 'Method_ids', ids)
@@ -482,7 +466,7 @@ class JasomeMethodsData(Data):
         packages = pd.Series(list(map(lambda x: '.'.join(x[1].split('@')[1].split('.')[:-2]), packages_id))).values
         classes = pd.Series(list(map(lambda x: x[1].split('@')[1].split('.')[:-1][-1], classes_id))).values
         methods = pd.Series(list(map(lambda x: x[1].split('.')[-1].split('(')[0], methods_id))).values
-        ids = df['id'].apply(os.path.normpath)
+        ids = map_unique(df['id'], os.path.normpath)
         df = df.drop(columns='id')
         df.insert(0, 'Method', methods)
         df.insert(0, 'Method_ids', ids)
@@ -509,11 +493,15 @@ class DataBuilder:
             self.extend(DataNameEnum.get_data_names_by_type(data_types))
 
     def build(self):
-        self.metrics = self.metrics.drop_duplicates().reset_index(drop=True)
-        data = self.metrics.groupby('data_type')['data_column'] \
-            .apply(lambda x: x.values.tolist()).to_dict()
-        column_names = dict(zip(self.metrics['data_column'], self.metrics['data_value']))
-        return self.data_collection.build(data, column_names)
+        with span("data.build", "build") as s:
+            self.metrics = self.metrics.drop_duplicates().reset_index(drop=True)
+            data = self.metrics.groupby('data_type')['data_column'] \
+                .apply(lambda x: x.values.tolist()).to_dict()
+            column_names = dict(zip(self.metrics['data_column'], self.metrics['data_value']))
+            classes_df, methods_df = self.data_collection.build(data, column_names)
+            s.set(classes=len(classes_df) if classes_df is not None else 0,
+                  methods=len(methods_df) if methods_df is not None else 0)
+            return classes_df, methods_df
 
     def __repr__(self):
         self.metrics = self.metrics.drop_duplicates().reset_index(drop=True)
@@ -0,0 +1,350 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+import traceback
+from collections import namedtuple
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait as wait_connections
+
+from caching import FileLock
+from config import Config
+from projects import ProjectName
+from tracing import get_tracer, span
+
+
+Task = namedtuple("Task", ["project", "stage", "version"])
+
+# the stages of a project, in the order they run: the selection (and extraction) of its versions, the features of
+# every selected version and the prediction on the datasets of these features
+STAGES = ("select", "features", "predict")
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+class TaskState(object):
+    """
+    The state of every task of a run in a SQLite database, written by the orchestrator only. A task is pending until
+    it is done, or failed once it failed max_attempts times. A pending task that failed waits its next_try.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tasks (project TEXT, stage TEXT, version TEXT, '
+                                'status TEXT, attempts INTEGER, next_try REAL, seconds REAL, error TEXT, '
+                                'updated REAL, PRIMARY KEY (project, stage, version))')
+        self.connection.execute("CREATE TABLE IF NOT EXISTS options (name TEXT PRIMARY KEY, value TEXT)")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, tasks):
+        """
+        Adds the tasks not added yet, a task keeps its state across runs.
+        """
+        with self.connection:
+            self._insert(tasks)
+
+    def set_options(self, options):
+        """
+        Keeps the options the tasks run with, the planner reads the data types of the timed tasks from them.
+        """
+        with self.connection:
+            self._set_options(options)
+
+    def _set_options(self, options):
+        self.connection.executemany("INSERT OR REPLACE INTO options VALUES (?, ?)",
+                                    [(k, json.dumps(v)) for k, v in options.items()])
+
+    def get_options(self):
+        return {k: json.loads(v) for k, v in self.connection.execute("SELECT name, value FROM options")}
+
+    def _insert(self, tasks):
+        self.connection.executemany("INSERT OR IGNORE INTO tasks (project, stage, version, status, attempts, next_try, "
+                                    "updated) VALUES (?, ?, ?, ?, 0, 0, ?)",
+                                    [tuple(t) + (PENDING, time.time()) for t in tasks])
+
+    def _set(self, task, **values):
+        with self.connection:
+            self._update(task, values)
+
+    def _update(self, task, values):
+        values = dict(values, updated=time.time())
+        columns = ", ".join("{0} = ?".format(k) for k in values)
+        self.connection.execute("UPDATE tasks SET {0} WHERE project = ? AND stage = ? AND version = ?".format(columns),
+                                list(values.values()) + list(task))
+
+    def reset(self, retry_failed=False):
+        """
+        The tasks left running by a crashed run are pending again, and the failed ones too if retry_failed.
+        """
+        statuses = (RUNNING, FAILED) if retry_failed else (RUNNING,)
+        with self.connection:
+            self.connection.execute("UPDATE tasks SET status = ?, next_try = 0, attempts = CASE WHEN status = ? "
+                                    "THEN 0 ELSE attempts END WHERE status IN ({0})".format(
+                                        ", ".join("?" * len(statuses))), (PENDING, FAILED) + statuses)
+
+    def start(self, task):
+        self._set(task, status=RUNNING)
+
+    def done(self, task, seconds):
+        self._set(task, status=DONE, seconds=seconds, error=None)
+
+    def fail(self, task, error, max_attempts, backoff):
+        self._set(task, **self._get_failure(task, error, max_attempts, backoff))
+
+    def _get_failure(self, task, error, max_attempts, backoff):
+        attempts = self.get_attempts(task) + 1
+        if attempts >= max_attempts:
+            return {"status": FAILED, "attempts": attempts, "error": error}
+        # exponential backoff, a flaky jira or network gets time to recover
+        return {"status": PENDING, "attempts": attempts, "error": error,
+                "next_try": time.time() + backoff * 2 ** (attempts - 1)}
+
+    def get_attempts(self, task):
+        return self.connection.execute("SELECT attempts FROM tasks WHERE project = ? AND stage = ? AND version = ?",
+                                       tuple(task)).fetchone()[0]
+
+    def get_tasks(self, status):
+        return [(Task(*row[:3]), row[3]) for row in self.connection.execute(
+            "SELECT project, stage, version, next_try FROM tasks WHERE status = ? ORDER BY project, version", (status,))]
+
+    def get_seconds(self):
+        """
+        The seconds of the done tasks of every project.
+        """
+        return [(Task(*row[:3]), row[3]) for row in self.connection.execute(
+            "SELECT project, stage, version, seconds FROM tasks WHERE status = ? ORDER BY project, version", (DONE,))]
+
+    def get_summary(self):
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"))
+
+
+def get_selection_options(version_num=3, algorithm='bin', version_type="Untyped", strict=False, selected_config=0):
+    return {"version_num": version_num, "algorithm": algorithm, "version_type": version_type, "strict": strict,
+            "selected_config": selected_config}
+
+
+def run_task(task, options):
+    """
+    Runs a task in a worker of the pool. Returns the tasks it adds (the features and prediction of the selected
+    versions after the selection) and the error it failed with, None if it succeeded.
+    """
+    # imported here, the pool workers start without the extractors of the orchestrator process
+    from Main import Main
+    from version_selector import VersionType
+    try:
+        with FileLock(options["lock_path"].format(task.project)), span(task.stage, "task", project=task.project,
+                                                                        version=task.version):
+            main = Main()
+            main.set_project_enum(task.project)
+            selection = dict(options["selection"])
+            selection["version_type"] = VersionType[selection["version_type"]]
+            data_types = set(options["data_types"] or [])
+            if task.stage == "select":
+                selected_config = selection.pop("selected_config")
+                main.choose_versions(**selection)
+                main.set_version_selection(selected_config=selected_config, **selection)
+                main.extract()
+                # the last selected version is not extracted, as in Main.extract_metrics
+                versions = main.extractor.get_selected_versions()[:-1]
+                return [Task(task.project, "features", v) for v in versions] + [Task(task.project, "predict", "")], None
+            if task.stage == "features":
+                main.extract_features_to_version(task.version, True, data_types)
+            elif task.stage == "predict":
+                # the features of the versions are on disk, the extractors only read them
+                main.extract_metrics([], False, data_types)
+                main.create_all_but_one_dataset(data_types)
+            return [], None
+    except Exception:
+        return [], traceback.format_exc()
+    finally:
+        # the pool ends its workers with os._exit, which skips the save of the tracer at exit
+        if get_tracer().enabled:
+            get_tracer().save()
+
+
+def _run_in_process(runner, task, options, connection):
+    try:
+        result = runner(task, options)
+    except Exception:
+        result = [], traceback.format_exc()
+    connection.send(result)
+    connection.close()
+
+
+class TaskProcess(object):
+    """
+    A task run by runner in a process of its own, whose result comes back through a pipe. A process that dies
+    without a result (the OOM killer, a SIGKILL, os._exit) closes the pipe and fails its task, where a Pool would
+    wait for its result forever.
+    """
+    def __init__(self, runner, task, options):
+        self.task = task
+        self.start = time.time()
+        self.connection, writer = Pipe(duplex=False)
+        self.process = Process(target=_run_in_process, args=(runner, task, options, writer))
+        self.process.start()
+        # only the child holds the writing end, so its exit ends the pipe
+        writer.close()
+
+    def wait(self, timeout=None):
+        """
+        Whether the task has ended, with a result or not, within timeout seconds.
+        """
+        return self.connection.poll(timeout)
+
+    def get(self):
+        """
+        The tasks added by the task and its error, once it has ended.
+        """
+        try:
+            added, error = self.connection.recv()
+        except EOFError:
+            added, error = [], None
+        self.connection.close()
+        self.process.join()
+        if error is None and self.process.exitcode != 0:
+            error = "the process of the task exited with {0} without a result".format(self.process.exitcode)
+        return added, error
+
+
+class Orchestrator(object):
+    """
+    Runs the stages of every project as tasks on a pool of processes. A project runs one task at a time (its tasks
+    share its git working tree), several projects run in parallel, and a lock file per project keeps two
+    orchestrators from running the same project. The state of the tasks is on disk, so a run started again
+    after a crash or a stop skips the tasks it has done and retries the ones it was running.
+    Features and prediction tasks run only when data_types is set, and a prediction only after all the features
+    of its project are done. With the estimated seconds of the projects as costs, the longest projects start first,
+    so a long project does not start last and keep the run going alone.
+    """
+    def __init__(self, projects, state_path, lock_dir, data_types=None, selection=None, workers=None,
+                 max_attempts=3, backoff=60.0, runner=run_task, costs=None):
+        self.projects = projects
+        self.state = TaskState(state_path)
+        self.stages = STAGES if data_types else STAGES[:1]
+        self.options = {"data_types": sorted(data_types) if data_types else None,
+                        "selection": selection or get_selection_options(),
+                        "lock_path": os.path.join(lock_dir, "{0}.lock")}
+        self.workers = workers or os.cpu_count()
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.runner = runner
+        self.costs = costs or {}
+        os.makedirs(lock_dir, exist_ok=True)
+
+    @staticmethod
+    def from_config(projects, data_types=None, selection=None, workers=None, costs=None):
+        config = Config().config
+        orchestrator = config['ORCHESTRATOR'] if 'ORCHESTRATOR' in config else {}
+        state_dir = Config.get_work_dir_path(os.path.join(config['CACHING']['RepositoryData'],
+                                                          orchestrator.get('StateDir', 'orchestrator')))
+        Config.assert_dir_exists(state_dir)
+        return Orchestrator(projects, os.path.join(str(state_dir), "tasks.db"), os.path.join(str(state_dir), "locks"),
+                            data_types, selection, workers or int(orchestrator.get('Workers', '0')) or None,
+                            int(orchestrator.get('MaxAttempts', '3')), float(orchestrator.get('Backoff', '60')),
+                            costs=costs)
+
+    def _get_runnable(self):
+        """
+        The pending tasks of the stages to run, but the predictions of projects with features not done yet.
+        """
+        pending = self.state.get_tasks(PENDING)
+        waiting = {task.project for task, _ in pending + self.state.get_tasks(FAILED) if task.stage == "features"}
+        return [(task, next_try) for task, next_try in pending
+                if task.stage in self.stages and not (task.stage == "predict" and task.project in waiting)]
+
+    def _get_ready(self, running):
+        """
+        The tasks to start now, at most one per project not running a task, by their stage order, the projects of
+        the highest costs first.
+        """
+        now = time.time()
+        ready = {}
+        for task, next_try in self._get_runnable():
+            if task.project in running or next_try > now:
+                continue
+            if task.project not in ready or STAGES.index(task.stage) < STAGES.index(ready[task.project].stage):
+                ready[task.project] = task
+        return sorted(ready.values(), key=lambda t: -self.costs.get(t.project, 0))
+
+    def _get_wait(self):
+        """
+        The seconds until the backoff of a failed task ends, None if no task waits for it.
+        """
+        now = time.time()
+        tries = [next_try for _, next_try in self._get_runnable() if next_try > now]
+        return min(tries) - now if tries else None
+
+    def run(self, retry_failed=False):
+        """
+        Runs the tasks until every one is done or failed, returns the number of tasks of every status.
+        """
+        self.state.add(Task(p, "select", "") for p in self.projects)
+        self.state.set_options({"data_types": self.options["data_types"], "selection": self.options["selection"]})
+        self.state.reset(retry_failed)
+        # a process per task, the memory of a large project is not kept for the next one, and a process killed on
+        # the way (e.g. out of memory) is a failed attempt
+        running = {}
+        while True:
+            for task in self._get_ready(running)[:self.workers - len(running)]:
+                self.state.start(task)
+                running[task.project] = TaskProcess(self.runner, task, self.options)
+            wait = self._get_wait()
+            if not running:
+                if wait is None:
+                    break
+                time.sleep(wait)
+                continue
+            ended = wait_connections([p.connection for p in running.values()], timeout=wait)
+            for process in [p for p in running.values() if p.connection in ended]:
+                task = process.task
+                added, error = process.get()
+                del running[task.project]
+                if error is None:
+                    self.state.add(added)
+                    self.state.done(task, time.time() - process.start)
+                    print("done {0} {1} {2} ({3:.1f}s)".format(*task, time.time() - process.start))
+                else:
+                    self.state.fail(task, error, self.max_attempts, self.backoff)
+                    print(f"WARN: {task.project} {task.stage} {task.version} failed:\n{error}")
+        summary = self.state.get_summary()
+        print("tasks:", ", ".join("{0} {1}".format(v, k) for k, v in sorted(summary.items())))
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract the projects on a pool of processes, resuming the last run')
+    parser.add_argument('-c', '--choose', dest='projects', nargs='+', default=None,
+                        help='the names of the projects to extract, all the projects by default')
+    parser.add_argument('-d', '--data_types_to_extract', dest='data_types', action='store', default=None,
+                        help='Json file of the data types to extract as features, only the versions are extracted '
+                             'without it')
+    parser.add_argument('-n', '--num_verions', dest='num_versions', action='store', default=3, type=int,
+                        help='the number of versions to select')
+    parser.add_argument('-t', '--versions_type', dest='versions_type', action='store', default="Untyped")
+    parser.add_argument('-s', '--select_verions', dest='select', action='store', default=0, type=int,
+                        help='the configuration to choose')
+    parser.add_argument('-w', '--workers', dest='workers', action='store', default=None, type=int)
+    parser.add_argument('-r', '--retry_failed', dest='retry_failed', action='store_true',
+                        help='retry the tasks that failed in the previous runs')
+    parser.add_argument('-l', '--longest_first', dest='longest_first', action='store_true',
+                        help='start the projects the planner estimates the longest first')
+    args = parser.parse_args()
+    data_types = None
+    if args.data_types:
+        with open(args.data_types) as f:
+            data_types = set(json.loads(f.read()))
+    projects = args.projects or [p.name for p in ProjectName]
+    selection = get_selection_options(args.num_versions, version_type=args.versions_type, selected_config=args.select)
+    costs = None
+    if args.longest_first:
+        from planner import Planner
+        costs = Planner.from_config().get_costs(projects, data_types, args.num_versions)
+    Orchestrator.from_config(projects, data_types, selection, args.workers, costs).run(args.retry_failed)
+
+
+if __name__ == "__main__":
+    main()
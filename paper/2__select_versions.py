@@ -42,6 +42,7 @@ def select_versions(project_ref):
     except Exception as e:
         failure_log.error("bin | Failed to select {0}.".format(project.github()))
         failure_verbose_log.exception("bin | Failed to select {0}.".format(project.github()))
+    extractor.close()
 
 
 def organize_quadratic_versions(project: ProjectName):
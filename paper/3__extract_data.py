@@ -24,8 +24,8 @@ def extract_data(project_ref):
 
     general_log.info(str(index) + ": " + project.github())
     try:
-        extractor = DataExtractor(project)
-        extractor.extract()
+        with DataExtractor(project) as extractor:
+            extractor.extract()
         success_log.info("Succeeded to extract {0}.".format(project.github()))
     except Exception as e:
         failure_log.error("Failed to extract {0}.".format(project.github()))
@@ -1,4 +1,6 @@
 import logging
+import sys
+from glob import glob
 from multiprocessing import Pool
 
 import numpy as np
@@ -7,11 +9,12 @@ import pandas as pd
 from abc import ABC, abstractmethod
 from imblearn.over_sampling import SMOTE
 from sklearn import preprocessing
+from sklearn.base import clone
 from sklearn.discriminant_analysis import LinearDiscriminantAnalysis, QuadraticDiscriminantAnalysis
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.feature_selection import SelectPercentile, chi2, mutual_info_classif, f_classif, SelectFromModel, RFECV
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import precision_score, recall_score, f1_score, roc_auc_score, brier_score_loss
+from sklearn.metrics import brier_score_loss
 from sklearn.naive_bayes import BernoulliNB
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.neural_network import MLPClassifier
@@ -19,9 +22,13 @@ from sklearn.svm import SVC, LinearSVC
 from sklearn.tree import DecisionTreeClassifier
 
 from config import Config
+from fingerprint import Fingerprint, StageStore
+from metrics import version_metrics_data
+from metrics.version_metrics_data import Data
 from paper.builders import Builders
 from paper.utils import FeatureSelectionHelper, EstimatorSelectionHelper
 from projects import ProjectName
+from scoring import MultiMetricScorer
 
 
 class Analysis(ABC):
@@ -77,17 +84,23 @@ class Analysis(ABC):
         return versions
 
     def analyse(self):
+        # every stage is read back from the caching when the fingerprint of its inputs did not change
         try:
-            datasets = self.build_datasets(self.versions)
-            training_df, testing_df = self.split_dataset(datasets)
-            training_df, testing_df = self.handle_missing_values(training_df, testing_df)
-            selected_features, selected_training = self.select_features(training_df)
-            oversampled_training = self.oversample(selected_training, training_df)
+            datasets_fingerprint = self.get_datasets_fingerprint()
+            training_df, testing_df = self.caching.cached("datasets", datasets_fingerprint, self.get_datasets)
+            features_fingerprint = Fingerprint(datasets_fingerprint, self.selection_methods)
+            selected_features, selected_training = self.caching.cached(
+                "selected_features", features_fingerprint, lambda: self.select_features(training_df))
+            oversample_fingerprint = Fingerprint(features_fingerprint, "oversample")
+            oversampled_training = self.caching.cached(
+                "oversamples", oversample_fingerprint, lambda: self.oversample(selected_training, training_df))
             selected_testing = self.get_selected_testing(testing_df, selected_features)
-            summaries = self.hyper_parameterize(oversampled_training)
+            summaries = self.hyper_parameterize(oversampled_training, oversample_fingerprint)
             top_summaries = self.get_top_summaries(summaries)
             configurations = self.get_configurations(top_summaries)
-            self.calculate_scores(configurations, oversampled_training, selected_testing)
+            scores_fingerprint = Fingerprint(oversample_fingerprint, configurations, self.models)
+            self.caching.cached("scores", scores_fingerprint,
+                                lambda: self.calculate_scores(configurations, oversampled_training, selected_testing))
             self.logs.summary("{0} | {1} | project succeeded.".format(self.metric, self.project_name))
 
         except Analysis.FailedBuildDataset:
@@ -107,6 +120,26 @@ class Analysis(ABC):
             self.logs.summary("{0} | {1} | project failed.".format(self.metric, self.project_name))
             return
 
+    @staticmethod
+    def get_code_fingerprint():
+        return Fingerprint.of_code(sys.modules[__name__], sys.modules[Builders.__module__],
+                                   sys.modules[EstimatorSelectionHelper.__module__], version_metrics_data)
+
+    def get_datasets_fingerprint(self):
+        """
+        The fingerprint of the metrics files of the versions, the input of the analysis.
+        """
+        fingerprint = Fingerprint(type(self).__name__, self.metric, self.versions, self.get_code_fingerprint())
+        for version in self.versions:
+            paths = glob(os.path.join(Data.get_version_dir(self.project, version), "*.csv"))
+            fingerprint.update_files(sorted(p for p in paths if not p.endswith("_describe.csv")))
+        return fingerprint
+
+    def get_datasets(self):
+        datasets = self.build_datasets(self.versions)
+        training_df, testing_df = self.split_dataset(datasets)
+        return self.handle_missing_values(training_df, testing_df)
+
     @abstractmethod
     def build_datasets(self, versions):
         self.logs.general("{0} | {1} | 2/11 | Building Datasets ...".format(self.metric, self.project_name))
@@ -152,13 +185,17 @@ class Analysis(ABC):
         self.logs.success("{0} | {1} | 6/11 | Oversampled dataset.".format(self.metric, self.project_name))
         return oversampled_datasets
 
-    def hyper_parameterize(self, oversample_datasets):
-        def get_summary(X, y):
+    def hyper_parameterize(self, oversample_datasets, fingerprint):
+        def get_summary(method, X, y):
             helper = EstimatorSelectionHelper(self.models, self.params)
-            helper.fit(X, y)
+            # a grid search is rerun only if its model, its parameters or its dataset changed
+            for key in self.models:
+                model_fingerprint = Fingerprint(fingerprint, method, key, self.models[key], self.params[key])
+                helper.grid_searches[key] = self.caching.cached("grid_search_{0}_{1}".format(method, key),
+                                                                model_fingerprint, lambda: helper.fit_model(key, X, y))
             return helper.score_summary()
         self.logs.general("{0} | {1} | 7/11 | Tuning models and parameters ...".format(self.metric, self.project_name))
-        summaries = {method: get_summary(data[0], data[1])
+        summaries = {method: get_summary(method, data[0], data[1])
                      for method, data in oversample_datasets.items()}
         self.caching.store_summaries(summaries)
         self.logs.success("{0} | {1} | 7/11 | Tuned models and parameters.".format(self.metric, self.project_name))
@@ -194,21 +231,25 @@ class Analysis(ABC):
 
     def calculate_scores(self, configurations, oversampled_training, selected_testing):
         def calculate_score(method_name, training, testing, configuration):
-            estimator = self.models[configuration['estimator']]
+            # a clone, the shared models keep their parameters for the next analyses
+            estimator = clone(self.models[configuration['estimator']])
             params = {key: val for key, val in configuration.items() if not (val is None or key == 'estimator')}
             estimator.set_params(**params)
             training_X, training_y = training
             estimator.fit(training_X, training_y)
             testing_X, testing_y = testing
             prediction_y = estimator.predict(testing_X)
+            # the scores are of the predicted labels, the probabilities only fill the arguments of the scorer
+            scores = MultiMetricScorer(names=['precision', 'recall', 'f1', 'roc_auc_score']).score(
+                testing_y, prediction_y, prediction_y)
             scores_dict = {
                 'estimator': configuration['estimator'],
                 'configuration': str(params),
                 'feature_selection': method_name,
-                'precision': precision_score(testing_y, prediction_y),
-                'recall': recall_score(testing_y, prediction_y),
-                'f1-measure': f1_score(testing_y, prediction_y),
-                'auc-roc': roc_auc_score(testing_y, prediction_y),
+                'precision': scores['precision'],
+                'recall': scores['recall'],
+                'f1-measure': scores['f1'],
+                'auc-roc': scores['roc_auc_score'],
                 'brier score': brier_score_loss(testing_y, prediction_y)
             }
             return scores_dict
@@ -523,6 +564,10 @@ class Caching:
         Config.assert_dir_exists(self.base)
         self.project_name = project_name
         self.metric = metric
+        self.stages = StageStore(os.path.join(self.base, self.metric, self.project_name, "stages"))
+
+    def cached(self, stage, fingerprint, compute):
+        return self.stages.cached(stage, fingerprint, compute)
 
     def store_datasets(self, training_df, testing_df):
         datasets_dir = os.path.join(self.base, self.metric, self.project_name, "dataset")
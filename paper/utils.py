@@ -20,13 +20,16 @@ class EstimatorSelectionHelper:
 
     def fit(self, X, y, cv=10, n_jobs=1, verbose=1, scoring=None, refit=False):
         for key in self.keys:
-            self.general_log.info("Running GridSearchCV for {0}".format(key))
-            model = self.models[key]
-            params = self.params[key]
-            gs = GridSearchCV(model, params, cv=cv, n_jobs=n_jobs, verbose=verbose,
-                              scoring=scoring, refit=refit, return_train_score=True)
-            gs.fit(X, y)
-            self.grid_searches[key] = gs
+            self.grid_searches[key] = self.fit_model(key, X, y, cv, n_jobs, verbose, scoring, refit)
+
+    def fit_model(self, key, X, y, cv=10, n_jobs=1, verbose=1, scoring=None, refit=False):
+        self.general_log.info("Running GridSearchCV for {0}".format(key))
+        model = self.models[key]
+        params = self.params[key]
+        gs = GridSearchCV(model, params, cv=cv, n_jobs=n_jobs, verbose=verbose,
+                          scoring=scoring, refit=refit, return_train_score=True)
+        gs.fit(X, y)
+        return gs
 
     def score_summary(self, sort_by='mean_score'):
 
@@ -0,0 +1,254 @@
+import argparse
+import heapq
+import json
+import os
+
+import git
+import numpy as np
+from scipy.optimize import nnls
+
+from config import Config
+from orchestrator import TaskState, PENDING, RUNNING, FAILED
+from projects import ProjectName
+
+
+# the data types read from the history of the project, the others run a tool on the source of every version
+HISTORY_DATA_TYPES = {"process_files", "issues_files", "bugged", "bugged_methods"}
+# the benchmark stages of the whole pipeline, the extractors and prediction are timed inside Main.extract_metrics
+BENCHMARK_STAGES = ("DataExtractor.", "Main.")
+
+
+def get_repo_stats(repo_path):
+    """
+    The statistics of a repository git gives without reading its history: the number of commits and tags, the
+    number and size of the java files of HEAD (the size stands for their lines) and the size of its objects.
+    """
+    repo = git.Repo(repo_path)
+    objects = dict(line.split(": ", 1) for line in repo.git.count_objects("-v").splitlines())
+    java_files, java_bytes = 0, 0
+    for line in repo.git.ls_tree("-r", "-l", "HEAD").splitlines():
+        # <mode> <type> <object> <size>\t<path>
+        info, path = line.split("\t", 1)
+        if path.endswith(".java"):
+            java_files += 1
+            java_bytes += int(info.split()[3])
+    return {"commits": int(repo.git.rev_list("--count", "HEAD")), "tags": len(repo.tags), "java_files": java_files,
+            "java_kb": java_bytes / 1024.0,
+            "objects_kb": int(objects.get("size", 0)) + int(objects.get("size-pack", 0))}
+
+
+class CostModel(object):
+    """
+    The seconds of the pipeline of a project: a fixed cost, the selection that reads its commits and tags, and for
+    every extracted version the tools that run on its java files and the data types that read its commits:
+    intercept + a * commits + b * tags + versions * (c * java_kb * tools + d * commits * history data types).
+    The coefficients are fitted by non negative least squares on the recorded timings.
+    """
+    FEATURES = ["intercept", "commits", "tags", "tools_kb", "history_commits"]
+    # rough seconds of every feature, until enough timings are recorded
+    DEFAULT_COEFFICIENTS = [60.0, 0.01, 1.0, 0.05, 0.0005]
+
+    def __init__(self, coefficients=None, observations=0):
+        self.coefficients = coefficients or list(CostModel.DEFAULT_COEFFICIENTS)
+        self.observations = observations
+
+    @staticmethod
+    def get_features(stats, data_types, versions):
+        data_types = set(data_types or [])
+        history = len(data_types & HISTORY_DATA_TYPES)
+        tools = len(data_types - HISTORY_DATA_TYPES)
+        return [1.0, stats["commits"], stats["tags"], versions * tools * stats["java_kb"],
+                versions * history * stats["commits"]]
+
+    @staticmethod
+    def fit(observations):
+        """
+        The model of the observations, (stats, data types, versions, seconds) tuples. The default model if there are
+        fewer observations than features.
+        """
+        if len(observations) < len(CostModel.FEATURES):
+            print(f"WARN: {len(observations)} timings recorded, the default costs are used until "
+                  f"{len(CostModel.FEATURES)} are")
+            return CostModel(observations=len(observations))
+        X = np.array([CostModel.get_features(stats, data_types, versions)
+                      for stats, data_types, versions, _ in observations], dtype=np.float64)
+        y = np.array([seconds for _, _, _, seconds in observations], dtype=np.float64)
+        # every feature adds time, a negative coefficient would only fit the noise of few observations
+        coefficients, _ = nnls(X, y)
+        return CostModel(coefficients.tolist(), len(observations))
+
+    def estimate(self, stats, data_types, versions):
+        return float(np.dot(self.coefficients, self.get_features(stats, data_types, versions)))
+
+
+def get_benchmark_observations(path):
+    """
+    The runs of benchmark.py that recorded the statistics of their repository and did not fail.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        history = json.load(f)
+    observations = []
+    for entry in history:
+        for run in entry["runs"]:
+            if run.get("error") or "stats" not in run:
+                continue
+            seconds = sum(stage["seconds"] for name, stage in run["stages"].items()
+                          if name.startswith(BENCHMARK_STAGES))
+            # the last selected version is not extracted
+            observations.append((run["stats"], run["data_types"], run["version_num"] - 1, seconds))
+    return observations
+
+
+def get_state_observations(path, get_stats):
+    """
+    The projects whose tasks are all done in the state of an orchestrator or a work queue, with the seconds of
+    their tasks.
+    """
+    if not os.path.exists(path):
+        return []
+    state = TaskState(path)
+    try:
+        data_types = state.get_options().get("data_types")
+        unfinished = {task.project for status in (PENDING, RUNNING, FAILED) for task, _ in state.get_tasks(status)}
+        projects = {}
+        for task, seconds in state.get_seconds():
+            if task.project in unfinished:
+                continue
+            project = projects.setdefault(task.project, {"seconds": 0.0, "versions": 0, "stages": set()})
+            project["seconds"] += seconds or 0.0
+            project["versions"] += int(task.stage == "features")
+            project["stages"].add(task.stage)
+    finally:
+        state.close()
+    observations = []
+    for name, project in sorted(projects.items()):
+        stats = get_stats(name)
+        if stats is not None and "select" in project["stages"]:
+            observations.append((stats, data_types, project["versions"], project["seconds"]))
+    return observations
+
+
+def get_makespan(costs, workers):
+    """
+    The end of the last project when the projects start longest first, each on the worker free first.
+    """
+    loads = [0.0] * max(workers, 1)
+    for cost in sorted(costs, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + cost)
+    return max(loads)
+
+
+class Planner(object):
+    """
+    Estimates the seconds of the projects from cheap statistics of their repositories, with a cost model fitted on
+    the benchmarks and the runs of the orchestrator and the work queue. The costs order the projects longest first,
+    and a plan warns when its projects will not end within the budget.
+    """
+    def __init__(self, model, budget=0.0):
+        self.model = model
+        self.budget = budget
+        self.stats = {}
+
+    @staticmethod
+    def get_stats(name):
+        """
+        The statistics of the repository of the project, None if it is not cloned.
+        """
+        path = ProjectName[name].value.path()
+        if not os.path.isdir(path):
+            return None
+        return get_repo_stats(path)
+
+    @staticmethod
+    def from_config():
+        config = Config().config
+        orchestrator = config['ORCHESTRATOR'] if 'ORCHESTRATOR' in config else {}
+        planner = config['PLANNER'] if 'PLANNER' in config else {}
+        repository_data = config['CACHING']['RepositoryData']
+        observations = get_benchmark_observations(str(Config.get_work_dir_path(
+            os.path.join(repository_data, "benchmark.json"))))
+        for state_dir, name in ((orchestrator.get('StateDir', 'orchestrator'), "tasks.db"),
+                                (orchestrator.get('QueueDir', 'work_queue'), "queue.db")):
+            observations.extend(get_state_observations(str(Config.get_work_dir_path(
+                os.path.join(repository_data, state_dir, name))), Planner.get_stats))
+        return Planner(CostModel.fit(observations), float(planner.get('Budget', '0')))
+
+    def estimate(self, project, data_types, versions):
+        """
+        The estimated seconds of the project, None if its repository is not cloned.
+        """
+        if project not in self.stats:
+            self.stats[project] = self.get_stats(project)
+        if self.stats[project] is None:
+            return None
+        return self.model.estimate(self.stats[project], data_types, versions)
+
+    def get_costs(self, projects, data_types, version_num):
+        """
+        The estimated seconds of the projects that are cloned, for version_num selected versions.
+        """
+        costs = {}
+        for project in projects:
+            cost = self.estimate(project, data_types, version_num - 1)
+            if cost is None:
+                print(f"WARN: {project} is not cloned, its cost is unknown")
+                continue
+            costs[project] = cost
+        return costs
+
+    def plan(self, projects, data_types, version_num, workers, budget=None):
+        """
+        The costs of the projects longest first and the estimated end of the run on workers processes.
+        """
+        budget = self.budget if budget is None else budget
+        costs = self.get_costs(projects, data_types, version_num)
+        plan = {"order": sorted(costs, key=lambda p: -costs[p]), "costs": costs,
+                "total": sum(costs.values()), "makespan": get_makespan(list(costs.values()), workers)}
+        if budget:
+            for project in plan["order"]:
+                if costs[project] > budget:
+                    print(f"WARN: {project} alone is estimated at {costs[project]:.0f}s, over the budget of "
+                          f"{budget:.0f}s")
+            if plan["makespan"] > budget:
+                print(f"WARN: the run is estimated to end after {plan['makespan']:.0f}s on {workers} workers, "
+                      f"over the budget of {budget:.0f}s")
+        return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Estimate the time to extract the projects, for every configuration '
+                                                 'of externals/configurations without -d')
+    parser.add_argument('-c', '--choose', dest='projects', nargs='+', default=None,
+                        help='the names of the projects, all the projects by default')
+    parser.add_argument('-d', '--data_types_to_extract', dest='data_types', action='store', default=None,
+                        help='Json file of the data types to extract as features')
+    parser.add_argument('-n', '--num_verions', dest='num_versions', action='store', default=3, type=int)
+    parser.add_argument('-w', '--workers', dest='workers', action='store', default=None, type=int)
+    parser.add_argument('-b', '--budget', dest='budget', action='store', default=None, type=float,
+                        help='seconds the run should end within, the Budget of config.ini by default')
+    args = parser.parse_args()
+    config = Config().config
+    orchestrator = config['ORCHESTRATOR'] if 'ORCHESTRATOR' in config else {}
+    workers = args.workers or int(orchestrator.get('Workers', '0')) or os.cpu_count()
+    configurations = [args.data_types] if args.data_types else sorted(
+        f.path for f in os.scandir(str(Config.get_work_dir_path(os.path.join(config['EXTERNALS']['BaseDir'],
+                                                                                  "configurations"))))
+        if f.name.endswith(".json"))
+    planner = Planner.from_config()
+    print("cost model of {0} timings: {1}".format(planner.model.observations, ", ".join(
+        "{0} {1:.4g}".format(f, c) for f, c in zip(CostModel.FEATURES, planner.model.coefficients))))
+    for path in configurations:
+        with open(path) as f:
+            data_types = json.loads(f.read())
+        plan = planner.plan(args.projects or [p.name for p in ProjectName], data_types, args.num_versions, workers,
+                            args.budget)
+        print("{0}: {1:.0f}s on {2} workers, {3:.0f}s in total".format(os.path.basename(path), plan["makespan"],
+                                                                       workers, plan["total"]))
+        for project in plan["order"]:
+            print("  {0} {1:.0f}s".format(project, plan["costs"][project]))
+
+
+if __name__ == "__main__":
+    main()
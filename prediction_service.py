@@ -0,0 +1,426 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from classification_instance import ClassificationInstance
+from config import Config
+from projects import ProjectName
+from tracing import span
+
+
+# the features of every level: their directory in VERSION_METRICS, the file of a version and the column of the names
+LEVELS = {"classes": ("ClassesData", "{0}_aggregated_classes_.csv", "File"),
+          "methods": ("MethodData", "{0}.csv", "Method_ids")}
+
+
+class LRUCache(object):
+    """
+    The max_size values used last, shared by the threads of the service.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, load):
+        with self.lock:
+            if key in self.values:
+                self.hits += 1
+                self.values.move_to_end(key)
+                return self.values[key]
+            self.misses += 1
+        # loaded out of the lock, two threads may load the same key once
+        value = load()
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+        return value
+
+    def get_stats(self):
+        with self.lock:
+            return {"size": len(self.values), "hits": self.hits, "misses": self.misses}
+
+
+class ModelStore(object):
+    """
+    The models and features the pipeline saved for every project: the model of a level in its dataset directory,
+    the features of a version in the classes_data and method_data directories.
+    """
+    @staticmethod
+    def get_project(name):
+        return ProjectName[name].value
+
+    def get_model_path(self, project, level):
+        dataset = Config().config['VERSION_METRICS']['Dataset']
+        return os.path.join(Config.get_data_dir(dataset, self.get_project(project).github(), level), "model.pkl")
+
+    def get_rows_path(self, project, level, version):
+        data_dir, file_name, _ = LEVELS[level]
+        return os.path.join(Config.get_data_dir(Config().config['VERSION_METRICS'][data_dir],
+                                                self.get_project(project).github()), file_name.format(version))
+
+    def get_versions(self, project):
+        """
+        The versions with extracted features.
+        """
+        suffix = LEVELS["classes"][1].format("")
+        classes_dir = os.path.dirname(self.get_rows_path(project, "classes", ""))
+        return [f[:-len(suffix)] for f in os.listdir(classes_dir) if f.endswith(suffix)]
+
+    def get_repo_path(self, project):
+        return self.get_project(project).path()
+
+    def load_model(self, project, level):
+        path = self.get_model_path(project, level)
+        if not os.path.exists(path):
+            raise KeyError("no model for the {0} of {1}, run its prediction first".format(level, project))
+        return ClassificationInstance.load_model(path)
+
+    def load_rows(self, project, level, version, features_list):
+        """
+        The features of the model for every name of the version, indexed by the name.
+        """
+        path = self.get_rows_path(project, level, version)
+        if not os.path.exists(path):
+            raise KeyError("no features for {0} {1}".format(project, version))
+        _, _, name_column = LEVELS[level]
+        df = pd.read_csv(path, sep=';')
+        names = df[name_column]
+        if level == "classes":
+            names = names.map(os.path.normpath)
+        df = df.reindex(columns=features_list).set_axis(names)
+        # as Main.fillna does for the testing sets
+        for col in df:
+            df[col] = df[col].fillna(0 if df[col].dtype == int or df[col].dtype == float else False)
+        return df[~df.index.duplicated(keep='last')]
+
+
+class ServiceMetrics(object):
+    """
+    The number and latency of the answered queries and the size of the batches they were predicted in.
+    """
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched = 0
+        # (end time, seconds) of the last window queries
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latencies.append((time.time(), seconds))
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batched += size
+
+    def get(self):
+        with self.lock:
+            now = time.time()
+            latencies = [seconds for _, seconds in self.latencies]
+            last_minute = sum(1 for end, _ in self.latencies if end > now - 60)
+            metrics = {"requests": self.requests, "errors": self.errors, "uptime": now - self.start,
+                       "throughput": self.requests / max(now - self.start, 1e-9),
+                       "throughput_last_minute": last_minute / min(60.0, max(now - self.start, 1e-9)),
+                       "batches": self.batches, "mean_batch_size": self.batched / self.batches if self.batches else 0}
+        metrics["latency_ms"] = get_percentiles(latencies)
+        return metrics
+
+
+def get_percentiles(seconds):
+    if not seconds:
+        return {}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+    return {"p50": p50, "p95": p95, "p99": p99, "max": max(seconds) * 1000}
+
+
+class PredictionService(object):
+    """
+    Answers the defect probability of a file or method at a version, or at the commit of the last extracted version
+    it descends from. The models stay loaded and the features of the versions used last stay in memory. The queries
+    wait up to batch_window seconds to be predicted in one call per (project, level, version), so concurrent
+    queries share the cost of predict_proba.
+    """
+    def __init__(self, store=None, cache_size=16, batch_window=0.005, max_batch=256):
+        self.store = store or ModelStore()
+        self.models = {}
+        self.models_lock = threading.Lock()
+        self.rows = LRUCache(cache_size)
+        self.commits = LRUCache(1024)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.metrics = ServiceMetrics()
+        self.queries = queue.Queue()
+        self.batcher = threading.Thread(target=self._run_batches, daemon=True)
+        self.batcher.start()
+
+    @staticmethod
+    def from_config():
+        config = Config().config
+        service = config['PREDICTION_SERVICE'] if 'PREDICTION_SERVICE' in config else {}
+        return PredictionService(cache_size=int(service.get('CacheSize', '16')),
+                                 batch_window=float(service.get('BatchWindow', '5')) / 1000,
+                                 max_batch=int(service.get('MaxBatch', '256')))
+
+    def close(self):
+        self.queries.put(None)
+        self.batcher.join()
+
+    def get_model(self, project, level):
+        key = (project, level)
+        with self.models_lock:
+            if key not in self.models:
+                self.models[key] = self.store.load_model(project, level)
+            return self.models[key]
+
+    def get_rows(self, project, level, version):
+        features_list, _ = self.get_model(project, level)
+        return self.rows.get_or_load((project, level, version),
+                                     lambda: self.store.load_rows(project, level, version, features_list))
+
+    def resolve_version(self, project, commit):
+        """
+        The last extracted version the commit descends from.
+        """
+        def resolve():
+            import git
+            repo = git.Repo(self.store.get_repo_path(project))
+            target = repo.commit(commit)
+            candidates = []
+            for version in self.store.get_versions(project):
+                try:
+                    version_commit = repo.commit(version.replace('\\', '/'))
+                except (git.BadName, ValueError):
+                    continue
+                if repo.is_ancestor(version_commit, target):
+                    candidates.append((version_commit.committed_date, version))
+            if not candidates:
+                raise KeyError("no extracted version before {0}".format(commit))
+            return max(candidates)[1]
+        return self.commits.get_or_load((project, commit), resolve)
+
+    def predict(self, project, level, version, names):
+        """
+        The probability of every name, None for the names without features at the version.
+        """
+        features_list, classifier = self.get_model(project, level)
+        rows = self.get_rows(project, level, version)
+        known = [n for n in dict.fromkeys(names) if n in rows.index]
+        probabilities = {}
+        if known:
+            proba = ClassificationInstance.get_probabilities(classifier, features_list, rows.loc[known])
+            probabilities = proba.get("True_probability", pd.Series(0.0, index=proba.index)).to_dict()
+        return [probabilities.get(n) for n in names]
+
+    def _run_batches(self):
+        while True:
+            item = self.queries.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queries.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queries.put(None)
+                    break
+                batch.append(item)
+            groups = {}
+            for key, name, future in batch:
+                groups.setdefault(key, []).append((name, future))
+            for (project, level, version), items in groups.items():
+                with span("service.batch", "service", project=project, level=level, version=version) as s:
+                    try:
+                        probabilities = self.predict(project, level, version, [name for name, _ in items])
+                    except Exception as e:
+                        for _, future in items:
+                            future.set_exception(e)
+                        continue
+                    s.set_rows(len(items))
+                self.metrics.record_batch(len(items))
+                for (_, future), probability in zip(items, probabilities):
+                    future.set_result(probability)
+
+    def submit(self, project, name, version=None, commit=None, level="classes"):
+        """
+        Queues a query, returns its future and the version it is answered at.
+        """
+        if level not in LEVELS:
+            raise KeyError("unknown level {0}".format(level))
+        if version is None:
+            if commit is None:
+                raise KeyError("a version or a commit is required")
+            version = self.resolve_version(project, commit)
+        if level == "classes":
+            name = os.path.normpath(name)
+        future = Future()
+        self.queries.put(((project, level, version), name, future))
+        return future, version
+
+    def query(self, queries):
+        """
+        Answers the queries (dicts of project, name, version or commit and level), submitted together so that
+        they share batches.
+        """
+        start = time.perf_counter()
+        submitted = []
+        for q in queries:
+            try:
+                submitted.append((q,) + self.submit(q.get("project"), q.get("name"), q.get("version"),
+                                                    q.get("commit"), q.get("level", "classes")))
+            except Exception as e:
+                submitted.append((q, e, None))
+        answers = []
+        for q, future, version in submitted:
+            answer = dict(q, version=version)
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                answer["probability"] = future.result()
+                if answer["probability"] is None:
+                    answer["error"] = "{0} has no features at {1}".format(q.get("name"), version)
+            except Exception as e:
+                answer["error"] = str(e)
+            self.metrics.record(time.perf_counter() - start, "error" in answer)
+            answers.append(answer)
+        return answers
+
+    def get_metrics(self):
+        return dict(self.metrics.get(), features_cache=self.rows.get_stats(),
+                    models=["{0}/{1}".format(*k) for k in self.models])
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    GET /predict?project=&name=&version=|commit=&level=, POST /predict with a json list of such queries, and
+    GET /metrics.
+    """
+    def _send(self, status, value):
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/metrics":
+            return self._send(200, self.server.service.get_metrics())
+        if url.path != "/predict":
+            return self._send(404, {"error": "unknown path {0}".format(url.path)})
+        answer = self.server.service.query([{k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}])[0]
+        self._send(404 if "error" in answer else 200, answer)
+
+    def do_POST(self):
+        if urllib.parse.urlparse(self.path).path != "/predict":
+            return self._send(404, {"error": "unknown path {0}".format(self.path)})
+        try:
+            queries = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            return self._send(400, {"error": str(e)})
+        self._send(200, self.server.service.query(queries))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service, host="127.0.0.1", port=8765):
+    """
+    The http server of the service, not started.
+    """
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def load_test(url, queries, requests=1000, concurrency=16):
+    """
+    Sends the queries to the service at url from concurrency threads until requests were answered, returns the
+    throughput and the latencies seen by the clients.
+    """
+    def send(q):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen("{0}/predict?{1}".format(url, urllib.parse.urlencode(q))) as response:
+                response.read()
+            error = False
+        except urllib.error.URLError:
+            error = True
+        return time.perf_counter() - start, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(send, (queries[i % len(queries)] for i in range(requests))))
+    seconds = time.perf_counter() - start
+    return {"requests": requests, "errors": sum(error for _, error in results), "seconds": seconds,
+            "throughput": requests / seconds, "latency_ms": get_percentiles([latency for latency, _ in results])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the defect probabilities of the predicted projects, or load '
+                                                 'test the service')
+    parser.add_argument('action', choices=['serve', 'load'])
+    parser.add_argument('--host', dest='host', action='store', default=None)
+    parser.add_argument('-p', '--port', dest='port', action='store', default=None, type=int)
+    parser.add_argument('-u', '--url', dest='url', action='store', default=None,
+                        help='the service to load test, a service is started in this process without it')
+    parser.add_argument('-c', '--choose', dest='project', action='store', help='the project to load test')
+    parser.add_argument('-v', '--version', dest='version', action='store', help='the version to load test')
+    parser.add_argument('-l', '--level', dest='level', action='store', default='classes', choices=sorted(LEVELS))
+    parser.add_argument('-n', '--requests', dest='requests', action='store', default=1000, type=int)
+    parser.add_argument('-t', '--threads', dest='threads', action='store', default=16, type=int)
+    args = parser.parse_args()
+    config = Config().config
+    options = config['PREDICTION_SERVICE'] if 'PREDICTION_SERVICE' in config else {}
+    host = args.host or options.get('Host', '127.0.0.1')
+    port = args.port if args.port is not None else int(options.get('Port', '8765'))
+    if args.action == 'serve':
+        server = serve(PredictionService.from_config(), host, port)
+        print("serving on http://{0}:{1}".format(*server.server_address))
+        server.serve_forever()
+        return
+    store = ModelStore()
+    features_list, _ = store.load_model(args.project, args.level)
+    names = store.load_rows(args.project, args.level, args.version, features_list).index.tolist()
+    queries = [{"project": args.project, "version": args.version, "level": args.level, "name": n} for n in names]
+    server = None
+    url = args.url
+    if url is None:
+        server = serve(PredictionService.from_config(), host, 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://{0}:{1}".format(*server.server_address)
+    print(json.dumps(load_test(url, queries, args.requests, args.threads), indent=2))
+    if server is not None:
+        print(json.dumps(server.service.get_metrics(), indent=2))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+from config import Config
+
+
+class ProjectStore(object):
+    """
+    A per-project SQLite database with the commits, committed files, issues, versions, versions infos and files
+    tables DataExtractor also exports as csv files, indexed on the columns the later steps look up by.
+    Versions, versions infos and files of a selection of versions are kept apart by their selection column,
+    the short name of the selected versions ('' for all the versions).
+    """
+    INDEXES = {"commits": [["commit_id"], ["issue_id"], ["commit_date"]],
+               "committed_files": [["file_name", "commit_date"], ["commit_id"], ["issue_id"], ["commit_date"]],
+               "issues": [["issue_id"]],
+               "versions": [["selection", "version_name"]],
+               "versions_infos": [["selection", "version_name"], ["commit_id"]],
+               "files": [["selection", "version_name"], ["file_name"]]}
+
+    def __init__(self, github_name, path=None):
+        self.path = path or self.get_path(github_name)
+        self.connection = sqlite3.connect(self.path)
+
+    @staticmethod
+    def _get_store_dir():
+        config = Config().config
+        return Config.get_work_dir_path(os.path.join(config['CACHING']['RepositoryData'],
+                                                     config['DATA_EXTRACTION']['Store']))
+
+    @staticmethod
+    def get_path(github_name):
+        store_dir = ProjectStore._get_store_dir()
+        Config.assert_dir_exists(store_dir)
+        return os.path.join(store_dir, github_name + ".db")
+
+    @staticmethod
+    def exists(github_name):
+        # only checks, the store directory is created by the first store written
+        return os.path.exists(os.path.join(ProjectStore._get_store_dir(), github_name + ".db"))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _get_type(series):
+        if pd.api.types.is_bool_dtype(series):
+            return "BOOLEAN"
+        if pd.api.types.is_integer_dtype(series):
+            return "INTEGER"
+        if pd.api.types.is_float_dtype(series):
+            return "REAL"
+        return "TEXT"
+
+    @staticmethod
+    def _infer_types(df):
+        # keep the types read_csv would give the csv export, e.g. numeric issue ids
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            try:
+                df[col] = pd.to_numeric(df[col])
+            except (ValueError, TypeError):
+                pass
+        return df
+
+    def _get_columns(self, table):
+        return [row[1] for row in self.connection.execute('PRAGMA table_info("{0}")'.format(table))]
+
+    def _get_bool_columns(self, table):
+        return [row[1] for row in self.connection.execute('PRAGMA table_info("{0}")'.format(table)) if row[2] == "BOOLEAN"]
+
+    def has(self, table, **scope):
+        if not self._get_columns(table):
+            return False
+        where, params = self._get_where(scope)
+        query = 'SELECT 1 FROM "{0}"{1} LIMIT 1'.format(table, where)
+        return self.connection.execute(query, params).fetchone() is not None
+
+    @staticmethod
+    def _get_where(filters):
+        if not filters:
+            return "", []
+        return " WHERE " + " AND ".join('"{0}" = ?'.format(k) for k in filters), list(filters.values())
+
+    def write(self, table, df, **scope):
+        """
+        Replaces the rows of the table that match scope (all of them when no scope is given) with df,
+        in a single transaction.
+        """
+        df = self._infer_types(df).assign(**scope)
+        columns = df.columns.to_list()
+        rows = df.astype(object).where(df.notnull(), None).values.tolist()
+        with self.connection:
+            if not scope or (self._get_columns(table) and set(self._get_columns(table)) != set(columns)):
+                self.connection.execute('DROP TABLE IF EXISTS "{0}"'.format(table))
+            self.connection.execute('CREATE TABLE IF NOT EXISTS "{0}" ({1})'.format(
+                table, ", ".join('"{0}" {1}'.format(c, self._get_type(df[c])) for c in columns)))
+            for i, index in enumerate(self.INDEXES.get(table, [])):
+                self.connection.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ({2})'.format(
+                    table, i, ", ".join('"{0}"'.format(c) for c in index)))
+            if scope:
+                where, params = self._get_where(scope)
+                self.connection.execute('DELETE FROM "{0}"{1}'.format(table, where), params)
+            self.connection.executemany('INSERT INTO "{0}" ({1}) VALUES ({2})'.format(
+                table, ", ".join('"{0}"'.format(c) for c in columns), ", ".join("?" * len(columns))), rows)
+
+    def read(self, table, query="", params=(), drop=()):
+        df = pd.read_sql_query('SELECT * FROM "{0}" {1}'.format(table, query), self.connection, params=list(params))
+        for col in self._get_bool_columns(table):
+            df[col] = df[col].astype(bool)
+        return df.drop(list(drop), axis=1, errors='ignore')
+
+    def get_commits(self):
+        return self.read("commits")
+
+    def get_committed_files(self, file_names=None, before=None):
+        """
+        The committed files, optionally only of the given files and of the commits before the given
+        '%Y-%m-%d %H:%M:%S' date.
+        """
+        if file_names is not None:
+            file_names = list(file_names)
+            # sqlite caps the number of bound parameters of a statement
+            return pd.concat([self._get_committed_files_chunk(file_names[i: i + 900], before)
+                              for i in range(0, len(file_names), 900)] or [self._get_committed_files_chunk([], before)],
+                             ignore_index=True)
+        return self._get_committed_files_chunk(None, before)
+
+    def _get_committed_files_chunk(self, file_names, before):
+        conditions, params = [], []
+        if file_names is not None:
+            conditions.append("file_name IN ({0})".format(", ".join("?" * len(file_names))))
+            params.extend(file_names)
+        if before is not None:
+            conditions.append("commit_date < ?")
+            params.append(str(before))
+        query = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.read("committed_files", query, params)
+
+    def get_issues(self):
+        return self.read("issues")
+
+    def get_versions(self, selection=''):
+        return self.read("versions", "WHERE selection = ?", [selection], drop=["selection"])
+
+    def get_version_date(self, version, selection=''):
+        row = self.connection.execute("SELECT version_date FROM versions WHERE selection = ? AND version_name = ?",
+                                      [selection, version]).fetchone()
+        return row[0] if row else None
+
+    def get_versions_infos(self, version, selection=''):
+        return self.read("versions_infos", "WHERE selection = ? AND version_name = ?", [selection, version],
+                         drop=["selection", "version_name"])
+
+    def get_files(self, version, selection=''):
+        """
+        The file_name and is_buggy of every file of the version.
+        """
+        return self.read("files", "WHERE selection = ? AND version_name = ?", [selection, version],
+                         drop=["selection", "version_name"])
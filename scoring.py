@@ -1,100 +1,119 @@
+import numpy as np
 import sklearn.metrics as metrics
-from sklearn.metrics.scorer import get_scorer
+from sklearn.metrics import get_scorer
 from itertools import product
 
+
+COSTS = list(product(range(1, 4), range(1, 4)))
+
+
+def _positive_proba(y_score):
+    # the probabilities of both classes, or of the positive class only as the scorers of sklearn give them
+    y_score = np.asarray(y_score, dtype=np.float64)
+    return y_score[:, 1] if y_score.ndim == 2 else y_score
+
+
+def _classes_proba(y_score):
+    y_score = np.asarray(y_score, dtype=np.float64)
+    if y_score.ndim == 2:
+        return y_score[:, 0], y_score[:, 1]
+    return 1.0 - y_score, y_score
+
+
 def pr_auc_score(y_true, y_score):
     precision, recall, thresholds = \
-        metrics.precision_recall_curve(y_true, y_score[:, 1])
-    return metrics.auc(recall, precision, reorder=True)
+        metrics.precision_recall_curve(y_true, _positive_proba(y_score))
+    return metrics.auc(recall, precision)
+
+
+def confusion(y_true, y_pred):
+    """
+    The (tn, fp, fn, tp) of binary labels, in one pass.
+    """
+    counts = np.bincount(2 * np.asarray(y_true, dtype=bool) + np.asarray(y_pred, dtype=bool), minlength=4)
+    return tuple(int(c) for c in counts)
 
 
 def tn(y_true, y_pred):
-    return metrics.confusion_matrix(y_true, y_pred)[0, 0]
+    return confusion(y_true, y_pred)[0]
 
 
 def fp(y_true, y_pred):
-    return metrics.confusion_matrix(y_true, y_pred)[0, 1]
+    return confusion(y_true, y_pred)[1]
 
 
 def fn(y_true, y_pred):
-    return metrics.confusion_matrix(y_true, y_pred)[1, 0]
+    return confusion(y_true, y_pred)[2]
 
 
 def tp(y_true, y_pred):
-    return metrics.confusion_matrix(y_true, y_pred)[1, 1]
+    return confusion(y_true, y_pred)[3]
 
 
 def cost(y_true, y_pred, fp_cost=1, fn_cost=1):
-    return fp(y_true, y_pred) * fp_cost + fn(y_true, y_pred) * fn_cost
+    _, fp_, fn_, _ = confusion(y_true, y_pred)
+    return fp_ * fp_cost + fn_ * fn_cost
 
 
 def mean_squared_error_cost(true_value, pred_value, fp_cost=1, fn_cost=1):
     # fp is true_value=true and pred_value>0.5
     # fn is true_value=false and pred_value<0.5
-    from numpy import mean
-    squares = []
-    for t, p in zip(true_value, pred_value):
-        diff = (t - p) ** 2
-        if t:
-            diff *= fp_cost
-        else:
-            diff *= fn_cost
-        squares.append(diff)
-    return mean(squares)
+    true_value = np.asarray(true_value, dtype=np.float64)
+    pred_value = np.asarray(list(pred_value), dtype=np.float64)
+    return np.mean((true_value - pred_value) ** 2 * np.where(true_value != 0, fp_cost, fn_cost))
+
+
+def _squared_errors(y_true, y_pred):
+    # the squared errors of the probability of the true class and of the other class
+    y_true = np.asarray(y_true, dtype=bool)
+    negative, positive = _classes_proba(y_pred)
+    return y_true, (y_true - np.where(y_true, positive, negative)) ** 2, \
+        (y_true - np.where(y_true, negative, positive)) ** 2
+
+
+def _mse_costs(y_true, y_pred, fp_cost=1, fn_cost=1):
+    y_true, true_class, other_class = _squared_errors(y_true, y_pred)
+    weights = np.where(y_true, fp_cost, fn_cost)
+    return np.mean(true_class * weights), np.mean(other_class * weights)
 
 
 def mse(y_true, y_pred):
-    return min(metrics.mean_squared_error([1 if x else 0 for x in y_true],
-                                          map(lambda x: x[0][1 if x[1] else 0], zip(y_pred, y_true))),
-               metrics.mean_squared_error([1 if x else 0 for x in y_true],
-                                          map(lambda x: x[0][0 if x[1] else 1], zip(y_pred, y_true))))
+    return min(_mse_costs(y_true, y_pred))
 
 
 def mse_cost(y_true, y_pred, fp_cost=1, fn_cost=1):
-    return min(mean_squared_error_cost([1 if x else 0 for x in y_true],
-                                       map(lambda x: x[0][1 if x[1] else 0], zip(y_pred, y_true)),
-                                       fp_cost=fp_cost, fn_cost=fn_cost),
-               mean_squared_error_cost([1 if x else 0 for x in y_true],
-                                       map(lambda x: x[0][0 if x[1] else 1], zip(y_pred, y_true)),
-                                       fp_cost=fp_cost, fn_cost=fn_cost))
+    return min(_mse_costs(y_true, y_pred, fp_cost=fp_cost, fn_cost=fn_cost))
 
 
 def mse1(y_true, y_pred):
-    return max(metrics.mean_squared_error([1 if x else 0 for x in y_true],
-                                          map(lambda x: x[0][1 if x[1] else 0], zip(y_pred, y_true))),
-               metrics.mean_squared_error([1 if x else 0 for x in y_true],
-                                          map(lambda x: x[0][0 if x[1] else 1], zip(y_pred, y_true))))
+    return max(_mse_costs(y_true, y_pred))
 
 
 def mse_cost1(y_true, y_pred, fp_cost=1, fn_cost=1):
-    return max(mean_squared_error_cost([1 if x else 0 for x in y_true],
-                                       map(lambda x: x[0][1 if x[1] else 0], zip(y_pred, y_true)),
-                                       fp_cost=fp_cost, fn_cost=fn_cost),
-               mean_squared_error_cost([1 if x else 0 for x in y_true],
-                                       map(lambda x: x[0][0 if x[1] else 1], zip(y_pred, y_true)),
-                                       fp_cost=fp_cost, fn_cost=fn_cost))
+    return max(_mse_costs(y_true, y_pred, fp_cost=fp_cost, fn_cost=fn_cost))
+
+
+SCORES_NAMES = ['accuracy', 'adjusted_mutual_info_score', 'adjusted_rand_score', 'average_precision',
+                'completeness_score',
+                'f1', 'f1_macro', 'f1_micro', 'f1_weighted', 'fowlkes_mallows_score',
+                'homogeneity_score', 'mutual_info_score', 'neg_log_loss', 'normalized_mutual_info_score',
+                'precision',
+                'precision_macro', 'precision_micro', 'precision_weighted', 'recall',
+                'recall_macro', 'recall_micro', 'recall_weighted', 'roc_auc', 'v_measure_score']
+METRICS_FUNCTIONS = [metrics.cohen_kappa_score, metrics.hinge_loss,
+                     metrics.matthews_corrcoef, metrics.accuracy_score,
+                     metrics.f1_score, metrics.hamming_loss,
+                     metrics.log_loss, metrics.precision_score, metrics.recall_score,
+                     metrics.zero_one_loss, metrics.average_precision_score, metrics.roc_auc_score]
 
 
 def get_scoring():
     scoring = {}
     scoring_proba = {}
-    scores_names = ['accuracy', 'adjusted_mutual_info_score', 'adjusted_rand_score', 'average_precision',
-                    'completeness_score',
-                    'f1', 'f1_macro', 'f1_micro', 'f1_weighted', 'fowlkes_mallows_score',
-                    'homogeneity_score', 'mutual_info_score', 'neg_log_loss', 'normalized_mutual_info_score',
-                    'precision',
-                    'precision_macro', 'precision_micro', 'precision_weighted', 'recall',
-                    'recall_macro', 'recall_micro', 'recall_weighted', 'roc_auc', 'v_measure_score']
-    metrics_functions = [metrics.cohen_kappa_score, metrics.hinge_loss,
-                         metrics.matthews_corrcoef, metrics.accuracy_score,
-                         metrics.f1_score, metrics.hamming_loss,
-                         metrics.log_loss, metrics.precision_score, metrics.recall_score,
-                         metrics.zero_one_loss, metrics.average_precision_score, metrics.roc_auc_score]
-
     pr_auc_scorer = metrics.make_scorer(pr_auc_score, greater_is_better=True,
-                                        needs_proba=True)
-    scoring = {x: get_scorer(x) for x in scores_names}
-    scoring.update({x.__name__: metrics.make_scorer(x) for x in metrics_functions})
+                                        response_method="predict_proba")
+    scoring = {x: get_scorer(x) for x in SCORES_NAMES}
+    scoring.update({x.__name__: metrics.make_scorer(x) for x in METRICS_FUNCTIONS})
 
     scoring["pr_auc"] = pr_auc_scorer
 
@@ -102,18 +121,143 @@ def get_scoring():
                     'fp': metrics.make_scorer(fp), 'fn': metrics.make_scorer(fn)})
 
     scoring.update({"cost_{0}_{1}".format(*x): metrics.make_scorer(cost, fp_cost=x[0], fn_cost=x[1]) for x in
-                    product(range(1, 4), range(1, 4))})
+                    COSTS})
     scoring.update(
-        {"mse_cost_{0}_{1}".format(*x): metrics.make_scorer(mse_cost, fp_cost=x[0], fn_cost=x[1], needs_proba=True) for
-         x in
-         product(range(1, 4), range(1, 4))})
+        {"mse_cost_{0}_{1}".format(*x): metrics.make_scorer(mse_cost, fp_cost=x[0], fn_cost=x[1],
+                                                            response_method="predict_proba") for x in COSTS})
 
     scoring.update(
-        {"mse1_cost_{0}_{1}".format(*x): metrics.make_scorer(mse_cost1, fp_cost=x[0], fn_cost=x[1], needs_proba=True)
-         for x in
-         product(range(1, 4), range(1, 4))})
+        {"mse1_cost_{0}_{1}".format(*x): metrics.make_scorer(mse_cost1, fp_cost=x[0], fn_cost=x[1],
+                                                             response_method="predict_proba") for x in COSTS})
 
-    scoring["mse"] = metrics.make_scorer(mse, needs_proba=True)
-    scoring["mse1"] = metrics.make_scorer(mse1, needs_proba=True)
+    scoring["mse"] = metrics.make_scorer(mse, response_method="predict_proba")
+    scoring["mse1"] = metrics.make_scorer(mse1, response_method="predict_proba")
 
     return scoring, scoring_proba
+
+
+def _safe_divide(a, b):
+    return a / b if b else 0.0
+
+
+def _entropy(counts):
+    counts = counts[counts > 0]
+    if len(counts) <= 1:
+        return 0.0
+    total = counts.sum()
+    return float(-np.sum((counts / total) * (np.log(counts) - np.log(total))))
+
+
+class MultiMetricScorer(object):
+    """
+    All the scores of get_scoring from one predict and one predict_proba of the estimator: the label metrics are
+    computed from a single confusion matrix, the probability ones from the same arrays.
+    A scoring for cross_validate and GridSearchCV (with refit set to one of the names), for binary labels.
+    """
+    def __init__(self, names=None):
+        self.names = names
+
+    def __call__(self, estimator, X, y_true):
+        return self.score(y_true, estimator.predict(X), estimator.predict_proba(X))
+
+    def score(self, y_true, y_pred, y_proba):
+        y_true = np.asarray(y_true, dtype=bool)
+        y_pred = np.asarray(y_pred, dtype=bool)
+        positive = _positive_proba(y_proba)
+        tn_, fp_, fn_, tp_ = confusion(y_true, y_pred)
+        cm = np.array([[tn_, fp_], [fn_, tp_]], dtype=np.float64)
+        scores = {'tp': tp_, 'tn': tn_, 'fp': fp_, 'fn': fn_}
+        scores.update({"cost_{0}_{1}".format(*x): fp_ * x[0] + fn_ * x[1] for x in COSTS})
+        scores.update(self._label_scores(cm))
+        scores.update(self._clustering_scores(cm, y_true, y_pred))
+        scores.update(self._ranking_scores(y_true, y_pred, positive))
+        scores.update(self._proba_scores(y_true, y_proba))
+        if self.names is not None:
+            return {name: scores[name] for name in self.names}
+        return scores
+
+    @staticmethod
+    def _label_scores(cm):
+        n = cm.sum()
+        support, predicted, correct = cm.sum(axis=1), cm.sum(axis=0), np.diag(cm)
+        # the labels of the averages are those in y_true or y_pred
+        present = (support + predicted) > 0
+        precision = np.array([_safe_divide(correct[i], predicted[i]) for i in range(2)])
+        recall = np.array([_safe_divide(correct[i], support[i]) for i in range(2)])
+        f1 = np.array([_safe_divide(2 * correct[i], support[i] + predicted[i]) for i in range(2)])
+        accuracy = _safe_divide(correct.sum(), n)
+        scores = {'accuracy': accuracy, 'accuracy_score': accuracy,
+                  'hamming_loss': 1 - accuracy, 'zero_one_loss': 1 - accuracy}
+        for name, values in [('precision', precision), ('recall', recall), ('f1', f1)]:
+            scores[name] = scores[name + '_score'] = values[1]
+            scores[name + '_macro'] = values[present].mean()
+            scores[name + '_micro'] = accuracy
+            scores[name + '_weighted'] = _safe_divide(np.dot(values, support), support.sum())
+        covariance = correct.sum() * n - np.dot(predicted, support)
+        denominator = np.sqrt((n ** 2 - np.dot(predicted, predicted)) * (n ** 2 - np.dot(support, support)))
+        scores['matthews_corrcoef'] = _safe_divide(covariance, denominator)
+        expected = np.outer(support, predicted) / n if n else np.zeros_like(cm)
+        disagreement = 1 - np.eye(2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores['cohen_kappa_score'] = 1 - np.sum(disagreement * cm) / np.sum(disagreement * expected)
+        return scores
+
+    @staticmethod
+    def _clustering_scores(cm, y_true, y_pred):
+        # the confusion matrix is the contingency matrix of the labels present in y_true and y_pred
+        contingency = cm[cm.sum(axis=1) > 0][:, cm.sum(axis=0) > 0]
+        n = contingency.sum()
+        classes, clusters = contingency.sum(axis=1), contingency.sum(axis=0)
+        mi = metrics.mutual_info_score(None, None, contingency=contingency.astype(np.int64)) if n else 0.0
+        h_true, h_pred = _entropy(classes), _entropy(clusters)
+        homogeneity = mi / h_true if h_true else 1.0
+        completeness = mi / h_pred if h_pred else 1.0
+        v_measure = 0.0 if homogeneity + completeness == 0 else \
+            2 * homogeneity * completeness / (homogeneity + completeness)
+        if len(classes) == len(clusters) and len(classes) <= 1:
+            nmi = 1.0
+        else:
+            nmi = _safe_divide(mi, (h_true + h_pred) / 2) if mi else 0.0
+        sum_squares = np.dot(contingency.ravel(), contingency.ravel())
+        pair_tp = sum_squares - n
+        pair_fp = np.sum(contingency * clusters[None, :]) - sum_squares
+        pair_fn = np.sum(contingency * classes[:, None]) - sum_squares
+        pair_tn = n ** 2 - pair_fp - pair_fn - sum_squares
+        if pair_fn == 0 and pair_fp == 0:
+            ari = 1.0
+        else:
+            ari = 2.0 * (pair_tp * pair_tn - pair_fn * pair_fp) / \
+                ((pair_tp + pair_fn) * (pair_fn + pair_tn) + (pair_tp + pair_fp) * (pair_fp + pair_tn))
+        pk, qk = np.dot(clusters, clusters) - n, np.dot(classes, classes) - n
+        fmi = float(np.sqrt(pair_tp / pk) * np.sqrt(pair_tp / qk)) if pair_tp != 0 else 0.0
+        return {'mutual_info_score': mi, 'homogeneity_score': homogeneity, 'completeness_score': completeness,
+                'v_measure_score': v_measure, 'normalized_mutual_info_score': nmi, 'adjusted_rand_score': ari,
+                'fowlkes_mallows_score': fmi,
+                # the expected mutual information has no closed form over the contingency matrix
+                'adjusted_mutual_info_score': metrics.adjusted_mutual_info_score(y_true, y_pred)}
+
+    @staticmethod
+    def _ranking_scores(y_true, y_pred, positive):
+        # the metrics of METRICS_FUNCTIONS are scored on the predicted labels, as make_scorer does
+        scores = {'hinge_loss': metrics.hinge_loss(y_true, y_pred), 'pr_auc': pr_auc_score(y_true, positive)}
+        for name, y_score in [('average_precision_score', y_pred), ('average_precision', positive)]:
+            scores[name] = metrics.average_precision_score(y_true, y_score)
+        # undefined for a single class, the scorers fail and cross_validate gives nan
+        both_classes = 0 < y_true.sum() < len(y_true)
+        for name, y_score in [('roc_auc_score', y_pred), ('roc_auc', positive)]:
+            scores[name] = metrics.roc_auc_score(y_true, y_score) if both_classes else np.nan
+        scores['log_loss'] = metrics.log_loss(y_true, y_pred) if both_classes else np.nan
+        scores['neg_log_loss'] = -metrics.log_loss(y_true, positive) if both_classes else np.nan
+        return scores
+
+    @staticmethod
+    def _proba_scores(y_true, y_proba):
+        y_true, squared_true, squared_other = _squared_errors(y_true, y_proba)
+        scores = {'mse': min(squared_true.mean(), squared_other.mean()),
+                  'mse1': max(squared_true.mean(), squared_other.mean())}
+        for fp_cost, fn_cost in COSTS:
+            weights = np.where(y_true, fp_cost, fn_cost)
+            costs = (np.mean(squared_true * weights), np.mean(squared_other * weights))
+            scores["mse_cost_{0}_{1}".format(fp_cost, fn_cost)] = min(costs)
+            scores["mse1_cost_{0}_{1}".format(fp_cost, fn_cost)] = max(costs)
+        return scores
@@ -0,0 +1,175 @@
+import gzip
+import os
+import pickle
+from multiprocessing import Pool
+
+import git
+
+from caching import cached, FileStorage, get_stats, git_sha
+
+
+def _compute_once(args):
+    cache_dir, marker_dir, key = args
+
+    @cached("parallel", cache_dir=cache_dir)
+    def compute(key):
+        open(os.path.join(marker_dir, str(os.getpid()) + "_" + key), "w").close()
+        return key * 2
+    return compute(key)
+
+
+class TestCached:
+    def test_cached_result(self, tmp_path):
+        calls = []
+
+        @cached("results", cache_dir=tmp_path)
+        def compute(key):
+            calls.append(key)
+            return {"key": key}
+
+        assert compute("a") == {"key": "a"}
+        assert compute("a") == {"key": "a"}
+        assert calls == ["a"]
+        assert compute.storage.stats["hits"] == 1
+        assert compute.storage.stats["misses"] == 1
+        assert get_stats()["hits"] >= 1
+
+    def test_reads_existing_gzip_entries(self, tmp_path):
+        tmp_path.joinpath("legacy").mkdir()
+        with gzip.GzipFile(str(tmp_path.joinpath("legacy", "KEY.gzip")), "wb") as f:
+            pickle.dump([1, 2, 3], f, pickle.HIGHEST_PROTOCOL)
+
+        @cached("legacy", cache_dir=tmp_path, storage=FileStorage(tmp_path.joinpath("legacy"), "none"))
+        def compute():
+            raise AssertionError("should be read from the cache")
+
+        assert compute() == [1, 2, 3]
+
+    def test_truncated_entry_is_recomputed(self, tmp_path):
+        @cached("truncated", cache_dir=tmp_path)
+        def compute(key):
+            return list(range(1000))
+
+        compute("k")
+        path = tmp_path.joinpath("truncated", "k.gzip")
+        data = path.read_bytes()
+        path.write_bytes(data[:len(data) // 2])
+        assert compute("k") == list(range(1000))
+        assert compute.storage.stats["errors"] == 1
+        assert path.read_bytes() == data
+
+    def test_no_temporary_files_left(self, tmp_path):
+        @cached("atomic", cache_dir=tmp_path)
+        def compute(key):
+            return key
+
+        compute("a")
+        assert os.listdir(str(tmp_path.joinpath("atomic"))) == ["a.gzip"]
+
+    def test_lru_eviction(self, tmp_path):
+        storage = FileStorage(tmp_path.joinpath("lru"), "none", max_bytes=2500, root=tmp_path)
+        for key in ["a", "b", "c"]:
+            storage.put(key, b"x" * 1000)
+        assert storage.get("a") == (False, None)
+        assert storage.get("b")[0] and storage.get("c")[0]
+        # b was read last, so d evicts c
+        storage.get("b")
+        os.utime(str(tmp_path.joinpath("lru", "c.pickle")), (0, 0))
+        storage.put("d", b"x" * 1000)
+        assert storage.get("b")[0] and storage.get("d")[0]
+        assert not storage.get("c")[0]
+        assert storage.stats["evictions"] == 2
+
+    def test_eviction_walks_only_over_the_limit(self, tmp_path, monkeypatch):
+        storage = FileStorage(tmp_path.joinpath("walks"), "none", max_bytes=5000, root=tmp_path)
+        walks = []
+        get_entries = FileStorage._get_entries
+        monkeypatch.setattr(FileStorage, "_get_entries", lambda self: walks.append(1) or get_entries(self))
+        for key in ["a", "b", "c", "b"]:
+            storage.put(key, b"x" * 1000)
+        # the first put counts the entries, the others add to the total
+        assert len(walks) == 1
+        for key in ["d", "e"]:
+            storage.put(key, b"x" * 1000)
+        assert len(walks) == 2
+        assert storage.stats["evictions"] == 1
+
+    def test_storage_created_once(self, tmp_path):
+        storages = [cached("once", cache_dir=tmp_path)(lambda key: key).storage for _ in range(3)]
+        assert storages[0] is storages[1] is storages[2]
+
+    def test_parallel_computes_once(self, tmp_path):
+        marker_dir = tmp_path.joinpath("markers")
+        marker_dir.mkdir()
+        with Pool(4) as p:
+            results = p.map(_compute_once, [(tmp_path, str(marker_dir), "key")] * 8)
+        assert results == ["keykey"] * 8
+        assert len(os.listdir(str(marker_dir))) == 1
+
+
+class TestInputAwareKeys:
+    def test_stale_entry_is_refreshed(self, tmp_path):
+        inputs = {"sha": "1"}
+        calls = []
+
+        @cached("inputs", cache_dir=tmp_path, inputs=lambda key: [inputs["sha"]])
+        def compute(key):
+            calls.append(inputs["sha"])
+            return inputs["sha"]
+
+        assert compute("k") == "1"
+        assert compute("k") == "1"
+        inputs["sha"] = "2"
+        assert compute("k") == "2"
+        assert calls == ["1", "2"]
+        assert compute.storage.stats["stale"] == 1
+        assert os.listdir(str(tmp_path.joinpath("inputs"))) == ["k.gzip"]
+
+    def test_salt(self, tmp_path):
+        @cached("salted", cache_dir=tmp_path, salt="v1")
+        def compute(key):
+            return "v1"
+
+        @cached("salted", cache_dir=tmp_path, salt="v2")
+        def compute_again(key):
+            return "v2"
+
+        assert compute("k") == "v1"
+        assert compute_again("k") == "v2"
+        assert compute("k") == "v1"
+
+    def test_entries_without_inputs_are_stamped(self, tmp_path):
+        inputs = {"sha": "1"}
+
+        @cached("legacy_inputs", cache_dir=tmp_path)
+        def compute(key):
+            return "old"
+
+        @cached("legacy_inputs", cache_dir=tmp_path, inputs=lambda key: [inputs["sha"]])
+        def compute_with_inputs(key):
+            return "new " + inputs["sha"]
+
+        assert compute("k") == "old"
+        # the entry of before the inputs is kept, with the fingerprint of the current inputs
+        assert compute_with_inputs("k") == "old"
+        assert compute_with_inputs.storage.stats["stamped"] == 1
+        assert compute_with_inputs("k") == "old"
+        assert compute_with_inputs.storage.stats["stamped"] == 1
+        inputs["sha"] = "2"
+        assert compute_with_inputs("k") == "new 2"
+
+    def test_put(self, tmp_path):
+        @cached("seeded", cache_dir=tmp_path, inputs=lambda key, url="a": [url])
+        def compute(key, url="a"):
+            raise AssertionError("should be read from the cache")
+
+        compute.put("k", "seeded", "b")
+        assert compute("k", "b") == "seeded"
+
+    def test_git_sha(self, tmp_path):
+        repo = git.Repo.init(str(tmp_path))
+        tmp_path.joinpath("a.txt").write_text("a")
+        repo.index.add(["a.txt"])
+        commit = repo.index.commit("a", author=git.Actor("a", "a@a"), committer=git.Actor("a", "a@a"))
+        assert git_sha(str(tmp_path)) == commit.hexsha
+        assert git_sha(str(tmp_path.joinpath("missing"))) is None
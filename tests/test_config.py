@@ -0,0 +1,23 @@
+import os
+import shutil
+
+import pytest
+
+from config import Config
+
+
+class TestConfig:
+    def test_read_once(self):
+        assert Config().config is Config().config
+
+    def test_missing_keys(self, monkeypatch):
+        monkeypatch.setattr(Config, "REQUIRED", {"CACHING": ["RepositoryData", "Missing"]})
+        with pytest.raises(ValueError, match=r"\[CACHING\] Missing"):
+            Config._read()
+
+    def test_data_dir_recreated(self):
+        path = Config.get_data_dir("test_config_data_dir")
+        shutil.rmtree(path)
+        assert Config.get_data_dir("test_config_data_dir") == path
+        assert os.path.isdir(path)
+        shutil.rmtree(path)
@@ -0,0 +1,40 @@
+import git
+import pytest
+
+from create_test_env import SyntheticRepo
+
+
+class TestSyntheticRepo:
+    def test_create(self, tmp_path):
+        repo = SyntheticRepo(str(tmp_path.joinpath("synthetic")), "SYN", commits=60, files=5, methods=3, tags=4).create()
+        git_repo = git.Repo(repo.path)
+        assert len(list(git_repo.iter_commits())) == 60
+        assert sorted(t.name for t in git_repo.tags) == ["release-1.0.0", "release-1.0.1", "release-1.0.2",
+                                                         "release-1.0.3"]
+        assert list(git_repo.remotes[0].urls) == ["https://github.com/apache/synthetic.git"]
+        assert not git_repo.is_dirty()
+        assert tmp_path.joinpath("synthetic", "src", "main", "java", "org", "synthetic", "p4", "C4.java").exists()
+
+    def test_deterministic(self, tmp_path):
+        shas = []
+        for name in ["a", "b"]:
+            repo = SyntheticRepo(str(tmp_path.joinpath(name)), "SYN", commits=30, files=5, seed=1).create()
+            shas.append(git.Repo(repo.path).head.commit.hexsha)
+        assert shas[0] == shas[1]
+
+    def test_replaces_only_synthetic_repos(self, tmp_path):
+        repo = SyntheticRepo(str(tmp_path.joinpath("synthetic")), "SYN", commits=10, files=2)
+        repo.create()
+        assert repo.create().path == str(tmp_path.joinpath("synthetic"))
+        clone = git.Repo.init(str(tmp_path.joinpath("clone")))
+        with pytest.raises(ValueError):
+            SyntheticRepo(clone.working_tree_dir, "SYN", commits=10, files=2).create()
+        assert tmp_path.joinpath("clone", ".git").exists()
+
+    def test_issues(self, tmp_path):
+        repo = SyntheticRepo(str(tmp_path.joinpath("synthetic")), "SYN", commits=100, files=5).create()
+        issues = {issue.key: issue for issue in repo.get_issues("http://jira")}
+        linked = [c.summary.split(":")[0] for c in git.Repo(repo.path).iter_commits() if c.summary.startswith("SYN-")]
+        assert linked and all(key in issues for key in linked)
+        assert {issue.type for issue in issues.values()} == {"bug", "improvement"}
+        assert issues["SYN-1"].fields["priority"] == "Major"
@@ -0,0 +1,53 @@
+import os
+
+import git
+import pandas as pd
+
+from classification_instance import ClassificationInstance
+from create_test_env import SyntheticRepo
+from jit import JITPredictor, RunningProcess, PROCESS_COLUMNS
+
+
+def _get_predictor(tmp_path):
+    repo = SyntheticRepo(str(tmp_path.joinpath("synthetic")), "SYN", commits=20, files=3, methods=2).create()
+    git_repo = git.Repo(repo.path)
+    names = [os.path.normpath(b.path) for b in git_repo.head.commit.tree.traverse()
+             if b.type == 'blob' and b.path.endswith('.java')]
+    training = pd.DataFrame({"all_process_count": [0, 1, 2, 8, 9, 10] * 3,
+                             "TotalNumberOfOperators": [1, 2, 3, 50, 60, 70] * 3,
+                             "Bugged": [False, False, False, True, True, True] * 3})
+    features = pd.DataFrame({"all_process_count": [0] * len(names), "TotalNumberOfOperators": [1] * len(names)},
+                            index=names)
+    classification_instance = ClassificationInstance(training, features.assign(Bugged=False), names, str(tmp_path),
+                                                     save_all=False)
+    predictor = JITPredictor(repo.path, classification_instance, features, RunningProcess(PROCESS_COLUMNS),
+                             git_repo.head.commit.hexsha)
+    return predictor, git_repo, names
+
+
+class TestJITPredictor:
+    def test_poll_scores_new_commits(self, tmp_path):
+        predictor, git_repo, names = _get_predictor(tmp_path)
+        assert predictor.poll() == []
+        path = os.path.join(git_repo.working_tree_dir, names[0])
+        with open(path) as f:
+            content = f.read()
+        # a new method before the closing brace of the class
+        content = content[:content.rindex("}")] + "    public int added(int x) {\n        return x * 2 + 1;\n    }\n}\n"
+        with open(path, "w") as f:
+            f.write(content)
+        git_repo.index.add([names[0]])
+        git_repo.index.commit("add a method")
+        results = predictor.poll()
+        assert len(results) == 1
+        files = results[0]["files"]
+        assert [f["file"] for f in files] == [names[0]]
+        assert 0.0 <= files[0]["probability"] <= 1.0
+        assert any(m.endswith(".added(int)") for m in files[0]["methods"])
+        assert predictor.features.loc[names[0], "all_process_count"] == 1
+        assert predictor.features.loc[names[0], "TotalNumberOfOperators"] > 1
+        assert predictor.poll() == []
+
+    def test_get_changed_lines(self):
+        diff = "@@ -3,0 +4,2 @@\n+a\n+b\n@@ -10 +12 @@\n-c\n+d\n@@ -20,2 +21,0 @@\n-e\n-f\n"
+        assert JITPredictor.get_changed_lines(diff) == {4, 5, 12, 21}
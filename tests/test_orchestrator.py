@@ -0,0 +1,63 @@
+import os
+import signal
+
+from orchestrator import Orchestrator, Task, TaskState, DONE, FAILED, PENDING
+
+
+def _run(task, options):
+    # a marker file per call, the calls are made in the workers
+    calls_dir = options["selection"]["calls_dir"]
+    name = "_".join(task) + "_" + str(len([f for f in os.listdir(calls_dir) if f.startswith("_".join(task))]))
+    open(os.path.join(calls_dir, name), "w").close()
+    if task.project == "killed":
+        # as the OOM killer would
+        os.kill(os.getpid(), signal.SIGKILL)
+    if task.project == "broken":
+        return [], "error"
+    if task.project == "flaky" and name.endswith("_0"):
+        return [], "first attempt"
+    if task.stage == "select":
+        return [Task(task.project, "features", "1.0"), Task(task.project, "features", "2.0"),
+                Task(task.project, "predict", "")], None
+    return [], None
+
+
+def _get_orchestrator(tmp_path, projects):
+    calls_dir = tmp_path.joinpath("calls")
+    calls_dir.mkdir(exist_ok=True)
+    return Orchestrator(projects, str(tmp_path.joinpath("tasks.db")), str(tmp_path.joinpath("locks")),
+                        data_types={"process_files"}, selection={"calls_dir": str(calls_dir)}, workers=2,
+                        max_attempts=2, backoff=0.01, runner=_run)
+
+
+class TestOrchestrator:
+    def test_run(self, tmp_path):
+        summary = _get_orchestrator(tmp_path, ["a", "flaky", "broken"]).run()
+        assert summary == {DONE: 8, FAILED: 1}
+        calls = sorted(os.listdir(str(tmp_path.joinpath("calls"))))
+        assert "flaky_select__1" in calls and "flaky_select__2" not in calls
+        assert "broken_select__1" in calls and "broken_select__2" not in calls
+        assert len([c for c in calls if c.startswith("a_")]) == 4
+
+    def test_killed_worker(self, tmp_path):
+        orchestrator = _get_orchestrator(tmp_path, ["a", "killed"])
+        assert orchestrator.run() == {DONE: 4, FAILED: 1}
+        assert orchestrator.state.get_attempts(Task("killed", "select", "")) == 2
+
+    def test_resume(self, tmp_path):
+        _get_orchestrator(tmp_path, ["a"]).run()
+        # a task left running by a crash
+        state = TaskState(str(tmp_path.joinpath("tasks.db")))
+        state._set(Task("a", "predict", ""), status="running")
+        state.close()
+        calls = len(os.listdir(str(tmp_path.joinpath("calls"))))
+        assert _get_orchestrator(tmp_path, ["a"]).run() == {DONE: 4}
+        assert len(os.listdir(str(tmp_path.joinpath("calls")))) == calls + 1
+
+    def test_failed_features_block_predict(self, tmp_path):
+        state = TaskState(str(tmp_path.joinpath("tasks.db")))
+        state.add([Task("a", "select", ""), Task("a", "features", "1.0"), Task("a", "predict", "")])
+        state.done(Task("a", "select", ""), 1.0)
+        state.fail(Task("a", "features", "1.0"), "error", 1, 0)
+        state.close()
+        assert _get_orchestrator(tmp_path, ["a"]).run() == {DONE: 1, FAILED: 1, PENDING: 1}
@@ -0,0 +1,51 @@
+from create_test_env import SyntheticRepo
+from orchestrator import Orchestrator, Task, TaskState
+from planner import CostModel, get_makespan, get_repo_stats, get_state_observations
+
+
+def _get_stats(commits, tags, java_kb):
+    return {"commits": commits, "tags": tags, "java_files": 10, "java_kb": java_kb, "objects_kb": 100}
+
+
+class TestPlanner:
+    def test_repo_stats(self, tmp_path):
+        repo = SyntheticRepo(str(tmp_path.joinpath("synthetic")), "SYN", commits=30, files=4, tags=3).create()
+        stats = get_repo_stats(repo.path)
+        assert stats["commits"] == 30 and stats["tags"] == 3 and stats["java_files"] == 4
+        assert stats["java_kb"] > 0
+        assert stats["objects_kb"] > 0
+
+    def test_fit(self):
+        coefficients = [30.0, 0.02, 2.0, 0.1, 0.001]
+        observations = []
+        for commits, tags, java_kb, data_types, versions in [(1000, 10, 500, ["ck"], 2), (5000, 20, 800, ["ck"], 4),
+                                                             (20000, 50, 3000, ["process_files"], 2),
+                                                             (2000, 5, 100, ["ck", "process_files"], 3),
+                                                             (8000, 40, 1500, None, 0),
+                                                             (12000, 15, 2500, ["ck", "mood", "issues_files"], 2)]:
+            stats = _get_stats(commits, tags, java_kb)
+            observations.append((stats, data_types, versions,
+                                 CostModel(coefficients).estimate(stats, data_types, versions)))
+        model = CostModel.fit(observations)
+        assert [round(c, 6) for c in model.coefficients] == coefficients
+        assert CostModel.fit(observations[:2]).coefficients == CostModel.DEFAULT_COEFFICIENTS
+
+    def test_state_observations(self, tmp_path):
+        state = TaskState(str(tmp_path.joinpath("tasks.db")))
+        state.set_options({"data_types": ["ck"], "selection": {}})
+        state.add([Task("a", "select", ""), Task("a", "features", "1.0"), Task("a", "predict", ""),
+                   Task("b", "select", ""), Task("b", "features", "1.0")])
+        for task, seconds in [(Task("a", "select", ""), 10), (Task("a", "features", "1.0"), 20),
+                              (Task("a", "predict", ""), 5), (Task("b", "select", ""), 10)]:
+            state.done(task, seconds)
+        state.close()
+        stats = _get_stats(100, 1, 10)
+        assert get_state_observations(str(tmp_path.joinpath("tasks.db")), lambda p: stats) == \
+            [(stats, ["ck"], 1, 35.0)]
+
+    def test_longest_first(self, tmp_path):
+        assert get_makespan([7, 5, 4, 2], 2) == 9
+        orchestrator = Orchestrator(["a", "b", "c"], str(tmp_path.joinpath("tasks.db")),
+                                    str(tmp_path.joinpath("locks")), costs={"a": 1.0, "b": 30.0, "c": 5.0})
+        orchestrator.state.add(Task(p, "select", "") for p in orchestrator.projects)
+        assert [t.project for t in orchestrator._get_ready({})] == ["b", "c", "a"]
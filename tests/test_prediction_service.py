@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+import urllib.request
+
+import pandas as pd
+
+from classification_instance import ClassificationInstance
+from prediction_service import LRUCache, ModelStore, PredictionService, load_test, serve
+
+
+class _Store(ModelStore):
+    def __init__(self, path):
+        self.path = path
+
+    def get_model_path(self, project, level):
+        return os.path.join(self.path, "model.pkl")
+
+    def get_rows_path(self, project, level, version):
+        return os.path.join(self.path, version + "_aggregated_classes_.csv")
+
+    def get_versions(self, project):
+        return ["1.0"]
+
+
+def _get_service(tmp_path, batch_window=0.05):
+    training = pd.DataFrame({"lines": [1, 2, 3] * 3 + [50, 60, 70] * 3, "Bugged": [False] * 9 + [True] * 9})
+    testing = pd.DataFrame({"lines": [1, 80], "Bugged": [False, True]})
+    ci = ClassificationInstance(training, testing, ["a", "b"], str(tmp_path), save_all=False)
+    ci.fit()
+    ci.save_model()
+    pd.DataFrame({"File": ["src/A.java", "src/B.java"], "Class": ["A", "B"], "lines": [1, 80],
+                  "other": [0, 0]}).to_csv(str(tmp_path.joinpath("1.0_aggregated_classes_.csv")), index=False, sep=';')
+    return PredictionService(_Store(str(tmp_path)), cache_size=1, batch_window=batch_window)
+
+
+class TestPredictionService:
+    def test_query_batches(self, tmp_path):
+        service = _get_service(tmp_path)
+        answers = service.query([{"project": "p", "name": "src/A.java", "version": "1.0"},
+                                 {"project": "p", "name": "src/B.java", "version": "1.0"},
+                                 {"project": "p", "name": "src/C.java", "version": "1.0"}])
+        service.close()
+        assert answers[0]["probability"] < 0.5 < answers[1]["probability"]
+        assert "error" in answers[2]
+        metrics = service.get_metrics()
+        assert metrics["requests"] == 3 and metrics["errors"] == 1
+        assert metrics["batches"] == 1 and metrics["mean_batch_size"] == 3
+
+    def test_http(self, tmp_path):
+        service = _get_service(tmp_path, batch_window=0.001)
+        server = serve(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://{0}:{1}".format(*server.server_address)
+        try:
+            with urllib.request.urlopen(url + "/predict?project=p&version=1.0&name=src/B.java") as response:
+                assert json.loads(response.read())["probability"] > 0.5
+            result = load_test(url, [{"project": "p", "version": "1.0", "name": "src/A.java"}], 20, 4)
+            assert result["errors"] == 0 and result["requests"] == 20
+            with urllib.request.urlopen(url + "/metrics") as response:
+                assert json.loads(response.read())["requests"] == 21
+        finally:
+            server.shutdown()
+            service.close()
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.get_or_load("a", lambda: 1)
+        cache.get_or_load("b", lambda: 2)
+        cache.get_or_load("a", lambda: 0)
+        cache.get_or_load("c", lambda: 3)
+        assert list(cache.values) == ["a", "c"]
+        assert cache.get_stats() == {"size": 2, "hits": 1, "misses": 3}
+
+
+class TestSaveModel:
+    def test_stored_prediction_saves_missing_model(self, tmp_path):
+        def get_instance():
+            training = pd.DataFrame({"lines": [1, 2, 3] * 3 + [50, 60, 70] * 3, "Bugged": [False] * 9 + [True] * 9})
+            testing = pd.DataFrame({"lines": [1, 80], "Bugged": [False, True]})
+            return ClassificationInstance(training, testing, ["a", "b"], str(tmp_path))
+
+        get_instance().predict()
+        model_path = str(tmp_path.joinpath("model.pkl"))
+        os.remove(model_path)
+        ci = get_instance()
+        ci.predict()
+        features_list, classifier = ClassificationInstance.load_model(model_path)
+        assert features_list == ["lines"]
+        assert classifier.classes_.tolist() == [False, True]
@@ -0,0 +1,38 @@
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import cross_validate
+
+from scoring import MultiMetricScorer, get_scoring, confusion, mse_cost
+
+
+class TestMultiMetricScorer:
+    def _fit(self):
+        rng = np.random.RandomState(0)
+        X = rng.rand(200, 4)
+        y = X[:, 0] + rng.rand(200) * 0.5 > 0.8
+        return RandomForestClassifier(n_estimators=10, random_state=0).fit(X[:150], y[:150]), X[150:], y[150:]
+
+    def test_same_scores_as_get_scoring(self):
+        clf, X, y = self._fit()
+        scoring, _ = get_scoring()
+        scores = MultiMetricScorer()(clf, X, y)
+        assert set(scores) == set(scoring)
+        for name, scorer in scoring.items():
+            assert np.isclose(scores[name], scorer(clf, X, y)), name
+
+    def test_single_class(self):
+        clf, X, y = self._fit()
+        scores = MultiMetricScorer()(clf, X, np.zeros(len(y), dtype=bool))
+        assert np.isnan(scores['roc_auc'])
+        assert scores['tp'] == scores['fn'] == 0
+
+    def test_cross_validate(self):
+        clf, X, y = self._fit()
+        results = cross_validate(clf, X, y, cv=3, scoring=MultiMetricScorer(names=['f1', 'mse']))
+        assert len(results['test_f1']) == len(results['test_mse']) == 3
+
+    def test_functions(self):
+        assert confusion([False, True, True, False], [True, True, False, False]) == (1, 1, 1, 1)
+        # the labels against the probabilities of the true class (0.8) and of the other class (0.2)
+        y_proba = np.array([[0.2, 0.8], [0.8, 0.2]])
+        assert np.isclose(mse_cost([True, False], y_proba, fp_cost=2, fn_cost=1), (2 * 0.2 ** 2 + 0.8 ** 2) / 2)
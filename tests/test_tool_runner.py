@@ -0,0 +1,12 @@
+import sys
+
+from metrics.tool_runner import ToolRunner
+
+
+class TestToolRunner:
+    def test_long_lines(self):
+        result = ToolRunner("long_lines").run([sys.executable, "-c", "print('x' * 100000); print('end')"])
+        assert result.ok
+        with open(result.log_path) as f:
+            lines = f.read().splitlines()
+        assert lines[1:] == ["[out] " + "x" * 100000, "[out] end"]
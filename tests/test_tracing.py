@@ -0,0 +1,54 @@
+import json
+
+from tracing import Tracer, traced
+import tracing
+
+
+class TestTracer:
+    def test_records_spans(self, tmp_path):
+        tracer = Tracer(trace_dir=str(tmp_path))
+        tracer.enabled = True
+        with tracer.span("parse", "ingestion", version="1.0") as s:
+            s.set_rows(12)
+        assert s.duration >= 0
+        path = tracer.save(str(tmp_path.joinpath("trace.json")))
+        with open(path) as f:
+            events = json.load(f)["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X"]
+        assert len(spans) == 1
+        assert spans[0]["name"] == "parse"
+        assert spans[0]["cat"] == "ingestion"
+        assert spans[0]["args"]["rows"] == 12
+        assert spans[0]["args"]["version"] == "1.0"
+        assert "cpu_ms" in spans[0]["args"]
+
+    def test_saved_again_to_the_same_trace(self, tmp_path):
+        tracer = Tracer(trace_dir=str(tmp_path))
+        tracer.enabled = True
+        with tracer.span("select", "task"):
+            pass
+        path = tracer.save()
+        with tracer.span("features", "task"):
+            pass
+        assert tracer.save() == path
+        with open(path) as f:
+            assert [e["name"] for e in json.load(f)["traceEvents"] if e["ph"] == "X"] == ["select", "features"]
+
+    def test_disabled_tracer_only_times(self, tmp_path):
+        tracer = Tracer(trace_dir=str(tmp_path))
+        with tracer.span("parse") as s:
+            pass
+        assert s.duration is not None
+        assert tracer.events == []
+
+    def test_traced(self, tmp_path, monkeypatch):
+        tracer = Tracer(trace_dir=str(tmp_path))
+        tracer.enabled = True
+        monkeypatch.setattr(tracing, "_tracer", tracer)
+
+        @traced("double", "compute")
+        def double(x):
+            return x * 2
+
+        assert double(2) == 4
+        assert [e["name"] for e in tracer.events if e["ph"] == "X"] == ["double"]
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from training_set import TrainingSet
+
+
+class TestTrainingSet:
+    def test_iter_chunks(self, tmp_path):
+        training_set = TrainingSet.create(str(tmp_path.joinpath("training_set")))
+        training_set.append(pd.DataFrame({"name": ["a", "b", "c"], "lines": [1, 2, 3]}))
+        training_set.append(pd.DataFrame({"name": ["d", "e"], "lines": [4, 5], "bugged": [True, False]}))
+        chunks = list(training_set.iter_chunks(chunksize=2))
+        assert [len(c) for c in chunks] == [2, 2, 1]
+        df = pd.concat(chunks, ignore_index=True)
+        assert df["name"].tolist() == ["a", "b", "c", "d", "e"]
+        assert df["lines"].tolist() == [1, 2, 3, 4, 5]
+        assert df["bugged"].tolist() == [False, False, False, True, False]
+        assert training_set.read_column("name", 1, 3).tolist() == ["b", "c"]
+
+    def test_count_nonzero(self, tmp_path):
+        training_set = TrainingSet.create(str(tmp_path.joinpath("training_set")))
+        training_set.append(pd.DataFrame({"lines": [0, 2, 3], "smell": [False, False, True]}))
+        training_set.append(pd.DataFrame({"lines": [0.0, 1.5], "other": [0, 4]}))
+        training_set = TrainingSet(training_set.path)
+        assert [training_set.count_nonzero(c) for c in ["lines", "smell", "other"]] == [3, 1, 1]
+        del training_set.schema["lines"]["nonzeros"]
+        assert training_set.count_nonzero("lines") == 3
@@ -1,3 +1,5 @@
+import pandas as pd
+
 from metrics.version_metrics import Halstead, Checkstyle, Designite, CK, Mood, Bugged, JavaParserFileAnalyser
 from projects import ProjectName
 
@@ -51,4 +53,23 @@ class TestJavaParserFileAnalyser:
             "/Users/brunomachado/apache_repos/commons-lang",
             "commons-lang",
             "LANG_3_4_RC1")
-        extractor._get_methods_by_path_and_name()
\ No newline at end of file
+        extractor._get_methods_by_path_and_name()
+
+    def test_get_closest_ids(self):
+        extractor = JavaParserFileAnalyser.__new__(JavaParserFileAnalyser)
+        extractor.local_path = "/repo"
+        extractor._methods_index = None
+        extractor.parser_df = pd.DataFrame({
+            "File Path": ["src/A.java", "src/A.java", "src/A.java", "other/src/A.java", "src/B.java", "src/B.java"],
+            "Package Name": ["p"] * 6,
+            "Type Name": ["A", "A", "A", "A", "B", "B"],
+            "Method Name": ["a", "b", "c", "d", "e", "f"],
+            "Parameters": ["()"] * 6,
+            "Method Beginning Line": [10, 20, 30, 21, 5, 15]})
+        # the exact file and a file whose path contains it, a tie between two methods, no file and a line of 0
+        file_names = ["/repo/src/A.java", "/repo/src/A.java", "/repo/src/B.java", "/repo/src/C.java", "src/B.java"]
+        lines = [21, 15, 10, 3, 0]
+        ids = extractor.get_closest_ids(file_names, lines).tolist()
+        assert ids == [extractor.get_closest_id(f, l) for f, l in zip(file_names, lines)]
+        assert ids == ["other/src/a.java@p.a.d()", "src/a.java@p.a.a()", "src/b.java@p.b.e()", None,
+                       "src/b.java@p.b.e()"]
@@ -0,0 +1,60 @@
+from version_selector import AbstractSelectVersions, BinSelectVersion, VersionParser, VersionType
+
+
+class _Version(object):
+    def __init__(self, name):
+        self._name = name
+
+
+class _Tag(object):
+    def __init__(self, name, bugged_ratio):
+        self.version = _Version(name)
+        self.bugged_ratio = bugged_ratio
+
+
+class TestVersionParser:
+    def test_parse(self):
+        assert VersionParser.parse("release-3.4.1") == (VersionType.Micro, 3, 4, 1)
+        assert VersionParser.parse("commons-lang-2.6") == (VersionType.Minor, 2, 6, 0)
+        assert VersionParser.parse("1.12.3") == (VersionType.Micro, 1, 12, 3)
+        assert VersionParser.parse("v3.0") == (VersionType.Major, 3, 0, 0)
+        assert VersionParser.parse("RC10") == (VersionType.Major, 1, 0, 0)
+        assert VersionParser.parse("0.0") == (VersionType.Untyped, 0, 0, 0)
+        assert VersionParser.parse("trunk") == (VersionType.Untyped, 0, 0, 0)
+
+    def test_templates_priority(self):
+        # 1.2.3 is found before 2.3, the first template found wins and not the longest one
+        assert VersionParser.parse("1-2.3") == (VersionType.Minor, 2, 3, 0)
+        assert VersionParser.parse("1.2.3") == (VersionType.Micro, 1, 2, 3)
+
+    def test_define_version_type(self):
+        version = AbstractSelectVersions.define_version_type(_Version("lang_2_4_1"))
+        assert version.version_type == VersionType.Micro
+        assert (version.major, version.minor, version.micro) == (2, 4, 1)
+
+    def test_sort_key(self):
+        names = ["release-3.10", "3_4_RC10", "3_4_1", "3_4_RC2", "3.4"]
+        assert sorted(names, key=VersionParser.sort_key) == ["3.4", "3_4_1", "3_4_RC2", "3_4_RC10", "release-3.10"]
+
+
+class TestBinSelectVersion:
+    def _select(self, ratios, version_num, strict, step=(10, 20)):
+        tags = [_Tag("v{0}".format(i), r) for i, r in enumerate(ratios)]
+        selector = BinSelectVersion(None, tags, [], version_num, VersionType.Untyped, strict, start=(10,), step=step)
+        return selector._select_versions(None, [], tags), selector.selected_versions
+
+    def test_not_strict(self):
+        selected, configurations = self._select([0.12, 0.15, 0.0, 0.33, 0.18, 0.35], 2, False)
+        assert [c['versions'] for c in configurations] == [("v3", "v5"), ("v0", "v1", "v4")]
+        assert configurations[0] == {'start': 10, 'step': 10, 'versions': ("v3", "v5")}
+        assert selected == ("v3", "v5")
+
+    def test_strict_windows(self):
+        selected, configurations = self._select([0.12, 0.15, 0.11, 0.14], 2, True)
+        # the last window of a bin is not a configuration
+        assert [c['versions'] for c in configurations] == [("v1", "v2"), ("v0", "v1")]
+
+    def test_ratio_above_the_last_bin(self):
+        # the bins of start 10 and step 10 end at 90 + 10, a ratio of 1 is in none of them
+        selected, configurations = self._select([1.0, 1.0, 0.12, 0.15], 2, False, step=(10,))
+        assert [c['versions'] for c in configurations] == [("v2", "v3")]
@@ -0,0 +1,78 @@
+import os
+import signal
+import time
+from multiprocessing import Process
+
+from orchestrator import Task, DONE, FAILED
+from work_queue import WorkQueue, Worker
+
+
+def _run(task, options):
+    open(os.path.join(options["selection"]["calls_dir"], "_".join(task) + "_" + str(os.getpid())), "w").close()
+    time.sleep(0.05)
+    if task.stage == "select":
+        return [Task(task.project, "features", "1.0"), Task(task.project, "features", "2.0"),
+                Task(task.project, "predict", "")], None
+    return [], None
+
+
+def _run_killed(task, options):
+    # as the OOM killer would
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def _work(queue_path, owner, lock_dir):
+    Worker(WorkQueue(queue_path), owner, lease=5, poll=0.05, lock_dir=lock_dir, runner=_run).run()
+
+
+def _submit(tmp_path, projects):
+    calls_dir = tmp_path.joinpath("calls")
+    calls_dir.mkdir()
+    queue = WorkQueue(str(tmp_path.joinpath("queue.db")), max_attempts=2, backoff=0)
+    queue.submit(projects, {"process_files"}, {"calls_dir": str(calls_dir)})
+    return queue
+
+
+class TestWorkQueue:
+    def test_workers(self, tmp_path):
+        queue = _submit(tmp_path, ["a", "b", "c", "d"])
+        workers = [Process(target=_work, args=(queue.path, "w{0}".format(i), str(tmp_path.joinpath("locks"))))
+                   for i in range(3)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join(60)
+        assert queue.get_summary() == {DONE: 16}
+        calls = os.listdir(str(tmp_path.joinpath("calls")))
+        # every task ran once
+        assert len(calls) == 16
+        assert len({c.rsplit("_", 1)[0] for c in calls}) == 16
+
+    def test_claim(self, tmp_path):
+        queue = _submit(tmp_path, ["a"])
+        task = queue.claim("w1", 60)
+        assert task == Task("a", "select", "")
+        # a project runs one task at a time
+        assert queue.claim("w2", 60) is None
+        assert queue.complete(task, "w1", [Task("a", "features", "1.0"), Task("a", "predict", "")], 1.0)
+        assert queue.claim("w2", 60) == Task("a", "features", "1.0")
+        assert not queue.is_finished()
+
+    def test_expired_lease(self, tmp_path):
+        queue = _submit(tmp_path, ["a"])
+        task = queue.claim("dead", 0.01)
+        time.sleep(0.05)
+        assert queue.claim("w1", 60) == task
+        assert queue.get_attempts(task) == 1
+        # the result of the worker that lost the lease is dropped
+        assert not queue.complete(task, "dead", [], 1.0)
+        assert not queue.heartbeat(task, "dead", 60)
+        assert queue.heartbeat(task, "w1", 60)
+
+    def test_killed_task_is_released(self, tmp_path):
+        queue = _submit(tmp_path, ["a"])
+        worker = Worker(WorkQueue(queue.path, max_attempts=2, backoff=0), "w1", lease=5, poll=0.05,
+                        lock_dir=str(tmp_path.joinpath("locks")), runner=_run_killed)
+        assert worker.run() == 2
+        assert queue.get_summary() == {FAILED: 1}
+        assert queue.get_attempts(Task("a", "select", "")) == 2
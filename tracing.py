@@ -0,0 +1,231 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from config import Config
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_peak_rss():
+    """
+    The peak resident set size of the process in bytes, None where it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_rss():
+    """
+    The current resident set size of the process in bytes, None where it is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Span(object):
+    """
+    A timed stage: its wall and cpu time, the peak rss of the process at its end and the rows it handled.
+    """
+    __slots__ = ('name', 'category', 'args', 'start', 'cpu_start', 'duration', 'cpu')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.duration = None
+        self.cpu = None
+
+    def set_rows(self, rows):
+        self.args['rows'] = int(rows)
+        return self
+
+    def set(self, **args):
+        self.args.update(args)
+        return self
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+        self.cpu = time.process_time() - self.cpu_start
+        return self
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the stacks of the other threads every interval seconds, the counts are saved as folded stacks
+    (one "frame;frame;frame count" line per stack) for flame graph tools.
+    """
+    def __init__(self, interval):
+        super().__init__(name="tracing-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{0}:{1}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def save(self, path):
+        # a copy, the sampler may still be counting
+        stacks = Counter(dict(self.stacks))
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write("{0} {1}\n".format(stack, count))
+
+
+class Tracer(object):
+    """
+    Records the spans of the pipeline stages as chrome trace events (chrome://tracing, Perfetto), along with the
+    rss of the process as a counter. Spans are always timed, so their duration can be printed, but only recorded
+    when the tracer is enabled ([TRACING] Enabled or start).
+    """
+    def __init__(self, enabled=False, trace_dir=None, sample_interval=0.0):
+        self.enabled = False
+        self.trace_dir = trace_dir
+        self.sample_interval = sample_interval
+        self.events = []
+        self.saved = 0
+        self.path = None
+        self.profiler = None
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        if enabled:
+            self.start()
+
+    @staticmethod
+    def from_config():
+        config = Config().config
+        tracing = config['TRACING'] if 'TRACING' in config else {}
+        trace_dir = os.path.join(config['CACHING']['RepositoryData'], tracing.get('TraceDir', 'traces'))
+        return Tracer(str(tracing.get('Enabled', 'False')).lower() == 'true', str(Config.get_work_dir_path(trace_dir)),
+                      float(tracing.get('SampleInterval', '0')) / 1000.0)
+
+    def start(self, trace_dir=None, sample_interval=None):
+        """
+        Records the spans from now on, the trace is saved when the process exits.
+        """
+        if self.enabled:
+            return self
+        self.enabled = True
+        self.trace_dir = trace_dir or self.trace_dir
+        if sample_interval is not None:
+            self.sample_interval = sample_interval
+        if self.sample_interval:
+            self.profiler = SamplingProfiler(self.sample_interval)
+            self.profiler.start()
+        atexit.register(self._save_at_exit)
+        return self
+
+    def _save_at_exit(self):
+        if len(self.events) > self.saved or self.profiler is not None:
+            if self.profiler is not None:
+                self.profiler.stop()
+            print("trace saved to", self.save())
+            self.profiler = None
+
+    def _timestamp(self, t):
+        return (t - self.origin) * 1e6
+
+    def _add(self, event):
+        event.update({'pid': os.getpid(), 'tid': threading.get_ident()})
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category="stage", **args):
+        s = Span(name, category, args)
+        try:
+            yield s
+        finally:
+            s.end()
+            if self.enabled:
+                self._record(s)
+
+    def _record(self, s):
+        args = dict(s.args)
+        args['cpu_ms'] = round(s.cpu * 1000, 3)
+        peak = get_peak_rss()
+        if peak is not None:
+            args['peak_rss_mb'] = round(peak / float(1 << 20), 1)
+        self._add({'name': s.name, 'cat': s.category, 'ph': 'X', 'ts': self._timestamp(s.start),
+                   'dur': s.duration * 1e6, 'args': args})
+        rss = get_rss()
+        if rss is not None:
+            self._add({'name': 'rss', 'ph': 'C', 'ts': self._timestamp(s.start + s.duration),
+                       'args': {'rss_mb': round(rss / float(1 << 20), 1)}})
+
+    def save(self, path=None):
+        """
+        Writes the trace (and the folded stacks of the profiler next to it), returns its path. A process saved
+        several times, e.g. a pool worker after every task, rewrites the same trace.
+        """
+        if path is None:
+            if self.path is None:
+                os.makedirs(self.trace_dir, exist_ok=True)
+                self.path = os.path.join(self.trace_dir, "trace_{0}_{1}.json".format(time.strftime("%Y%m%d_%H%M%S"),
+                                                                                     os.getpid()))
+            path = self.path
+        with self._lock:
+            events = list(self.events)
+        self.saved = len(events)
+        with open(path, "w") as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'argv': " ".join(sys.argv)}}, f)
+        if self.profiler is not None:
+            self.profiler.save(os.path.splitext(path)[0] + ".folded")
+        return path
+
+
+_tracer = None
+
+
+def get_tracer():
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer.from_config()
+    return _tracer
+
+
+def span(name, category="stage", **args):
+    return get_tracer().span(name, category, **args)
+
+
+def traced(name=None, category="stage"):
+    """
+    A decorator recording every call of the function as a span of the process tracer.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            with span(name or fn.__qualname__, category):
+                return fn(*args, **kwargs)
+        return wrapped
+    return decorator
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import shutil
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fingerprint import Fingerprint
+
+
+class TrainingSet(object):
+    """
+    A training set kept on disk one file per column, so the frame of every version is appended as soon as it is
+    built instead of concatenating all the versions in memory.
+    Numeric and boolean columns are raw float64 files, the other columns json lines. The schema is the union of
+    the columns of the appended frames: a column missing from a frame is filled with 0 (False for non-numeric
+    columns, and integer columns become float), the way the concatenated frames were filled.
+    """
+    SCHEMA = "schema.json"
+    MATRICES = "matrices"
+    KINDS = ['bool', 'integer', 'number', 'text']
+    FILL = {'bool': 0.0, 'integer': 0.0, 'number': 0.0, 'text': False}
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.schema = {}
+        self.selected = None
+        if os.path.exists(os.path.join(self.path, self.SCHEMA)):
+            with open(os.path.join(self.path, self.SCHEMA)) as f:
+                schema = json.load(f)
+            self.rows = schema['rows']
+            self.schema = {c['name']: c for c in schema['columns']}
+
+    @staticmethod
+    def create(path):
+        """
+        An empty training set at path, removing the one already there.
+        """
+        shutil.rmtree(path, ignore_errors=True)
+        Path(path).mkdir(parents=True, exist_ok=True)
+        return TrainingSet(path)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, TrainingSet.SCHEMA))
+
+    @property
+    def columns(self):
+        if self.selected is not None:
+            return pd.Index(self.selected)
+        return pd.Index(list(self.schema.keys()))
+
+    def __len__(self):
+        return self.rows
+
+    def select(self, columns):
+        """
+        A view of the training set with only the given columns.
+        """
+        missing = set(columns) - set(self.schema)
+        if missing:
+            raise KeyError(missing)
+        training_set = TrainingSet(self.path)
+        training_set.selected = list(columns)
+        return training_set
+
+    def _save_schema(self):
+        with open(os.path.join(self.path, self.SCHEMA), "w") as f:
+            json.dump({'rows': self.rows, 'columns': list(self.schema.values())}, f)
+
+    @staticmethod
+    def _get_kind(series):
+        inferred = pd.api.types.infer_dtype(series, skipna=True)
+        if inferred == 'boolean':
+            return 'bool'
+        if inferred == 'integer':
+            return 'integer'
+        if inferred in ('floating', 'mixed-integer-float', 'decimal', 'empty'):
+            return 'number'
+        return 'text'
+
+    def _get_column_path(self, column):
+        return os.path.join(self.path, column['file'])
+
+    def _write(self, column, values):
+        if column['kind'] == 'text':
+            with open(self._get_column_path(column), "a") as f:
+                f.writelines(json.dumps(v) + "\n" for v in values)
+        else:
+            values = np.asarray(values, dtype=np.float64)
+            with open(self._get_column_path(column), "ab") as f:
+                values.tofile(f)
+            if 'nonzeros' in column:
+                column['nonzeros'] += int(np.count_nonzero(values))
+
+    def _write_fill(self, column, count):
+        if count:
+            if column['kind'] == 'integer':
+                column['kind'] = 'number'
+            self._write(column, [self.FILL[column['kind']]] * count if column['kind'] == 'text'
+                        else np.full(count, self.FILL[column['kind']]))
+
+    def _add_column(self, name, kind):
+        column = {'name': name, 'kind': kind, 'file': "c{0}.{1}".format(len(self.schema), 'txt' if kind == 'text' else 'f8'),
+                  'nonzeros': 0}
+        self.schema[name] = column
+        open(self._get_column_path(column), "w").close()
+        self._write_fill(column, self.rows)
+        return column
+
+    def _promote(self, column, kind):
+        # bool, integer and number columns share the float64 layout, only a text column has to be rewritten
+        if kind == 'text':
+            values = self.read_column(column['name']).tolist()
+            os.remove(self._get_column_path(column))
+            column['file'] = os.path.splitext(column['file'])[0] + ".txt"
+            column['kind'] = kind
+            open(self._get_column_path(column), "w").close()
+            self._write(column, values)
+        column['kind'] = kind
+
+    def append(self, df):
+        """
+        Appends the rows of df, adding its new columns to the schema.
+        """
+        assert self.selected is None
+        for name in df.columns:
+            kind = self._get_kind(df[name])
+            column = self.schema.get(name) or self._add_column(name, kind)
+            if self.KINDS.index(kind) > self.KINDS.index(column['kind']):
+                self._promote(column, kind)
+            values = df[name].tolist() if column['kind'] == 'text' else df[name].astype(np.float64).to_numpy()
+            self._write(column, values)
+        for name, column in self.schema.items():
+            if name not in df.columns:
+                self._write_fill(column, len(df))
+        self.rows += len(df)
+        self._save_schema()
+
+    def count_nonzero(self, name):
+        """
+        The nonzero values of a numeric column, counted as its values are appended.
+        """
+        column = self.schema[name]
+        if column['kind'] == 'text' or 'nonzeros' not in column:
+            # a text column, or a training set written before the counts
+            return int(np.count_nonzero(self.read_column(name).values))
+        return column['nonzeros']
+
+    def read_column(self, name, start=0, stop=None):
+        column = self.schema[name]
+        stop = self.rows if stop is None else min(stop, self.rows)
+        if self.rows == 0:
+            return pd.Series([], name=name, dtype={'text': object, 'bool': bool, 'integer': np.int64}.get(column['kind'], np.float64))
+        if column['kind'] == 'text':
+            with open(self._get_column_path(column)) as f:
+                values = [json.loads(line) for line in islice(f, start, stop)]
+            return pd.Series(values, name=name, dtype=object)
+        values = np.memmap(self._get_column_path(column), dtype=np.float64, mode='r', shape=(self.rows,))[start: stop]
+        if column['kind'] == 'bool':
+            return pd.Series(values.astype(bool), name=name)
+        if column['kind'] == 'integer':
+            return pd.Series(values.astype(np.int64), name=name)
+        return pd.Series(np.array(values), name=name)
+
+    def iter_chunks(self, chunksize=100000):
+        """
+        The rows chunksize at a time. A text column is read in one pass over its file, read_column would read its
+        lines again from the start for every chunk.
+        """
+        text = {name: open(self._get_column_path(self.schema[name])) for name in self.columns
+                if self.schema[name]['kind'] == 'text'}
+        try:
+            for start in range(0, self.rows, chunksize):
+                yield pd.DataFrame({name: np.array([json.loads(line) for line in islice(text[name], chunksize)],
+                                                   dtype=object) if name in text
+                                    else self.read_column(name, start, start + chunksize).values
+                                    for name in self.columns}, columns=self.columns)
+        finally:
+            for f in text.values():
+                f.close()
+
+    def read(self):
+        return pd.DataFrame({name: self.read_column(name).values for name in self.columns}, columns=self.columns)
+
+    def to_csv(self, path, sep=';', chunksize=100000):
+        pd.DataFrame(columns=self.columns).to_csv(path, index=False, sep=sep)
+        for chunk in self.iter_chunks(chunksize):
+            chunk.to_csv(path, index=False, header=False, sep=sep, mode='a')
+
+    def describe(self):
+        """
+        describe(include='all') of the training set, computed one column at a time.
+        """
+        described = [self.read_column(name).describe() for name in self.columns]
+        # the row order pandas gives the describe of a whole frame
+        names = []
+        for index in sorted((d.index for d in described), key=len):
+            for n in index:
+                if n not in names:
+                    names.append(n)
+        df = pd.concat([d.reindex(names) for d in described], axis=1, sort=False)
+        df.columns = self.columns
+        return df
+
+    def get_fingerprint(self):
+        """
+        The content of the (selected) columns, for Fingerprint.
+        """
+        fingerprint = Fingerprint(self.rows, [(c, self.schema[c]['kind']) for c in self.columns])
+        return fingerprint.update_files([self._get_column_path(self.schema[c]) for c in self.columns])
+
+    def to_matrix(self, columns, chunksize=100000):
+        """
+        The columns as a read-only float32 memory-mapped matrix, written once per set of columns.
+        """
+        text = [c for c in columns if self.schema[c]['kind'] == 'text']
+        if text:
+            raise ValueError("text columns {0} can not be used as features".format(text))
+        matrices_dir = os.path.join(self.path, self.MATRICES)
+        Path(matrices_dir).mkdir(parents=True, exist_ok=True)
+        key = hashlib.md5(json.dumps([self.rows] + list(columns)).encode()).hexdigest()
+        path = os.path.join(matrices_dir, key + ".f32")
+        shape = (self.rows, len(columns))
+        if not os.path.exists(path):
+            matrix = np.memmap(path + ".tmp", dtype=np.float32, mode='w+', shape=shape)
+            for start in range(0, self.rows, chunksize):
+                for j, name in enumerate(columns):
+                    matrix[start: start + chunksize, j] = self.read_column(name, start, start + chunksize).values
+            matrix.flush()
+            del matrix
+            os.replace(path + ".tmp", path)
+        return np.memmap(path, dtype=np.float32, mode='r', shape=shape)
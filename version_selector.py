@@ -2,7 +2,9 @@ import os
 import re
 import json
 from abc import ABC, abstractmethod
-from itertools import product
+from functools import lru_cache
+from itertools import accumulate, product
+import numpy as np
 import pandas as pd
 from config import Config
 from enum import Enum
@@ -35,6 +37,72 @@ class Version():
         return self.version_type == VersionType.Major
 
 
+class VersionParser(object):
+    """
+    Types version names by their last numbers, e.g. 3_4_RC1 or 3.11.2. The templates are tried in order and the
+    first one found anywhere in the name wins. They are compiled once into a single pattern of anchored lookaheads,
+    one per template, so the alternation keeps their priority, and every name is parsed once.
+    """
+    SEPARATORS = [r'\.', r'\-', r'\_']
+    TEMPLATE_BASE = [['([0-9])', '([0-9])([0-9])', '([0-9])$'], ['([0-9])', '([0-9])([0-9])$'],
+                     ['([0-9])', '([0-9])', '([0-9])([0-9])$'], ['([0-9])([0-9])', '([0-9])$'],
+                     ['([0-9])', '([0-9])', '([0-9])$'], ['([0-9])', '([0-9])$']]
+    TEMPLATES = [sep.join(base) for base, sep in product(TEMPLATE_BASE, SEPARATORS)] + \
+                ['([0-9])([0-9])([0-9])$', '([0-9])([0-9])$']
+    # .*? finds the leftmost match of a template, as re.findall did
+    PATTERN = re.compile("^(?:" + "|".join("(?=.*?" + t + ")" for t in TEMPLATES) + ")", re.DOTALL)
+    SIZES = [re.compile(t).groups for t in TEMPLATES]
+    # the index of the first group of every template in PATTERN
+    GROUPS = [1 + g for g in accumulate([0] + SIZES[:-1])]
+    NUMBERS = re.compile(r'[0-9]+|[^0-9]+', re.DOTALL)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def parse(name):
+        """
+        The (VersionType, major, minor, micro) of the version name.
+        """
+        match = VersionParser.PATTERN.match(name)
+        if not match:
+            return VersionType.Untyped, 0, 0, 0
+        first, size = next((g, n) for g, n in zip(VersionParser.GROUPS, VersionParser.SIZES)
+                           if match.group(g) is not None)
+        values = list(map(int, match.groups()[first - 1: first - 1 + size]))
+        if len(values) == 4:
+            major, minor1, minor2, micro = values
+            minor = 10 * minor1 + minor2
+        elif len(values) == 3:
+            major, minor, micro = values
+        else:
+            major, minor = values
+            micro = 0
+        if micro != 0:
+            return VersionType.Micro, major, minor, micro
+        elif minor != 0:
+            return VersionType.Minor, major, minor, 0
+        elif major != 0:
+            return VersionType.Major, major, 0, 0
+        return VersionType.Untyped, 0, 0, 0
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def sort_key(name):
+        """
+        A key ordering version names by their numbers, whatever their prefix and separators, then by their text
+        (so 3.4 < 3_4_1 < 3_4_RC2 < 3_4_RC10 < release-3.10).
+        """
+        parts = VersionParser.NUMBERS.findall(name)
+        numbers = tuple(int(p) for p in parts if p.isdigit())
+        return numbers, tuple((0, int(p), '') if p.isdigit() else (1, 0, p.lower()) for p in parts)
+
+    @staticmethod
+    def date_key(version):
+        """
+        Orders versions (versions.Version) by date, and versions of the same date by their names.
+        """
+        return version._commit._commit_date, VersionParser.sort_key(version._name)
+
+
 class AbstractSelectVersions(ABC):
     def __init__(self, repo, tags, versions, version_num, version_type, strict=True):
         self.repo = repo
@@ -55,35 +123,8 @@ class AbstractSelectVersions(ABC):
 
     @staticmethod
     def define_version_type(version):
-        separators = [r'\.', r'\-', r'\_']
-        template_base = [['([0-9])', '([0-9])([0-9])', '([0-9])$'], ['([0-9])', '([0-9])([0-9])$'],
-                         ['([0-9])', '([0-9])', '([0-9])([0-9])$'], ['([0-9])([0-9])', '([0-9])$'],
-                         ['([0-9])', '([0-9])', '([0-9])$'], ['([0-9])', '([0-9])$']]
-        templates = []
-        for base in template_base:
-            templates.extend(list(map(lambda sep: sep.join(base), separators)))
-        templates.extend(['([0-9])([0-9])([0-9])$', '([0-9])([0-9])$'])
-        for template in templates:
-            values = re.findall(template, version._name)
-            if values:
-                values = list(map(int, values[0]))
-                if len(values) == 4:
-                    major, minor1, minor2, micro = values
-                    minor = 10 * minor1 + minor2
-                elif len(values) == 3:
-                    major, minor, micro = values
-                else:
-                    major, minor = values
-                    micro = 0
-                if micro != 0:
-                    return Version(version, VersionType.Micro, major, minor, micro)
-                elif minor != 0:
-                    return Version(version, VersionType.Minor, major, minor)
-                elif major != 0:
-                    return Version(version, VersionType.Major, major)
-                else:
-                    return Version(version, VersionType.Untyped)
-        return Version(version, VersionType.Untyped)
+        version_type, major, minor, micro = VersionParser.parse(version._name)
+        return Version(version, version_type, major, minor, micro)
 
     def _get_versions_by_type(self, versions):
         if self.type == VersionType.Untyped:
@@ -115,33 +156,55 @@ class BinSelectVersion(AbstractSelectVersions):
         self.selected_config = selected_config
         self.selected_versions = list()
 
-    def _select_versions(self, repo, versions_by_type, tags):
-        relevant_tags = list(filter(lambda t: t.bugged_ratio, tags))
-        version_names = list(map(lambda x: x.version._name, relevant_tags))
-        only_version = []
-        for start, step in product(self.start, self.step):
-            bins = list(map(lambda x: list(), range(start, 100, step)))
-            for tag in relevant_tags:
-                if 100.0 * tag.bugged_ratio < start:
-                    continue
-                bins[int((100.0 * tag.bugged_ratio - start) / step)].append(tag.version._name)
+    def _get_bins(self, ratios):
+        """
+        Bins the bugged ratios for all the (start, step) configurations at once. Yields the start, the step and the
+        positions of the ratios in every non empty bin, in order.
+        """
+        configurations = list(product(self.start, self.step))
+        starts = np.array([start for start, _ in configurations], dtype=np.float64)[:, None]
+        steps = np.array([step for _, step in configurations], dtype=np.float64)[:, None]
+        sizes = np.array([len(range(start, 100, step)) for start, step in configurations])[:, None]
+        percents = 100.0 * np.asarray(ratios, dtype=np.float64)[None, :]
+        bins = np.floor((percents - starts) / steps).astype(np.int64)
+        # a ratio above the last bin of a configuration is not in any of its bins
+        valid = (percents >= starts) & (bins < sizes)
+        for (start, step), row, mask in zip(configurations, bins, valid):
+            positions = np.flatnonzero(mask)
+            if not len(positions):
+                continue
+            positions = positions[np.argsort(row[positions], kind='stable')]
+            _, first = np.unique(row[positions], return_index=True)
+            yield start, step, np.split(positions, first[1:])
+
+    def _get_configurations(self, names, ratios):
+        """
+        The configurations in the order they are found, without repeating versions.
+        """
+        seen = set()
+        for start, step, bins in self._get_bins(ratios):
             for bin_ in bins:
                 if len(bin_) < self.version_num:
                     continue
-                selected_versions = list(bin_)
                 if self.strict:
-                    for i in range(len(selected_versions) - self.version_num):
-                        versions = tuple(selected_versions[i: i + self.version_num])
-                        configuration = {'start': start, 'step': step, 'versions': versions}
-                        if len(configuration['versions']) > 1 and configuration['versions'] not in only_version:
-                            self.selected_versions.append(configuration)
-                            only_version.append(configuration['versions'])
+                    windows = (bin_[i: i + self.version_num] for i in range(len(bin_) - self.version_num))
                 else:
-                    configuration = {'start': start, 'step': step, 'versions': tuple(selected_versions)}
-                    if len(configuration['versions']) > 1 and configuration['versions'] not in only_version:
-                        self.selected_versions.append(configuration)
-                        only_version.append(configuration['versions'])
-        self.selected_versions = sorted(self.selected_versions, key=lambda v: sum(map(version_names.index, v['versions'])), reverse=True)
+                    windows = [bin_]
+                for window in windows:
+                    versions = tuple(names[i] for i in window)
+                    if len(versions) > 1 and versions not in seen:
+                        seen.add(versions)
+                        yield {'start': start, 'step': step, 'versions': versions}
+
+    def _select_versions(self, repo, versions_by_type, tags):
+        relevant_tags = list(filter(lambda t: t.bugged_ratio, tags))
+        version_names = list(map(lambda x: x.version._name, relevant_tags))
+        rank = {}
+        for i, name in enumerate(version_names):
+            rank.setdefault(name, i)
+        self.selected_versions.extend(self._get_configurations(version_names, [t.bugged_ratio for t in relevant_tags]))
+        # _store_versions writes all the configurations, so all of them are ranked
+        self.selected_versions = sorted(self.selected_versions, key=lambda v: sum(map(rank.get, v['versions'])), reverse=True)
         if len(self.selected_versions) <= self.selected_config:
             print("no versions found")
             exit(0)
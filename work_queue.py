@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import socket
+import time
+
+from config import Config
+from orchestrator import Task, TaskProcess, TaskState, STAGES, PENDING, RUNNING, DONE, FAILED, get_selection_options, \
+    run_task
+from projects import ProjectName
+
+
+class WorkQueue(TaskState):
+    """
+    The tasks of the orchestrator in a SQLite file on a shared filesystem, claimed by the workers of several hosts.
+    A worker leases the task it claims and renews the lease while it runs it. The task of a worker that died is
+    claimed again once its lease expires, which counts as a failed attempt. A project runs one task at a time and
+    a prediction waits for the features of its project, as in the orchestrator. Every change is a transaction on the
+    file, sqlite locks it, so no broker runs beside the workers.
+    """
+    def __init__(self, path, max_attempts=3, backoff=60.0):
+        super().__init__(path)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info("tasks")')]
+        with self.connection:
+            # a state of the orchestrator is a queue without leases
+            for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self.connection.execute("ALTER TABLE tasks ADD COLUMN {0} {1}".format(column, column_type))
+
+    @staticmethod
+    def get_path():
+        config = Config().config
+        orchestrator = config['ORCHESTRATOR'] if 'ORCHESTRATOR' in config else {}
+        queue_dir = Config.get_work_dir_path(os.path.join(config['CACHING']['RepositoryData'],
+                                                          orchestrator.get('QueueDir', 'work_queue')))
+        Config.assert_dir_exists(queue_dir)
+        return os.path.join(str(queue_dir), "queue.db")
+
+    def submit(self, projects, data_types=None, selection=None, costs=None):
+        """
+        Adds the selection of the projects, and the options every worker runs the tasks with. The projects of the
+        highest costs are claimed first.
+        """
+        options = {"data_types": sorted(data_types) if data_types else None,
+                   "selection": selection or get_selection_options(), "costs": costs or {}}
+        with self.connection:
+            self._set_options(options)
+            self._insert(Task(p, "select", "") for p in projects)
+
+    def get_stages(self):
+        return STAGES if self.get_options().get("data_types") else STAGES[:1]
+
+    def retry_failed(self):
+        with self.connection:
+            self.connection.execute("UPDATE tasks SET status = ?, attempts = 0, next_try = 0 WHERE status = ?",
+                                    (PENDING, FAILED))
+
+    def _get_open(self):
+        return [(Task(*row[:3]),) + tuple(row[3:]) for row in self.connection.execute(
+            "SELECT project, stage, version, status, next_try, lease_until FROM tasks WHERE status IN (?, ?, ?) "
+            "ORDER BY project, version", (PENDING, RUNNING, FAILED))]
+
+    def _expire(self, now):
+        for task, status, _, lease_until in self._get_open():
+            if status == RUNNING and lease_until is not None and lease_until < now:
+                print(f"WARN: the lease of {task.project} {task.stage} {task.version} expired")
+                self._update(task, dict(self._get_failure(task, "lease expired", self.max_attempts, self.backoff),
+                                        owner=None, lease_until=None))
+
+    def claim(self, owner, lease):
+        """
+        Leases the next task to run for lease seconds, None if no task can run now.
+        """
+        stages = self.get_stages()
+        costs = self.get_options().get("costs") or {}
+        # an immediate transaction, two workers never claim the same task
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._expire(time.time())
+            now = time.time()
+            tasks = self._get_open()
+            busy = {task.project for task, status, _, _ in tasks if status == RUNNING}
+            waiting = {task.project for task, _, _, _ in tasks if task.stage == "features"}
+            ready = [task for task, status, next_try, _ in tasks
+                     if status == PENDING and next_try <= now and task.stage in stages and task.project not in busy
+                     and not (task.stage == "predict" and task.project in waiting)]
+            if not ready:
+                self.connection.commit()
+                return None
+            task = min(ready, key=lambda t: (-costs.get(t.project, 0), STAGES.index(t.stage)))
+            self._update(task, {"status": RUNNING, "owner": owner, "lease_until": now + lease})
+            self.connection.commit()
+            return task
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+    def _if_owner(self, task, owner, values, added=()):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute("SELECT owner, status FROM tasks WHERE project = ? AND stage = ? AND "
+                                          "version = ?", tuple(task)).fetchone()
+            if row != (owner, RUNNING):
+                # the lease expired and another worker has the task
+                self.connection.rollback()
+                return False
+            self._insert(added)
+            self._update(task, values)
+            self.connection.commit()
+            return True
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+    def heartbeat(self, task, owner, lease):
+        """
+        Renews the lease of the task, False if the worker lost it.
+        """
+        return self._if_owner(task, owner, {"lease_until": time.time() + lease})
+
+    def complete(self, task, owner, added, seconds):
+        return self._if_owner(task, owner, {"status": DONE, "seconds": seconds, "error": None, "owner": None,
+                                            "lease_until": None}, added)
+
+    def release(self, task, owner, error):
+        return self._if_owner(task, owner, dict(self._get_failure(task, error, self.max_attempts, self.backoff),
+                                                owner=None, lease_until=None))
+
+    def is_finished(self):
+        """
+        True when no task runs and no pending task can run anymore.
+        """
+        stages = self.get_stages()
+        tasks = self._get_open()
+        if any(status == RUNNING for _, status, _, _ in tasks):
+            return False
+        failed = {task.project for task, status, _, _ in tasks if status == FAILED and task.stage == "features"}
+        return not any(status == PENDING and task.stage in stages and not (task.stage == "predict" and
+                                                                            task.project in failed)
+                       for task, status, _, _ in tasks)
+
+
+class Worker(object):
+    """
+    Claims the tasks of the queue and runs them one after another, every task in a new process, until the queue is
+    finished. The lease of a task is renewed every lease / 3 seconds while it runs.
+    """
+    def __init__(self, queue, owner=None, lease=600.0, poll=30.0, lock_dir=None, runner=run_task):
+        self.queue = queue
+        self.owner = owner or "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self.lease = lease
+        self.poll = poll
+        # the project locks are local, the leases keep the hosts apart
+        self.lock_dir = lock_dir or Config.get_temp_path("work_queue_locks")
+        self.runner = runner
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    @staticmethod
+    def from_config(queue_path=None, owner=None):
+        config = Config().config
+        orchestrator = config['ORCHESTRATOR'] if 'ORCHESTRATOR' in config else {}
+        queue = WorkQueue(queue_path or WorkQueue.get_path(), int(orchestrator.get('MaxAttempts', '3')),
+                          float(orchestrator.get('Backoff', '60')))
+        return Worker(queue, owner, float(orchestrator.get('Lease', '600')), float(orchestrator.get('Poll', '30')))
+
+    def run(self):
+        """
+        Returns the number of tasks the worker ran.
+        """
+        count = 0
+        options = dict(self.queue.get_options(), lock_path=os.path.join(self.lock_dir, "{0}.lock"))
+        while True:
+            task = self.queue.claim(self.owner, self.lease)
+            if task is None:
+                if self.queue.is_finished():
+                    return count
+                time.sleep(self.poll)
+                continue
+            # the heartbeats stop with the process of the task, even when it is killed, so its lease can expire
+            process = TaskProcess(self.runner, task, options)
+            while not process.wait(self.lease / 3.0):
+                if not self.queue.heartbeat(task, self.owner, self.lease):
+                    print(f"WARN: {self.owner} lost the lease of {task.project} {task.stage} {task.version}")
+            added, error = process.get()
+            count += 1
+            if error is None:
+                done = self.queue.complete(task, self.owner, added, time.time() - process.start)
+            else:
+                print(f"WARN: {task.project} {task.stage} {task.version} failed on {self.owner}:\n{error}")
+                done = self.queue.release(task, self.owner, error)
+            if not done:
+                print(f"WARN: the result of {task.project} {task.stage} {task.version} is dropped, "
+                      f"{self.owner} lost its lease")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distribute the extraction of the projects between the workers of '
+                                                 'several hosts, through a queue on a shared filesystem')
+    parser.add_argument('action', choices=['submit', 'work', 'status'],
+                        help='submit the projects, run a worker on this host or print the number of tasks by status')
+    parser.add_argument('-q', '--queue', dest='queue', action='store', default=None,
+                        help='the queue file, under the RepositoryData of config.ini by default')
+    parser.add_argument('-c', '--choose', dest='projects', nargs='+', default=None,
+                        help='the names of the projects to submit, all the projects by default')
+    parser.add_argument('-d', '--data_types_to_extract', dest='data_types', action='store', default=None,
+                        help='Json file of the data types to extract as features, only the versions are extracted '
+                             'without it')
+    parser.add_argument('-n', '--num_verions', dest='num_versions', action='store', default=3, type=int)
+    parser.add_argument('-t', '--versions_type', dest='versions_type', action='store', default="Untyped")
+    parser.add_argument('-s', '--select_verions', dest='select', action='store', default=0, type=int)
+    parser.add_argument('-r', '--retry_failed', dest='retry_failed', action='store_true',
+                        help='submit again the tasks that failed')
+    parser.add_argument('-l', '--longest_first', dest='longest_first', action='store_true',
+                        help='claim the projects the planner estimates the longest first')
+    args = parser.parse_args()
+    worker = Worker.from_config(args.queue)
+    if args.action == 'submit':
+        data_types = None
+        if args.data_types:
+            with open(args.data_types) as f:
+                data_types = set(json.loads(f.read()))
+        projects = args.projects or [p.name for p in ProjectName]
+        costs = None
+        if args.longest_first:
+            from planner import Planner
+            costs = Planner.from_config().get_costs(projects, data_types, args.num_versions)
+        worker.queue.submit(projects, data_types, get_selection_options(args.num_versions,
+                                                                        version_type=args.versions_type,
+                                                                        selected_config=args.select), costs)
+        if args.retry_failed:
+            worker.queue.retry_failed()
+    elif args.action == 'work':
+        print("{0} ran {1} tasks".format(worker.owner, worker.run()))
+    print("tasks:", ", ".join("{0} {1}".format(v, k) for k, v in sorted(worker.queue.get_summary().items())))
+
+
+if __name__ == "__main__":
+    main()